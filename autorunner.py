@@ -1,6 +1,17 @@
 import sys
+import json
+import time
+import uuid
+import select
+import socket
+import argparse
+import threading
 import subprocess
+import http.client
 from pathlib import Path
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import shutil
 
 def get_script_dir():
@@ -20,9 +31,12 @@ def ensure_dir(p):
 def docker_available():
     return shutil.which("docker") is not None
 
-def build_docker_command(base_dir, image, host_models_rel, host_data_rel, host_llm_rel, container_models, container_data, container_llm, host_port, container_port, use_gpus):
+def build_docker_command(base_dir, image, host_models_rel, host_data_rel, host_llm_rel, container_models, container_data, container_llm, host_port, container_port, use_gpus, name=None, env=None, interactive=True):
     """
     Construye el comando docker run
+    - name: nombre del contenedor (réplicas)
+    - env: variables que reemplazan las del .env del servidor
+    - interactive: -it (un solo contenedor en primer plano)
     """
     host_models = (base_dir / host_models_rel).resolve()
     host_data = (base_dir / host_data_rel).resolve()
@@ -33,7 +47,15 @@ def build_docker_command(base_dir, image, host_models_rel, host_data_rel, host_l
 
     cmd = [
         "docker", "run",
-        "--rm", "-it",
+        "--rm",
+    ]
+    if interactive:
+        cmd.append("-it")
+    if name:
+        cmd.extend(["--name", name])
+    for key, value in (env or {}).items():
+        cmd.extend(["-e", f"{key}={value}"])
+    cmd += [
         "-p", f"{host_port}:{container_port}",
         "-v", f"{str(host_models)}:{container_models}",
         "-v", f"{str(host_data)}:{container_data}",
@@ -48,14 +70,462 @@ def build_docker_command(base_dir, image, host_models_rel, host_data_rel, host_l
 
     return cmd
 
+# Router local: reparte las solicitudes entre réplicas del servidor
+HEALTH_INTERVAL_S = 2.0
+PROXY_TIMEOUT_S = 900
+BUFFER_MAX_BYTES = 8 * 1024 * 1024  # Cuerpos más grandes se reenvían por bloques (sin reintento)
+STICKY_TTL_S = 3600  # Afinidades sin uso se olvidan (igual que SESSION_IDLE_TTL_S del servidor)
+STICKY_MAX_KEYS = 10000
+RETRY_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}  # Idempotentes: se reintentan aunque ya se hayan enviado
+HOP_HEADERS = {"connection", "keep-alive", "transfer-encoding", "te", "trailer", "upgrade", "proxy-connection"}
+
+class Backend:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.outstanding = 0
+        self.served = 0
+        self.failures = 0
+        self.healthy = False
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def info(self):
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "served": self.served,
+            "failures": self.failures,
+        }
+
+class Router:
+    """
+    Balanceo por menor cantidad de solicitudes en curso entre las réplicas sanas.
+    - Health check periódico (/health) y failover: si una réplica no acepta la conexión
+      se marca caída y la solicitud se reintenta en otra
+    - Afinidad: las sesiones (/v1/sessions/{id}) y cada colección RAG (/v1/chat/rag,
+      /v1/rag/*) quedan fijas en una réplica, porque su estado vive en memoria. Las afinidades
+      sin uso por sticky_ttl_s se olvidan (como máximo sticky_max_keys, LRU)
+    """
+    def __init__(self, backends, health_interval_s=HEALTH_INTERVAL_S, sticky_ttl_s=STICKY_TTL_S, sticky_max_keys=STICKY_MAX_KEYS):
+        self.backends = backends
+        self.health_interval_s = health_interval_s
+        self.sticky_ttl_s = sticky_ttl_s
+        self.sticky_max_keys = sticky_max_keys
+        self.lock = threading.Lock()
+        self.sticky = OrderedDict()  # clave -> (réplica, último uso), orden LRU
+        self._stop = threading.Event()
+
+    def pick(self, key=None, exclude=()):
+        with self.lock:
+            backend = self._sticky_get(key) if key else None
+            if backend is None or not backend.healthy or backend in exclude:
+                candidates = [b for b in self.backends if b.healthy and b not in exclude]
+                if not candidates:
+                    # Sin réplicas sanas conocidas: probar igual (p. ej. antes del primer health check)
+                    candidates = [b for b in self.backends if b not in exclude]
+                if not candidates:
+                    return None
+                backend = min(candidates, key=lambda b: (b.outstanding, b.served))
+                if key:
+                    self._sticky_set(key, backend)
+            backend.outstanding += 1
+            return backend
+
+    def _sticky_get(self, key):
+        item = self.sticky.get(key)
+        if item is None:
+            return None
+        backend, _ = item
+        self._sticky_set(key, backend)
+        return backend
+
+    def _sticky_set(self, key, backend):
+        now = time.monotonic()
+        self.sticky[key] = (backend, now)
+        self.sticky.move_to_end(key)
+        # Podar desde el más antiguo: vencidos por TTL y el exceso de claves
+        while self.sticky:
+            _, (_, last) = next(iter(self.sticky.items()))
+            if len(self.sticky) <= self.sticky_max_keys and now - last <= self.sticky_ttl_s:
+                break
+            self.sticky.popitem(last=False)
+
+    def release(self, backend, failed=False):
+        with self.lock:
+            backend.outstanding -= 1
+            if failed:
+                backend.failures += 1
+                backend.healthy = False
+            else:
+                backend.served += 1
+
+    def bind(self, key, backend):
+        with self.lock:
+            self._sticky_set(key, backend)
+
+    def unbind(self, key):
+        with self.lock:
+            self.sticky.pop(key, None)
+
+    def check(self, backend):
+        conn = http.client.HTTPConnection(backend.host, backend.port, timeout=2)
+        try:
+            conn.request("GET", "/health")
+            ok = conn.getresponse().status == 200
+        except OSError:
+            ok = False
+        finally:
+            conn.close()
+        if ok != backend.healthy:
+            print(f"[ROUTER] {backend.url} {'disponible' if ok else 'caído'}")
+        backend.healthy = ok
+        return ok
+
+    def start_health_checks(self):
+        def _loop():
+            while not self._stop.is_set():
+                for backend in self.backends:
+                    self.check(backend)
+                self._stop.wait(self.health_interval_s)
+
+        threading.Thread(target=_loop, name="router-health", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def status(self):
+        with self.lock:
+            return {
+                "backends": [b.info() for b in self.backends],
+                "sticky_keys": len(self.sticky),
+            }
+
+def form_field(headers, body, name):
+    """Valor de un campo de formulario (urlencoded o multipart) en un cuerpo ya leído, o None"""
+    ctype = headers.get("Content-Type") or ""
+    if not body:
+        return None
+    if ctype.startswith("application/x-www-form-urlencoded"):
+        values = parse_qs(body.decode("latin-1")).get(name)
+        return values[0] if values else None
+    if ctype.startswith("multipart/form-data") and "boundary=" in ctype:
+        boundary = ctype.split("boundary=", 1)[1].split(";", 1)[0].strip().strip('"')
+        for part in body.split(b"--" + boundary.encode("latin-1")):
+            head, sep, value = part.partition(b"\r\n\r\n")
+            if not sep:
+                continue
+            head = head.decode("latin-1").lower()
+            # Solo campos de texto (los archivos llevan filename)
+            if f'name="{name}"' in head and "filename=" not in head:
+                if value.endswith(b"\r\n"):
+                    value = value[:-2]
+                return value.decode("utf-8", "replace")
+    return None
+
+def sticky_key(method, path, query, headers, body=None):
+    """Clave de afinidad de la solicitud, o None si puede ir a cualquier réplica"""
+    parts = path.strip("/").split("/")
+    if parts[:2] == ["v1", "sessions"] and len(parts) >= 3:
+        return f"session:{parts[2]}"
+    if parts[:2] == ["v1", "requests"] and len(parts) >= 3:
+        return f"request:{parts[2]}"
+    if path.startswith("/v1/chat/rag") or path.startswith("/v1/rag/"):
+        # La colección va en el formulario; con cuerpos no almacenados (> BUFFER_MAX_BYTES)
+        # el cliente puede indicarla en el header X-Collection o la query
+        collection = (
+            headers.get("X-Collection")
+            or (query.get("collection") or [None])[0]
+            or form_field(headers, body, "collection")
+            or "default"
+        )
+        return f"collection:{collection}"
+    return None
+
+class RouterHandler(BaseHTTPRequestHandler):
+    router = None
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == "/router/status":
+            return self._reply(200, self.router.status())
+        self._proxy()
+
+    def do_POST(self):
+        self._proxy()
+
+    def do_PUT(self):
+        self._proxy()
+
+    def do_DELETE(self):
+        self._proxy()
+
+    def do_OPTIONS(self):
+        self._proxy()
+
+    def _reply(self, status, obj):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _proxy(self):
+        self._client_gone = False
+        url = urlsplit(self.path)
+        if "Transfer-Encoding" in self.headers:
+            return self._reply(411, {"detail": "Se requiere Content-Length"})
+
+        length = int(self.headers.get("Content-Length") or 0)
+        body = None
+        if length <= BUFFER_MAX_BYTES:
+            body = self.rfile.read(length) if length else b""
+        key = sticky_key(self.command, url.path, parse_qs(url.query), self.headers, body)
+
+        # Las generaciones con X-Request-Id se pueden cancelar a través del router
+        request_id = self.headers.get("X-Request-Id")
+
+        tried = []
+        while True:
+            backend = self.router.pick(key, exclude=tried)
+            if backend is None:
+                return self._reply(502, {"detail": "No hay réplicas disponibles"})
+            conn = http.client.HTTPConnection(backend.host, backend.port, timeout=PROXY_TIMEOUT_S)
+            try:
+                conn.connect()
+            except OSError:
+                conn.close()
+                self.router.release(backend, failed=True)
+                tried.append(backend)
+                continue
+
+            if request_id:
+                self.router.bind(f"request:{request_id}", backend)
+            try:
+                resp = self._forward(conn, body, length)
+            except OSError as e:
+                conn.close()
+                self.router.release(backend, failed=True)
+                tried.append(backend)
+                # Un POST ya enviado pudo ejecutarse en la réplica (p. ej. una subida): no se repite
+                if body is not None and not self._client_gone and self.command in RETRY_METHODS:
+                    continue
+                if not self._client_gone:
+                    self._reply(502, {"detail": f"Error en la réplica {backend.url}: {e}"})
+                return
+            finally:
+                if request_id:
+                    self.router.unbind(f"request:{request_id}")
+
+            try:
+                self._relay(resp, backend)
+            except OSError:
+                pass
+            finally:
+                conn.close()
+                self.router.release(backend)
+            return
+
+    def _forward(self, conn, body, length):
+        conn.putrequest(self.command, self.path, skip_host=True, skip_accept_encoding=True)
+        for name, value in self.headers.items():
+            if name.lower() not in HOP_HEADERS:
+                conn.putheader(name, value)
+        conn.putheader("Connection", "close")
+        conn.endheaders()
+        if body is None:
+            # Subidas grandes: copiar por bloques sin guardarlas en memoria
+            remaining = length
+            while remaining > 0:
+                chunk = self.rfile.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    break
+                conn.send(chunk)
+                remaining -= len(chunk)
+        elif body:
+            conn.send(body)
+
+        # Si el cliente se desconecta, cerrar la conexión con la réplica para que aborte la generación
+        done = threading.Event()
+        watcher = threading.Thread(target=self._watch_client, args=(conn, done), daemon=True)
+        watcher.start()
+        try:
+            return conn.getresponse()
+        finally:
+            done.set()
+
+    def _watch_client(self, conn, done):
+        while not done.is_set():
+            try:
+                readable, _, _ = select.select([self.connection], [], [], 0.25)
+                if readable and not self.connection.recv(1, socket.MSG_PEEK):
+                    self._client_gone = True
+                    conn.sock.shutdown(socket.SHUT_RDWR)
+                    return
+            except (OSError, ValueError, AttributeError):
+                return
+
+    def _relay(self, resp, backend):
+        # Recordar la réplica de las sesiones nuevas y olvidar las eliminadas
+        body = None
+        path = urlsplit(self.path).path.rstrip("/")
+        if self.command == "POST" and path == "/v1/sessions":
+            body = resp.read()
+            try:
+                self.router.bind(f"session:{json.loads(body)['id']}", backend)
+            except (ValueError, KeyError, TypeError):
+                pass
+        elif self.command == "DELETE" and path.startswith("/v1/sessions/") and resp.status in (200, 404):
+            self.router.unbind(sticky_key(self.command, path, {}, self.headers))
+
+        self.send_response(resp.status, resp.reason)
+        for name, value in resp.getheaders():
+            if name.lower() not in HOP_HEADERS:
+                self.send_header(name, value)
+        self.send_header("Connection", "close")
+        self.end_headers()
+        if body is not None:
+            self.wfile.write(body)
+            return
+        while True:
+            chunk = resp.read(64 * 1024)
+            if not chunk:
+                break
+            self.wfile.write(chunk)
+
+def start_router(port, backends, host="127.0.0.1"):
+    router = Router(backends)
+    handler = type("Handler", (RouterHandler,), {"router": router})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    router.start_health_checks()
+    return router, server
+
+# Réplicas falsas para probar el router en una sola máquina (sin Docker ni GPU)
+class StubBackendHandler(BaseHTTPRequestHandler):
+    delay_s = 0.05
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _reply(self, status, obj):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            return self._reply(200, {"status": "ok"})
+        self._reply(200, {"backend": self.server.server_port, "path": self.path})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        if self.path.rstrip("/") == "/v1/sessions":
+            return self._reply(200, {"id": uuid.uuid4().hex, "backend": self.server.server_port})
+        time.sleep(self.delay_s)
+        self._reply(200, {"backend": self.server.server_port, "path": self.path})
+
+    do_PUT = do_POST
+    do_DELETE = do_GET
+
+def start_stub_backend(port, delay_s, host="127.0.0.1"):
+    handler = type("StubHandler", (StubBackendHandler,), {"delay_s": delay_s})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name=f"stub-{port}", daemon=True).start()
+    return server
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Lanza el servidor LLM (una o varias réplicas con router local)")
+    ap.add_argument("--replicas", type=int, default=1, help="Cantidad de réplicas (más de 1 inicia el router)")
+    ap.add_argument("--port", type=int, default=8000, help="Puerto del servidor (o del router con varias réplicas)")
+    ap.add_argument("--gpu-util", type=float, default=0.8, help="Fracción de GPU total, se reparte entre las réplicas")
+    ap.add_argument("--stub", action="store_true", help="Réplicas falsas en proceso (sin Docker ni GPU)")
+    ap.add_argument("--stub-delay", type=float, default=0.05, help="Latencia de las réplicas falsas (s)")
+    return ap.parse_args(argv)
+
+def run_replicas(base_dir, args):
+    """
+    Inicia N réplicas en puertos consecutivos (port+1 ... port+N) y el router en port.
+    """
+    ports = [args.port + 1 + i for i in range(args.replicas)]
+    procs, names, stubs = [], [], []
+
+    if args.stub:
+        stubs = [start_stub_backend(p, args.stub_delay) for p in ports]
+    else:
+        for i, port in enumerate(ports):
+            name = f"llm-server-{i}"
+            cmd = build_docker_command(
+                base_dir=base_dir,
+                image="llm-server",
+                host_models_rel="models",
+                host_data_rel="data",
+                host_llm_rel="llm",
+                container_models="/models",
+                container_data="/data",
+                container_llm="/app",
+                host_port=port,
+                container_port=8000,
+                use_gpus=True,
+                name=name,
+                env={
+                    # Las réplicas comparten la GPU, el límite de LangSearch y /data: solo la
+                    # primera reconstruye el índice RAG al iniciar
+                    "GPU_UTIL": round(args.gpu_util / args.replicas, 3),
+                    "LANGSEARCH_LIMITER": "shared",
+                    "RAG_WRITER": "True" if i == 0 else "False",
+                },
+                interactive=False,
+            )
+            print(f"[!] Réplica {i}: " + " ".join(cmd))
+            procs.append(subprocess.Popen(cmd))
+            names.append(name)
+
+    router, server = start_router(args.port, [Backend("127.0.0.1", p) for p in ports])
+    print(f"[!] Router en http://127.0.0.1:{args.port} -> {', '.join(str(p) for p in ports)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        router.stop()
+        server.server_close()
+        for stub in stubs:
+            stub.shutdown()
+        for name in names:
+            subprocess.run(["docker", "stop", name], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        for proc in procs:
+            proc.wait()
+
 def main():
+    args = parse_args()
     base_dir = get_script_dir()
     print(f"[!] Carpeta base detectada: {base_dir}")
 
+    if args.stub:
+        run_replicas(base_dir, args)
+        return
+
     if not docker_available():
         print("Error: No se encontró 'docker' en el PATH. Asegúrate de que Docker esté instalado y accesible desde la línea de comandos.")
         sys.exit(1)
 
+    if args.replicas > 1:
+        run_replicas(base_dir, args)
+        return
+
     # Ejecutando docker
     image_name = "llm-server"
     cmd = build_docker_command(
@@ -67,7 +537,7 @@ def main():
         container_models="/models",
         container_data="/data",
         container_llm="/app",
-        host_port=8000,
+        host_port=args.port,
         container_port=8000,
         use_gpus=True
     )
@@ -0,0 +1,98 @@
+"""
+Benchmark de backends de embedding en CPU (fp32 vs int8 dinámico).
+
+Mide chunks/s al indexar (batch como RAGIndexer.embed), latencia por consulta individual
+(como RAGRetriever.retrieve), similitud coseno contra fp32 y recall@k de la búsqueda
+con consultas int8 sobre el índice fp32 (caso de un índice existente).
+
+Uso (desde la carpeta llm/):
+    python -m bench.bench_embeddings --model /models/multilingual-e5-base --chunks 2000 --threads 8
+"""
+import json, time, random, argparse
+
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+
+from rag.embeddings import set_threads, quantize_int8, parity_check
+
+_WORDS = (
+    "datos índice modelo consulta documento vector texto servidor memoria caché respuesta fuente "
+    "contrato plazo informe ventas región paciente tratamiento artículo requisito acceso usuario"
+).split()
+
+def synthetic_chunks(n, words, seed):
+    # Chunks del tamaño típico del indexador (~800 caracteres)
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(_WORDS) for _ in range(words)) for _ in range(n)]
+
+def embed_throughput(model, chunks, batch_size):
+    t0 = time.perf_counter()
+    emb = model.encode(chunks, batch_size=batch_size, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False)
+    secs = time.perf_counter() - t0
+    return emb.astype("float32"), round(len(chunks) / secs, 2)
+
+def query_latency(model, queries):
+    lat = []
+    out = []
+    for q in queries:
+        t0 = time.perf_counter()
+        out.append(model.encode([q], normalize_embeddings=True)[0])
+        lat.append((time.perf_counter() - t0) * 1000.0)
+    return np.asarray(out, dtype="float32"), {
+        "mean_ms": round(float(np.mean(lat)), 2),
+        "p50_ms": round(float(np.percentile(lat, 50)), 2),
+        "p95_ms": round(float(np.percentile(lat, 95)), 2),
+    }
+
+def recall_at_k(index_emb, ref_q, cand_q, k):
+    truth = np.argsort(-(ref_q @ index_emb.T), axis=1)[:, :k]
+    found = np.argsort(-(cand_q @ index_emb.T), axis=1)[:, :k]
+    return round(sum(len(set(t) & set(f)) for t, f in zip(truth, found)) / float(len(truth) * k), 4)
+
+def main():
+    ap = argparse.ArgumentParser(description="Backends de embedding en CPU: fp32 vs int8")
+    ap.add_argument("--model", required=True)
+    ap.add_argument("--chunks", type=int, default=2000)
+    ap.add_argument("--chunk-words", type=int, default=120)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--batch-size", type=int, default=64)
+    ap.add_argument("--threads", type=int, default=0, help="Hilos de PyTorch (0 = por defecto)")
+    ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--json", default=None, help="Guardar resultados en este archivo")
+    args = ap.parse_args()
+
+    set_threads(args.threads)
+    chunks = synthetic_chunks(args.chunks, args.chunk_words, args.seed)
+    queries = synthetic_chunks(args.queries, 8, args.seed + 1)
+
+    fp32 = SentenceTransformer(args.model, device="cpu")
+    int8 = quantize_int8(fp32)
+
+    results = {"threads": torch.get_num_threads(), "chunks": args.chunks, "queries": args.queries}
+    index_emb = None
+    ref_q = None
+    for name, model in (("fp32", fp32), ("int8", int8)):
+        model.encode(queries[:8], show_progress_bar=False)  # Calentar
+        emb, chunks_s = embed_throughput(model, chunks, args.batch_size)
+        q, latency = query_latency(model, queries)
+        if index_emb is None:
+            index_emb, ref_q = emb, q
+        results[name] = {"chunks_per_s": chunks_s, "query": latency}
+        print(f"[BENCH] {name}: {chunks_s} chunks/s, consulta p50 {latency['p50_ms']} ms, p95 {latency['p95_ms']} ms")
+
+    results["int8"]["parity"] = parity_check(fp32, int8, chunks[:256] + queries[:64])
+    results["int8"]["recall_at_k"] = recall_at_k(index_emb, ref_q, q, args.k)
+    results["speedup"] = {
+        "indexing": round(results["int8"]["chunks_per_s"] / results["fp32"]["chunks_per_s"], 2),
+        "query_p50": round(results["fp32"]["query"]["p50_ms"] / results["int8"]["query"]["p50_ms"], 2),
+    }
+    print(f"[BENCH] int8 vs fp32: coseno {json.dumps(results['int8']['parity'])}, recall@{args.k} {results['int8']['recall_at_k']}, speedup {json.dumps(results['speedup'])}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
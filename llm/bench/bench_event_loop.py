@@ -0,0 +1,110 @@
+"""
+Prueba de concurrencia del servidor: latencia de /v1/chat/completions y /health
+sin carga y con solicitudes /v1/chat/rag en curso (subida + reindex + recuperación).
+
+Si el pipeline RAG bloqueara el event loop, la latencia del resto de endpoints
+crecería con cada solicitud RAG en vuelo. Con el pipeline no bloqueante debe
+mantenerse estable.
+
+Uso (servidor ya levantado, p. ej. con LLM_ENGINE=stub para CPU):
+    python -m bench.bench_event_loop --url http://localhost:8000 --rag-concurrency 4
+"""
+import json, time, asyncio, argparse
+
+import httpx
+import numpy as np
+
+def _summary(lat):
+    if not lat:
+        return {"n": 0}
+    return {
+        "n": len(lat),
+        "p50_ms": round(float(np.percentile(lat, 50)), 2),
+        "p95_ms": round(float(np.percentile(lat, 95)), 2),
+        "max_ms": round(float(np.max(lat)), 2),
+    }
+
+async def probe(client, path, payload, duration_s, interval_s):
+    # Solicitudes secuenciales al endpoint durante duration_s, devuelve latencias en ms
+    lat = []
+    end = time.perf_counter() + duration_s
+    while time.perf_counter() < end:
+        t0 = time.perf_counter()
+        if payload is None:
+            r = await client.get(path)
+        else:
+            r = await client.post(path, json=payload)
+        r.raise_for_status()
+        lat.append((time.perf_counter() - t0) * 1000.0)
+        await asyncio.sleep(interval_s)
+    return lat
+
+async def rag_worker(client, i, stop, collection, doc_kb):
+    # Sube un documento nuevo en cada iteración para forzar reindex + recuperación + generación
+    done = 0
+    while not stop.is_set():
+        text = f"documento {i}-{done} " + " ".join(f"palabra{j}" for j in range(doc_kb * 100))
+        chat = {"messages": [{"role": "user", "content": f"¿Qué dice el documento {i}-{done}?"}], "max_tokens": 32}
+        r = await client.post(
+            "/v1/chat/rag",
+            data={"sync": "true", "collection": collection, "chat": json.dumps(chat)},
+            files={"file0": (f"bench_{i}_{done}.txt", text.encode("utf-8"), "text/plain")},
+        )
+        r.raise_for_status()
+        done += 1
+    return done
+
+async def run(args):
+    chat = {"messages": [{"role": "user", "content": "Hola"}], "max_tokens": args.max_tokens}
+    async with httpx.AsyncClient(base_url=args.url, timeout=600) as client:
+        results = {}
+
+        # Fase 1: sin carga
+        base_chat, base_health = await asyncio.gather(
+            probe(client, "/v1/chat/completions", chat, args.duration, args.interval),
+            probe(client, "/health", None, args.duration, args.interval),
+        )
+        results["idle"] = {"chat_completions": _summary(base_chat), "health": _summary(base_health)}
+
+        # Fase 2: con solicitudes RAG en curso
+        stop = asyncio.Event()
+        workers = [
+            asyncio.create_task(rag_worker(client, i, stop, args.collection, args.doc_kb))
+            for i in range(args.rag_concurrency)
+        ]
+        await asyncio.sleep(args.warmup)
+        load_chat, load_health = await asyncio.gather(
+            probe(client, "/v1/chat/completions", chat, args.duration, args.interval),
+            probe(client, "/health", None, args.duration, args.interval),
+        )
+        stop.set()
+        rag_done = sum(await asyncio.gather(*workers))
+        results["rag_load"] = {
+            "rag_concurrency": args.rag_concurrency,
+            "rag_completed": rag_done,
+            "chat_completions": _summary(load_chat),
+            "health": _summary(load_health),
+        }
+
+    for phase, r in results.items():
+        print(f"[BENCH] {phase}: " + json.dumps(r, ensure_ascii=False))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+def main():
+    ap = argparse.ArgumentParser(description="Latencia de endpoints con solicitudes RAG en curso")
+    ap.add_argument("--url", default="http://localhost:8000")
+    ap.add_argument("--rag-concurrency", type=int, default=4)
+    ap.add_argument("--collection", default="bench")
+    ap.add_argument("--doc-kb", type=int, default=8, help="Tamaño aproximado de cada documento subido (KB)")
+    ap.add_argument("--duration", type=float, default=10.0, help="Segundos de medición por fase")
+    ap.add_argument("--warmup", type=float, default=1.0)
+    ap.add_argument("--interval", type=float, default=0.05)
+    ap.add_argument("--max-tokens", type=int, default=16)
+    ap.add_argument("--json", default=None, help="Guardar resultados en este archivo")
+    asyncio.run(run(ap.parse_args()))
+
+if __name__ == "__main__":
+    main()
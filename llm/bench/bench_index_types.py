@@ -0,0 +1,109 @@
+"""
+Benchmark de almacenamiento de vectores RAG (flat vs fp16 vs sq8 vs pq).
+
+Mide tiempo de construcción, tamaño del índice, latencia por consulta y recall@k
+contra el índice float32 (IndexFlatIP) actual.
+
+Uso (desde la carpeta llm/):
+    python -m bench.bench_index_types --n 50000 --dim 768 --k 5
+    python -m bench.bench_index_types --from-index /data/rag_index.faiss
+"""
+import argparse, json, time
+
+import faiss
+import numpy as np
+
+from rag.rag_index import INDEX_TYPES, build_index, index_nbytes
+
+def synthetic_embeddings(n, dim, clusters, seed):
+    """
+    Embeddings normalizados agrupados en clusters (más realistas que ruido uniforme).
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype("float32")
+    labels = rng.integers(0, clusters, size=n)
+    emb = centers[labels] + 0.35 * rng.standard_normal((n, dim)).astype("float32")
+    faiss.normalize_L2(emb)
+    return emb
+
+def load_embeddings(path):
+    # Recuperar vectores float32 de un índice plano existente
+    index = faiss.read_index(path)
+    return index.reconstruct_n(0, index.ntotal).astype("float32")
+
+def recall_at_k(truth, found, k):
+    hits = 0
+    for t, f in zip(truth, found):
+        hits += len(set(t[:k]) & set(f[:k]))
+    return hits / float(len(truth) * k)
+
+def run(emb, queries, k, types):
+    # Referencia: búsqueda exacta float32
+    flat = build_index(emb, "flat")
+    _, truth = flat.search(queries, k)
+
+    results = []
+    for t in types:
+        t0 = time.perf_counter()
+        index = build_index(emb, t)
+        build_s = time.perf_counter() - t0
+
+        # Latencia por consulta individual (caso real del retriever)
+        lat = []
+        found = []
+        for q in queries:
+            t0 = time.perf_counter()
+            _, I = index.search(q.reshape(1, -1), k)
+            lat.append((time.perf_counter() - t0) * 1000.0)
+            found.append(I[0])
+
+        nbytes = index_nbytes(index)
+        results.append({
+            "type": t,
+            "build_s": round(build_s, 4),
+            "bytes": nbytes,
+            "bytes_per_vector": round(nbytes / max(1, index.ntotal), 1),
+            "query_p50_ms": round(float(np.percentile(lat, 50)), 4),
+            "query_p95_ms": round(float(np.percentile(lat, 95)), 4),
+            f"recall@{k}": round(recall_at_k(truth, found, k), 4),
+        })
+
+    return results
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark de tipos de índice RAG")
+    ap.add_argument("--n", type=int, default=20000, help="Cantidad de vectores sintéticos")
+    ap.add_argument("--dim", type=int, default=768, help="Dimensión (multilingual-e5-base = 768)")
+    ap.add_argument("--clusters", type=int, default=200)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--types", default=",".join(INDEX_TYPES))
+    ap.add_argument("--from-index", default=None, help="Usar vectores de un índice flat existente")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--json", default=None, help="Guardar resultados en este archivo")
+    args = ap.parse_args()
+
+    if args.from_index:
+        emb = load_embeddings(args.from_index)
+    else:
+        emb = synthetic_embeddings(args.n, args.dim, args.clusters, args.seed)
+
+    # Consultas: vectores del corpus con ruido, normalizados
+    rng = np.random.default_rng(args.seed + 1)
+    pick = rng.integers(0, emb.shape[0], size=args.queries)
+    queries = emb[pick] + 0.05 * rng.standard_normal((args.queries, emb.shape[1])).astype("float32")
+    faiss.normalize_L2(queries)
+
+    types = [t.strip() for t in args.types.split(",") if t.strip()]
+    results = run(emb, queries, args.k, types)
+
+    print(f"[BENCH] {emb.shape[0]} vectores, dim={emb.shape[1]}, {args.queries} consultas, k={args.k}")
+    for r in results:
+        print("  " + "  ".join(f"{key}={val}" for key, val in r.items()))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"n": int(emb.shape[0]), "dim": int(emb.shape[1]), "k": args.k, "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Benchmark de TTFT (tiempo al primer token) con prefix caching de vLLM según el orden del prompt.
+
+- legacy: el contexto RAG va dentro del mensaje de sistema (entre las reglas), el prefijo
+  cambia en cada solicitud y no se reutiliza
+- stable: instrucciones fijas primero, historial después y el contexto junto a la última
+  pregunta (server.utils.build_prompt_from_messages)
+
+Escenarios:
+- requests: preguntas independientes con contextos distintos (mismo sistema)
+- conversation: una conversación de varios turnos con contexto nuevo en cada turno
+
+Uso (desde la carpeta llm/, requiere GPU):
+    python -m bench.bench_prefix_cache --model /models/liquidai_lfm2_2.6b --requests 32 --turns 8
+"""
+import json, time, random, asyncio, argparse
+
+import numpy as np
+from vllm import SamplingParams
+
+from server.engine import LLMEngine
+from server.schemas import Message
+from server.utils import build_prompt_from_messages, render_messages
+
+_WORDS = "datos índice modelo consulta documento vector texto servidor memoria caché respuesta fuente".split()
+
+def _lorem(rng, n_words):
+    return " ".join(rng.choice(_WORDS) for _ in range(n_words))
+
+def _context(rng, chunks, words):
+    return "\n\n".join(
+        f"[doc:doc{rng.randint(0, 99)}.pdf|chunk:{i}|score:0.{rng.randint(10, 99)}]\n{_lorem(rng, words)}"
+        for i in range(chunks)
+    )
+
+def legacy_prompt(messages, tokenizer, context):
+    # Orden anterior: el contexto queda dentro del sistema, antes de las reglas de razonamiento
+    system = (
+        "Responde SIEMPRE en el mismo idioma que el usuario usó en su mensaje. "
+        "Si el usuario mezcla idiomas, responde en el idioma predominante. "
+        "Nunca cambies el idioma por tu cuenta."
+        "Eres un asistente con RAG. Usa EXCLUSIVAMENTE el siguiente contexto para responder. "
+        "Si no hay información suficiente en el contexto, responde: "
+        "\"No encontré suficiente información en la base de conocimiento local.\" "
+        "REQUISITOS DE CITADO (OBLIGATORIO):\n"
+        "- Para documentos locales usa: [doc:{nombre}|chunk:{id}|score:{s}]\n"
+        "- Para páginas web usa: [site:{url}|chunk:{id}|score:{s}]\n"
+        "- Incluye SIEMPRE al menos una cita para cada punto clave o afirmación factual que hagas.\n"
+        "- Coloca la(s) cita(s) al final de la frase o bullet correspondiente.\n"
+        "- PROHIBIDO usar referencias numéricas, notas o footnotes (p. ej. [1], [2], [CONTEXTO][1]).\n"
+        "- NO inventes URLs y NO uses ningún otro formato de cita.\n\n"
+        f"### CONTEXTO\n{context}\n### FIN CONTEXTO"
+        "Nunca reveles cadenas de pensamiento ni contenido interno como <think>. "
+        "Si necesitas razonar, hazlo internamente y devuelve solo la respuesta final."
+    )
+    return render_messages([Message(role="system", content=system)] + messages, tokenizer)
+
+def stable_prompt(messages, tokenizer, context):
+    return build_prompt_from_messages(messages, tokenizer, False, True, context)
+
+async def ttft(engine, prompt, sampling):
+    t0 = time.perf_counter()
+    first = []
+
+    def _progress(n):
+        if not first:
+            first.append(time.perf_counter() - t0)
+
+    text = await engine.generate(prompt, sampling, progress=_progress)
+    return (first[0] if first else time.perf_counter() - t0) * 1000.0, text
+
+def _summary(lat):
+    return {
+        "n": len(lat),
+        "mean_ms": round(float(np.mean(lat)), 2),
+        "p50_ms": round(float(np.percentile(lat, 50)), 2),
+        "p95_ms": round(float(np.percentile(lat, 95)), 2),
+    }
+
+async def run_requests(engine, tok, layout, args, sampling):
+    rng = random.Random(args.seed)
+    lat = []
+    for _ in range(args.requests):
+        q = [Message(role="user", content=f"¿Qué dice la fuente sobre {_lorem(rng, 6)}?")]
+        ctx = _context(rng, args.chunks, args.chunk_words)
+        ms, _ = await ttft(engine, layout(q, tok, ctx), sampling)
+        lat.append(ms)
+    return _summary(lat)
+
+async def run_conversation(engine, tok, layout, args, sampling):
+    rng = random.Random(args.seed + 1)
+    history, lat = [], []
+    for _ in range(args.turns):
+        history.append(Message(role="user", content=f"Y sobre {_lorem(rng, 6)}, ¿qué más dice?"))
+        ctx = _context(rng, args.chunks, args.chunk_words)
+        ms, text = await ttft(engine, layout(history, tok, ctx), sampling)
+        lat.append(ms)
+        history.append(Message(role="assistant", content=text))
+    return _summary(lat)
+
+async def run(args):
+    engine = LLMEngine(args.model, args.dtype, args.max_model_len, args.gpu_util, True, not args.no_prefix_caching)
+    tok = engine.get_tokenizer()
+    sampling = SamplingParams(max_tokens=args.max_tokens, temperature=0.0)
+
+    # Calentar el motor (compilación / grafos) antes de medir
+    await engine.generate("Hola", SamplingParams(max_tokens=4))
+
+    results = {"prefix_caching": not args.no_prefix_caching}
+    for name, layout in (("legacy", legacy_prompt), ("stable", stable_prompt)):
+        results[name] = {
+            "requests": await run_requests(engine, tok, layout, args, sampling),
+            "conversation": await run_conversation(engine, tok, layout, args, sampling),
+        }
+        print(f"[BENCH] {name}: " + json.dumps(results[name]))
+
+    for scenario in ("requests", "conversation"):
+        before = results["legacy"][scenario]["mean_ms"]
+        after = results["stable"][scenario]["mean_ms"]
+        print(f"[BENCH] {scenario}: TTFT medio {before} ms -> {after} ms ({(1 - after / before) * 100:.1f}% menos)")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    engine.shutdown()
+
+def main():
+    ap = argparse.ArgumentParser(description="TTFT con prefix caching según el orden del prompt")
+    ap.add_argument("--model", required=True)
+    ap.add_argument("--dtype", default="float16")
+    ap.add_argument("--max-model-len", type=int, default=4096)
+    ap.add_argument("--gpu-util", type=float, default=0.8)
+    ap.add_argument("--requests", type=int, default=32)
+    ap.add_argument("--turns", type=int, default=8)
+    ap.add_argument("--chunks", type=int, default=3, help="Chunks de contexto por solicitud")
+    ap.add_argument("--chunk-words", type=int, default=60)
+    ap.add_argument("--max-tokens", type=int, default=32)
+    ap.add_argument("--no-prefix-caching", action="store_true")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--json", default=None, help="Guardar resultados en este archivo")
+    asyncio.run(run(ap.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+"""
+Benchmark de indexado y recuperación RAG (RAGIndexer / RAGRetriever) con corpus sintéticos.
+
+Genera documentos .txt, .md (frontmatter como create_md) y .pdf por temas y mide, para
+cada tamaño de corpus:
+- parse: lectura por tipo de archivo (docs/s, MB/s)
+- chunk, dedup (chunks duplicados eliminados), embed e index (chunks/s, vectores/s, tamaño del índice)
+- RSS máximo del proceso
+- carga del índice (RAGRetriever) y latencia por consulta (p50/p95)
+- recall@k contra búsqueda exacta y acierto del documento de origen en el top-k
+
+Por defecto usa un embedder falso (hashing de palabras, sin red ni GPU); con --model se usa
+un SentenceTransformer local en CPU. Cada tamaño corre en un proceso aparte para que el RSS
+no se acumule entre tamaños.
+
+Uso (desde la carpeta llm/):
+    python -m bench.bench_rag --sizes 50,200,800 --json bench_rag.json
+    python -m bench.bench_rag --sizes 200 --model /models/multilingual-e5-base --index-type sq8
+"""
+import os, sys, json, time, zlib, random, shutil, argparse, tempfile, subprocess
+import multiprocessing as mp
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from rag.rag_indexer import RAGIndexer
+from rag.rag_retriever import RAGRetriever
+from rag.rag_index import build_index, index_nbytes
+from rag.rag_snapshot import write_snapshot
+from rag.internet_search import create_md
+
+_SYLLABLES = "ba be bi bo bu ca ce ci co cu da de di do du fa fe fi fo la le li lo lu ma me mi mo mu na ne ni no nu pa pe pi po pu ra re ri ro ru sa se si so su ta te ti to tu".split()
+_COMMON = "el la los las de del en con por para que una un es son se su al como más pero sobre entre".split()
+
+class HashEmbedder:
+    """
+    Embedder falso con la interfaz de SentenceTransformer: bolsa de palabras con hashing
+    (signo y posición por crc32). Determinista, rápido y sin dependencias.
+    """
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, texts, batch_size=64, show_progress_bar=False, convert_to_numpy=True, normalize_embeddings=True):
+        out = np.zeros((len(texts), self.dim), dtype="float32")
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                h = zlib.crc32(word.encode("utf-8"))
+                out[row, h % self.dim] += 1.0 if (h >> 16) & 1 else -1.0
+        if normalize_embeddings:
+            norms = np.linalg.norm(out, axis=1, keepdims=True)
+            out /= np.where(norms == 0, 1.0, norms)
+        return out
+
+"""
+Corpus sintético
+"""
+def _vocabulary(rng, n):
+    words = set()
+    while len(words) < n:
+        words.add("".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+def _paragraphs(rng, topic, n_words):
+    # Palabras del tema con distribución sesgada + palabras comunes
+    words = []
+    while len(words) < n_words:
+        sentence = [rng.choice(_COMMON) if rng.random() < 0.3 else topic[int(rng.paretovariate(1.2)) % len(topic)] for _ in range(rng.randint(8, 20))]
+        words += sentence
+        words[-1] += "."
+    text = " ".join(words)
+    return [text[i:i + 600] for i in range(0, len(text), 600)]
+
+def _pdf_escape(line):
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def write_pdf(path, lines, lines_per_page=50):
+    """PDF mínimo con texto Helvetica (sin dependencias)"""
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[""]]
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # Pages (se completa con los hijos)
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    kids = []
+    for page in pages:
+        body = "BT /F1 9 Tf 11 TL 40 800 Td " + " ".join(f"({_pdf_escape(l)}) Tj T*" for l in page) + " ET"
+        stream = body.encode("latin-1", errors="replace")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id)
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % k for k in kids) + b"] /Count %d >>" % len(kids)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + obj + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % off for off in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+
+def generate_corpus(out_dir, n_docs, doc_words, mix, topics, seed, dup_rate=0.0):
+    """
+    Crea n_docs documentos repartidos según mix {"txt": p, "md": p, "pdf": p}.
+    dup_rate: fracción de .md que repiten el resumen de uno anterior (como resultados web).
+    Devuelve {ruta: tema}.
+    """
+    rng = random.Random(seed)
+    vocab = _vocabulary(rng, 4000)
+    topic_words = [rng.sample(vocab, 150) for _ in range(topics)]
+    kinds = [k for k, p in mix.items() for _ in range(int(round(p * 100)))]
+    os.makedirs(out_dir, exist_ok=True)
+
+    corpus = {}
+    summaries = []
+    for i in range(n_docs):
+        topic = rng.randrange(topics)
+        paragraphs = _paragraphs(rng, topic_words[topic], doc_words)
+        kind = rng.choice(kinds)
+        path = os.path.join(out_dir, f"doc{i:06d}.{kind}")
+        if kind == "txt":
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("\n\n".join(paragraphs))
+        elif kind == "md":
+            text = "\n\n".join(paragraphs)
+            if summaries and rng.random() < dup_rate:
+                text = rng.choice(summaries)
+            summaries.append(text)
+            md = create_md(f"https://ejemplo{topic}.com/pagina/{i}", f"Documento {i} tema {topic}", paragraphs[0][:300], text)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(md)
+        else:
+            lines = [p[j:j + 90] for p in paragraphs for j in range(0, len(p), 90)]
+            write_pdf(path, lines)
+        corpus[path] = topic
+    return corpus
+
+"""
+Medición
+"""
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux en KB, macOS en bytes
+    return round(peak / (1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0), 1)
+
+def _timed(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return out, time.perf_counter() - t0
+
+def _rate(n, secs):
+    return round(n / secs, 2) if secs > 0 else None
+
+def run_size(args, n_docs):
+    work = tempfile.mkdtemp(prefix=f"bench_rag_{n_docs}_", dir=args.workdir)
+    try:
+        return _run_size(args, n_docs, work)
+    finally:
+        if not args.keep:
+            shutil.rmtree(work, ignore_errors=True)
+
+def _run_size(args, n_docs, work):
+    mix = dict(zip(("txt", "md", "pdf"), (float(x) for x in args.mix.split(","))))
+    docs_dir = os.path.join(work, "docs")
+    corpus, gen_s = _timed(generate_corpus, docs_dir, n_docs, args.doc_words, mix, args.topics, args.seed, args.dup_rate)
+    corpus_bytes = sum(os.path.getsize(p) for p in corpus)
+
+    embedder = HashEmbedder(args.dim)
+    if args.model:
+        from sentence_transformers import SentenceTransformer
+        embedder = SentenceTransformer(args.model, device="cpu")
+
+    index_path = os.path.join(work, "rag_index.faiss")
+    meta_path = os.path.join(work, "rag_meta.jsonl")
+    indexer = RAGIndexer(docs_dir, index_path, meta_path, None, model=embedder, index_type=args.index_type, shards=args.shards, dedup_threshold=args.dedup_threshold)
+    result = {"docs": n_docs, "corpus_mb": round(corpus_bytes / 1024 / 1024, 2), "generate_s": round(gen_s, 3)}
+
+    # Parse por tipo de archivo
+    parse = {}
+    raw_docs = []
+    for kind in ("txt", "md", "pdf"):
+        paths = [p for p in corpus if p.endswith("." + kind)]
+        if not paths:
+            continue
+        entries, secs = _timed(lambda: [e for e in (indexer.load_file(p) for p in paths) if e])
+        raw_docs += entries
+        nbytes = sum(os.path.getsize(p) for p in paths)
+        parse[kind] = {"docs": len(paths), "s": round(secs, 3), "docs_per_s": _rate(len(paths), secs), "mb_per_s": _rate(nbytes / 1024 / 1024, secs)}
+    result["parse"] = parse
+
+    docs, chunk_s = _timed(indexer.chunk_docs, raw_docs)
+    result["chunk"] = {"chunks": len(docs), "s": round(chunk_s, 3), "chunks_per_s": _rate(len(docs), chunk_s)}
+
+    if args.dedup_threshold:
+        docs, dedup_s = _timed(indexer.dedup, docs)
+        result["dedup"] = {**(indexer.last_dedup or {}), "s": round(dedup_s, 3)}
+
+    texts = [d["text"] for d in docs]
+    emb, embed_s = _timed(indexer.embed, texts, show_progress_bar=False)
+    emb = np.asarray(emb, dtype="float32")
+    result["embed"] = {"s": round(embed_s, 3), "chunks_per_s": _rate(len(texts), embed_s)}
+
+    # Construcción + snapshot, igual que el final de RAGIndexer.main
+    index, build_s = _timed(build_index, emb, args.index_type)
+    _, write_s = _timed(write_snapshot, index, docs, index_path, meta_path, args.index_type, args.shards)
+    result["index"] = {
+        "build_s": round(build_s, 3),
+        "write_s": round(write_s, 3),
+        "vectors_per_s": _rate(len(docs), build_s + write_s),
+    }
+
+    retriever, load_s = _timed(RAGRetriever, index_path, meta_path, None, model=embedder, shards=args.shards)
+    result["load"] = {
+        "s": round(load_s, 3),
+        "index_bytes": sum(index_nbytes(s) for s in retriever.shards),
+        "index_file_bytes": sum(os.path.getsize(os.path.join(work, f)) for f in os.listdir(work) if ".faiss" in f),
+    }
+
+    result["query"] = _queries(args, retriever, embedder, docs, emb, corpus)
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+def _queries(args, retriever, embedder, docs, emb, corpus):
+    rng = random.Random(args.seed + 7)
+    by_key = {(d["source"], d["chunk_id"]): i for i, d in enumerate(docs)}
+    lat, recall, doc_hits = [], [], 0
+    for _ in range(args.queries):
+        # Consulta: palabras tomadas de un chunk, el documento de origen es la respuesta esperada
+        target = docs[rng.randrange(len(docs))]
+        words = target["text"].split()
+        query = " ".join(rng.sample(words, min(args.query_words, len(words))))
+
+        t0 = time.perf_counter()
+        hits = retriever.retrieve(query, args.k)
+        lat.append((time.perf_counter() - t0) * 1000.0)
+
+        q = np.asarray(embedder.encode([query], normalize_embeddings=True), dtype="float32")[0]
+        exact = set(np.argsort(-(emb @ q))[:args.k].tolist())
+        found = {by_key.get((h["source"], h["chunk_id"])) for h in hits}
+        recall.append(len(exact & found) / float(args.k))
+        doc_hits += any(h["source"] == target["source"] for h in hits)
+
+    return {
+        "n": args.queries,
+        "k": args.k,
+        "p50_ms": round(float(np.percentile(lat, 50)), 3),
+        "p95_ms": round(float(np.percentile(lat, 95)), 3),
+        "recall_at_k": round(float(np.mean(recall)), 4),
+        "source_hit_rate": round(doc_hits / float(args.queries), 4),
+    }
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _ints(s):
+    return [int(x) for x in s.split(",") if x.strip()]
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark de indexado y recuperación RAG con corpus sintéticos")
+    ap.add_argument("--sizes", default="50,200,800", help="Cantidad de documentos por corrida")
+    ap.add_argument("--doc-words", type=int, default=800)
+    ap.add_argument("--mix", default="0.4,0.4,0.2", help="Proporción txt,md,pdf")
+    ap.add_argument("--topics", type=int, default=20)
+    ap.add_argument("--dup-rate", type=float, default=0.0, help="Fracción de .md con el resumen repetido")
+    ap.add_argument("--dedup-threshold", type=float, default=0.85, help="Jaccard de casi duplicados (0 = sin dedup)")
+    ap.add_argument("--model", default=None, help="SentenceTransformer local (por defecto embedder falso)")
+    ap.add_argument("--dim", type=int, default=384, help="Dimensión del embedder falso")
+    ap.add_argument("--index-type", default="flat")
+    ap.add_argument("--shards", type=int, default=1)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--query-words", type=int, default=8)
+    ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--workdir", default=None, help="Carpeta para los corpus temporales")
+    ap.add_argument("--keep", action="store_true", help="No borrar los corpus generados")
+    ap.add_argument("--no-isolate", action="store_true", help="Correr todos los tamaños en este proceso")
+    ap.add_argument("--json", default=None, help="Guardar resultados en este archivo")
+    args = ap.parse_args()
+
+    results = []
+    for n in _ints(args.sizes):
+        if args.no_isolate:
+            r = run_size(args, n)
+        else:
+            # Proceso nuevo por tamaño: RSS máximo y cachés independientes
+            with mp.get_context("spawn").Pool(1) as pool:
+                r = pool.apply(run_size, (args, n))
+        results.append(r)
+        print(
+            f"[BENCH] docs={r['docs']} chunks={r['chunk']['chunks']} únicos={r.get('dedup', {}).get('unique', r['chunk']['chunks'])} "
+            f"embed={r['embed']['chunks_per_s']} chunks/s index={r['index']['vectors_per_s']} vec/s "
+            f"carga={r['load']['s']}s p50={r['query']['p50_ms']}ms recall@{args.k}={r['query']['recall_at_k']} "
+            f"rss={r['peak_rss_mb']}MB"
+        )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"commit": _git_commit(), "args": vars(args), "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Benchmark de búsqueda RAG en shards paralelos.
+
+Mide latencia por consulta y consultas/s para distintos tamaños de corpus,
+cantidad de shards, consultas concurrentes y núcleos usados, con la misma
+búsqueda del retriever (search_shards: pool de hilos + heap top-k).
+Para cada cantidad de hilos (--threads) se fijan los hilos OpenMP de faiss y
+el tamaño del pool de shards, y se reporta el escalado contra el primer valor.
+
+Uso (desde la carpeta llm/):
+    python -m bench.bench_shards --sizes 100000,400000 --shards 1,2,4,8 --concurrency 1,8 --threads 1,2,4,8
+"""
+import os, json, time, argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import faiss
+import numpy as np
+
+from rag.rag_index import build_index, split_index
+from rag.rag_retriever import search_shards
+from bench.bench_index_types import synthetic_embeddings
+
+def _ints(s):
+    return [int(x) for x in s.split(",") if x.strip()]
+
+def _default_threads():
+    # Potencias de 2 hasta la cantidad de núcleos (incluida)
+    cores = os.cpu_count() or 1
+    out = [1]
+    while out[-1] * 2 <= cores:
+        out.append(out[-1] * 2)
+    if out[-1] != cores:
+        out.append(cores)
+    return ",".join(str(t) for t in out)
+
+def run_case(shards, queries, k, concurrency, pool):
+    lat = []
+
+    def _query(q):
+        t0 = time.perf_counter()
+        search_shards(shards, q.reshape(1, -1), k, pool)
+        return (time.perf_counter() - t0) * 1000.0
+
+    t0 = time.perf_counter()
+    if concurrency == 1:
+        lat = [_query(q) for q in queries]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as clients:
+            lat = list(clients.map(_query, queries))
+    elapsed = time.perf_counter() - t0
+
+    return {
+        "qps": round(len(queries) / elapsed, 1),
+        "p50_ms": round(float(np.percentile(lat, 50)), 3),
+        "p95_ms": round(float(np.percentile(lat, 95)), 3),
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark de búsqueda por shards")
+    ap.add_argument("--sizes", default="50000,200000")
+    ap.add_argument("--shards", default="1,2,4,8")
+    ap.add_argument("--concurrency", default="1,4")
+    ap.add_argument("--dim", type=int, default=768)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--threads", default=_default_threads(), help="Núcleos a medir: hilos OpenMP de faiss y del pool de shards (p. ej. 1,2,4,8)")
+    ap.add_argument("--index-type", default="flat")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--json", default=None, help="Guardar resultados en este archivo")
+    args = ap.parse_args()
+
+    threads = _ints(args.threads)
+    print(f"[BENCH] núcleos={os.cpu_count()} hilos={threads} omp_max={faiss.omp_get_max_threads()}")
+
+    results = []
+    for n in _ints(args.sizes):
+        emb = synthetic_embeddings(n, args.dim, 200, args.seed)
+        rng = np.random.default_rng(args.seed + 1)
+        queries = emb[rng.integers(0, n, size=args.queries)]
+        index = build_index(emb, args.index_type)
+
+        for n_shards in _ints(args.shards):
+            shards = [index] if n_shards == 1 else split_index(index, np.arange(n) % n_shards, n_shards)
+            for c in _ints(args.concurrency):
+                base_qps = None
+                for t in threads:
+                    faiss.omp_set_num_threads(t)
+                    with ThreadPoolExecutor(max_workers=t, thread_name_prefix="rag-search") as pool:
+                        r = {"n": n, "shards": n_shards, "concurrency": c, "threads": t}
+                        r.update(run_case(shards, queries, args.k, c, pool))
+                    # Escalado contra la primera cantidad de hilos (eficiencia 1.0 = lineal)
+                    base_qps = base_qps or (r["qps"], t)
+                    r["speedup"] = round(r["qps"] / base_qps[0], 2)
+                    r["efficiency"] = round(r["speedup"] / (t / base_qps[1]), 2)
+                    results.append(r)
+                    print("  " + "  ".join(f"{key}={val}" for key, val in r.items()))
+
+    # Consultas/s por cantidad de núcleos para cada caso
+    print("\n[BENCH] qps por núcleos")
+    print("  " + "n".rjust(9) + "shards".rjust(8) + "conc".rjust(6) + "".join(f"t={t}".rjust(10) for t in threads))
+    for key in dict.fromkeys((r["n"], r["shards"], r["concurrency"]) for r in results):
+        row = {r["threads"]: r["qps"] for r in results if (r["n"], r["shards"], r["concurrency"]) == key}
+        print("  " + str(key[0]).rjust(9) + str(key[1]).rjust(8) + str(key[2]).rjust(6) + "".join(str(row[t]).rjust(10) for t in threads))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"cpu_count": os.cpu_count(), "threads": threads, "dim": args.dim, "k": args.k, "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,63 @@
-import os, time, uuid, threading, json
+import os, time, threading, json, asyncio, functools, contextvars
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
 
 from contextlib import asynccontextmanager
-from vllm import LLM
 from dotenv import load_dotenv
-from fastapi import FastAPI, Request, Form, BackgroundTasks, HTTPException
+from fastapi import FastAPI, Request, Form, File, UploadFile, BackgroundTasks, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 
-from server.schemas import Message, ChatRequest, ChatChoice, ChatResponse
-from server.utils import build_prompt_from_messages, build_model_params
-from server.rate_limit import ApiUsageTracker, RateLimiter
-from rag.rag_retriever import RAGRetriever, build_context
-from rag.rag_indexer import RAGIndexer
-from rag.internet_search import get_webpages
+from server.schemas import Message, ChatRequest, ChatChoice, ChatResponse, SessionCreate, SessionMessage
+from server.utils import build_prompt_from_messages, build_model_params, system_instruction
+from server.engine import LLMEngine, StubEngine
+from server.models import ModelRegistry, ModelBusy
+from server.lifecycle import RequestRegistry, RequestCancelled
+from server.sessions import SessionStore
+from server.tracing import Tracer, TracingMiddleware, span
+from server.rate_limit import ApiUsageTracker, RateLimiter, SharedRateLimiter
+from server.uploads import ContentHashRegistry, RequestSizeLimit, UploadTooLarge, stream_to_temp
+from rag.rag_retriever import build_context, get_search_pool
+from rag.rag_collections import collections_from_env, DEFAULT_COLLECTION
+from rag.internet_search import LangSearchClient, SearchCache, aget_webpages, write_webpages
 
 load_dotenv()
 
 # Config
 MODEL_DIR = os.getenv("MODEL_DIR")
+MODELS_DIR = os.getenv("MODELS_DIR")  # Carpeta con un modelo por subcarpeta (se eligen con el campo "model")
+MODEL_DEFAULT = os.getenv("MODEL_DEFAULT") or (os.path.basename(MODEL_DIR) if MODEL_DIR else None)
+MODELS_MAX_BYTES = int(float(os.getenv("MODELS_MEM_MB", "16384")) * 1024 * 1024)  # Pesos cargados a la vez (GPU_UTIL se reparte si caben varios)
 MODEL_DATA_TYPE = os.getenv("MODEL_DTYPE")
 MODEL_MAX_TOKENS = int(os.getenv("MODEL_MAX_TOKENS"))
 MODEL_GPU_MAX_THRESHOLD = float(os.getenv("GPU_UTIL"))
+GPU_MEM_BYTES = int(float(os.getenv("GPU_MEM_MB") or 0) * 1024 * 1024)  # Memoria total de la GPU (opcional, para repartir GPU_UTIL)
 TRUST_REMOTE_CODE = os.getenv("TRUST_REMOTE_CODE")
 SHOW_INTERNAL_THINKING = os.getenv("SHOW_INTERNAL_THINKING")
+LLM_ENGINE = os.getenv("LLM_ENGINE", "vllm")  # vllm | stub (CPU, pruebas sin GPU)
+LLM_PREFIX_CACHING = os.getenv("LLM_PREFIX_CACHING", "True").lower() in ("1", "true", "yes")
+SESSION_MAX_BYTES = int(float(os.getenv("SESSION_MAX_MB", "256")) * 1024 * 1024)
+SESSION_IDLE_TTL_S = float(os.getenv("SESSION_IDLE_TTL_S", "3600"))
+TRACING = os.getenv("TRACING", "header")  # off | header (X-Trace: 1) | all
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "0"))  # Umbral del log de solicitudes lentas (0 = desactivado)
+TRACE_SLOW_LOG_PATH = os.getenv("TRACE_SLOW_LOG_PATH") or "slow_requests.jsonl"
+TRACE_SLOW_LOG_MAX_BYTES = int(float(os.getenv("TRACE_SLOW_LOG_MAX_MB", "10")) * 1024 * 1024)
 
-DOCS_DIR = os.getenv("DOCS_DIR")
-RAG_INDEX_PATH = os.getenv("RAG_INDEX_PATH")
-RAG_META_PATH = os.getenv("RAG_META_PATH")
-RAG_EMBED_MODEL = os.getenv("RAG_EMBED_MODEL")
 RAG_ENABLED = os.getenv("RAG_ENABLED")
+RAG_WRITER = os.getenv("RAG_WRITER", "True").lower() in ("1", "true", "yes")  # Réplica que reindexa al iniciar (con varias réplicas, solo una)
+RAG_SEARCH_THREADS = int(os.getenv("RAG_SEARCH_THREADS", "0")) or None
+RAG_COMPACT_INTERVAL_S = float(os.getenv("RAG_COMPACT_INTERVAL_S", "300"))
+RAG_COMPACT_MIN_CHANGES = int(os.getenv("RAG_COMPACT_MIN_CHANGES", "256"))
+RAG_COMPACT_RATIO = float(os.getenv("RAG_COMPACT_RATIO", "0.1"))
 ALLOWED_EXTS = {".pdf", ".txt", ".md"}  # Extensiones soportadas en RAG
+RAG_MAX_FILE_BYTES = int(float(os.getenv("RAG_MAX_FILE_MB", "50")) * 1024 * 1024)
+RAG_MAX_REQUEST_BYTES = int(float(os.getenv("RAG_MAX_REQUEST_MB", "200")) * 1024 * 1024)
+RAG_MAX_ARCHIVE_BYTES = int(float(os.getenv("RAG_MAX_ARCHIVE_MB", "4096")) * 1024 * 1024)
+RAG_INGEST_ROOT = os.getenv("RAG_INGEST_ROOT", "/data")  # Rutas permitidas para ingesta desde el servidor
+RAG_INGEST_WORKERS = int(os.getenv("RAG_INGEST_WORKERS", "2"))
+RAG_INDEX_WORKERS = int(os.getenv("RAG_INDEX_WORKERS", "1"))  # Reindex, ingesta y embeddings de documentos
+RAG_QUERY_WORKERS = int(os.getenv("RAG_QUERY_WORKERS", "4"))  # Embedding de consulta + búsqueda
+RAG_IO_WORKERS = int(os.getenv("RAG_IO_WORKERS", "4"))  # Escrituras y registros en disco
 
-WEB_DIR = os.getenv("WEB_DIR")
 LS_API_URL = os.getenv("LANGSEARCH_API_URL")
 LS_API_KEY = os.getenv("LANGSEARCH_API_KEY")
 
@@ -38,18 +65,44 @@ LS_DB_PATH = os.getenv("LANGSEARCH_DB_PATH")
 LS_QPS = 1
 LS_QPM = 60
 LS_QPD = 1000
-
-ls_usage_tracker = ApiUsageTracker(LS_DB_PATH)
-ls_rate_limiter = RateLimiter(ls_usage_tracker, LS_QPS, LS_QPM, LS_QPD)
+LS_CACHE_PATH = os.getenv("LANGSEARCH_CACHE_PATH") or os.path.join(os.path.dirname(LS_DB_PATH or "."), "langsearch_cache.db")
+LS_CACHE_TTL = float(os.getenv("LANGSEARCH_CACHE_TTL", "21600"))  # 6 horas
+LS_FLUSH_INTERVAL_S = float(os.getenv("LANGSEARCH_FLUSH_INTERVAL_S", "5"))  # Escritura diferida del conteo de uso
+LS_FLUSH_EVERY = int(os.getenv("LANGSEARCH_FLUSH_EVERY", "20"))
+LS_LIMITER = os.getenv("LANGSEARCH_LIMITER", "local")  # local | shared (varios workers/procesos)
+LS_LIMITER_DB_PATH = os.getenv("LANGSEARCH_LIMITER_DB_PATH") or os.path.join(os.path.dirname(LS_DB_PATH or "."), "langsearch_limits.db")
+
+ls_usage_tracker = ApiUsageTracker(LS_DB_PATH, LS_FLUSH_INTERVAL_S, LS_FLUSH_EVERY)
+if LS_LIMITER == "shared":
+    ls_rate_limiter = SharedRateLimiter(ls_usage_tracker, LS_QPS, LS_QPM, LS_QPD, LS_LIMITER_DB_PATH)
+else:
+    ls_rate_limiter = RateLimiter(ls_usage_tracker, LS_QPS, LS_QPM, LS_QPD)
+ls_client = LangSearchClient(LS_API_URL, LS_API_KEY, SearchCache(LS_CACHE_PATH, LS_CACHE_TTL))
 
 # Rate limiter DB check
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     ls_usage_tracker.check_rollover()
+    ls_usage_tracker.start()
     yield
+    await ls_client.aclose()
+    # Persistir el conteo pendiente de llamadas a la API
+    ls_usage_tracker.close()
+    for pool in (_index_pool, _query_pool, _io_pool):
+        pool.shutdown(wait=False, cancel_futures=True)
+    models.shutdown()
 
 # Server init
 app = FastAPI(lifespan=lifespan, title="vLLM API")
+# Trazas por solicitud: GET /v1/traces/{id} y log JSONL rotativo de solicitudes lentas
+tracer = Tracer(TRACING, TRACE_SLOW_MS, TRACE_SLOW_LOG_PATH, slow_log_max_bytes=TRACE_SLOW_LOG_MAX_BYTES)
+app.add_middleware(TracingMiddleware, tracer=tracer)
+# Subidas demasiado grandes se rechazan por Content-Length, antes de recibir el formulario
+app.add_middleware(RequestSizeLimit, limits=[
+    ("POST", "/v1/chat/rag", RAG_MAX_REQUEST_BYTES),
+    ("PUT", "/v1/rag/docs/", min(RAG_MAX_FILE_BYTES, RAG_MAX_REQUEST_BYTES)),
+    ("POST", "/v1/rag/ingest", RAG_MAX_ARCHIVE_BYTES),
+])
 app.add_middleware(
     CORSMiddleware,
     allow_origins="http://wails.localhost:34115",
@@ -57,53 +110,163 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-llm = LLM(
-    model=MODEL_DIR,
-    trust_remote_code=TRUST_REMOTE_CODE,
-    dtype=MODEL_DATA_TYPE,
-    max_model_len=MODEL_MAX_TOKENS,
-    gpu_memory_utilization=MODEL_GPU_MAX_THRESHOLD,
+# Motor asíncrono: la generación se espera con await y comparte el batch continuo de vLLM
+def _make_engine(model_dir, share=1.0):
+    if LLM_ENGINE == "stub":
+        return StubEngine(model_dir=model_dir)
+    # Cada motor reserva su parte de GPU_UTIL (toda si no caben dos modelos en MODELS_MEM_MB):
+    # los modelos que caben juntos en MODELS_MEM_MB también caben juntos en la GPU (pesos + KV cache)
+    return LLMEngine(model_dir, MODEL_DATA_TYPE, MODEL_MAX_TOKENS, MODEL_GPU_MAX_THRESHOLD * share, TRUST_REMOTE_CODE, LLM_PREFIX_CACHING)
+
+# Modelos: el de por defecto se carga al iniciar, el resto al primer uso (LRU por memoria)
+models = ModelRegistry(
+    MODELS_DIR,
+    _make_engine,
+    MODELS_MAX_BYTES,
+    MODEL_DEFAULT,
+    {os.path.basename(MODEL_DIR): MODEL_DIR} if MODEL_DIR else None,
+    int(GPU_MEM_BYTES * MODEL_GPU_MAX_THRESHOLD) or None,
 )
+models.load()
+
+# Generaciones en curso: cancelación por desconexión o explícita (/v1/requests/{id}/cancel)
+inflight = RequestRegistry()
+
+# Conversaciones guardadas en el servidor (prompt y token ids incrementales)
+sessions = SessionStore(SESSION_MAX_BYTES, SESSION_IDLE_TTL_S)
 
-_tokenizer = llm.get_tokenizer()
+# Ejecutores acotados para las etapas bloqueantes del RAG (el event loop solo coordina)
+_index_pool = ThreadPoolExecutor(max_workers=RAG_INDEX_WORKERS, thread_name_prefix="rag-index")
+_query_pool = ThreadPoolExecutor(max_workers=RAG_QUERY_WORKERS, thread_name_prefix="rag-query")
+_io_pool = ThreadPoolExecutor(max_workers=RAG_IO_WORKERS, thread_name_prefix="rag-io")
 
-# RAG init
-retriever = None
-_reindex_lock = threading.Lock()
+async def _run(pool, fn, *args, **kwargs):
+    # Copiar el contexto para que los spans del hilo queden en la traza de la solicitud
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(pool, functools.partial(ctx.run, fn, *args, **kwargs))
 
-def _rebuild_index_and_reload():
-    global retriever
-    indexer = RAGIndexer([DOCS_DIR, WEB_DIR], RAG_INDEX_PATH, RAG_META_PATH, RAG_EMBED_MODEL)
-    indexer.main()
-    retriever = RAGRetriever(RAG_INDEX_PATH, RAG_META_PATH, RAG_EMBED_MODEL)
+# RAG init: una colección por conversación/workspace, la colección por defecto usa las rutas originales
+rag_collections = None
 
 if RAG_ENABLED:
-    _rebuild_index_and_reload()
+    # Rutas, tipo de índice, shards, embeddings, dedup y retención web (RAG_* / WEB_*),
+    # la misma configuración que usa la ingesta por CLI (python -m rag.bulk_ingest)
+    rag_collections = collections_from_env()
+    get_search_pool(RAG_SEARCH_THREADS)
+    # Las réplicas comparten la carpeta de datos: solo una reconstruye el índice al iniciar,
+    # el resto carga la colección al primer uso (las escrituras se sincronizan con el lock de la colección)
+    if RAG_WRITER:
+        rag_collections.rebuild(DEFAULT_COLLECTION)
+    rag_collections.start_compactor(RAG_COMPACT_INTERVAL_S, RAG_COMPACT_MIN_CHANGES, RAG_COMPACT_RATIO)
+
+# Registro de hashes de contenido por colección (evitar duplicados)
+_hash_registries = {}
+_hash_registries_lock = threading.Lock()
+
+def _hash_registry(col):
+    with _hash_registries_lock:
+        reg = _hash_registries.get(col.name)
+        if reg is None:
+            reg = ContentHashRegistry(col.hashes_path, col.docs_dir, lock=col.lock)
+            _hash_registries[col.name] = reg
+        return reg
+
+def _safe_filename(name):
+    return (name or "unnamed").replace("/", "_").replace("\\", "_")
+
+def _require_rag():
+    if not RAG_ENABLED:
+        raise HTTPException(
+            status_code=400,
+            detail="RAG no está activado"
+        )
+
+def _get_collection(name):
+    _require_rag()
+    try:
+        return rag_collections.get(name)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=str(e)
+        )
+
+def _validate_doc_name(name):
+    safe_name = _safe_filename(name)
+    _, ext = os.path.splitext(safe_name)
+    if safe_name.startswith(".") or ext.lower() not in ALLOWED_EXTS:
+        raise HTTPException(
+            status_code=415,
+            detail=f"Nombre de documento no válido '{name}'. Solo se permiten: {', '.join(sorted(ALLOWED_EXTS))}"
+        )
+    return safe_name
+
+def _get_model(name):
+    try:
+        return models.get(name)
+    except KeyError as e:
+        raise HTTPException(
+            status_code=404,
+            detail=e.args[0]
+        )
+
+@asynccontextmanager
+async def _use_model(name):
+    entry = _get_model(name)
+    try:
+        with span("model.acquire", model=entry.name, cold=entry.engine is None):
+            model = await models.acquire(entry.name)
+    except ModelBusy as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e)
+        )
+    try:
+        yield model
+    finally:
+        models.release(model)
+
+async def _generate(http_request, model, prompt, sampling, request_id, endpoint):
+    try:
+        return await inflight.generate(prompt, sampling, request_id, http_request, endpoint, model.engine)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=409,
+            detail=str(e)
+        )
+    except RequestCancelled as e:
+        # 499: el cliente cerró la solicitud (nadie leerá la respuesta)
+        raise HTTPException(
+            status_code=499,
+            detail=str(e)
+        )
 
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
 @app.post("/v1/chat/completions", response_model=ChatResponse)
-def chat_completions(req: ChatRequest):
+async def chat_completions(req: ChatRequest, request: Request):
     if not req.messages:
         return {"error": "Campo messages no puede estar vacío"}
 
-    # Renderizar prompt desde messages
-    prompt = build_prompt_from_messages(req.messages, _tokenizer, SHOW_INTERNAL_THINKING)
+    async with _use_model(req.model) as model:
+        # Renderizar prompt desde messages
+        prompt = build_prompt_from_messages(req.messages, model.tokenizer, SHOW_INTERNAL_THINKING)
 
-    # Cargar modelo con parametros especificados
-    sampling = build_model_params(req.params, req.max_tokens or 2048)
-    
-    outputs = llm.generate(prompts=[prompt], sampling_params=sampling)
-    text = outputs[0].outputs[0].text
+        # Cargar modelo con parametros especificados
+        sampling = build_model_params(req.params, req.max_tokens or 2048)
+
+        request_id = RequestRegistry.new_id(request)
+        text = await _generate(request, model, prompt, sampling, request_id, "/v1/chat/completions")
 
     # Preparar respuesta
     res = ChatResponse(
-        id=str(uuid.uuid4()),
+        id=request_id,
         api="/v1/chat/completions",
         created=int(time.time()),
-        model=os.path.basename(MODEL_DIR),
+        model=model.name,
         choices=[
             ChatChoice(
                 index=0,
@@ -114,22 +277,102 @@ def chat_completions(req: ChatRequest):
 
     return res
 
+@app.post("/v1/sessions")
+async def create_session(req: Optional[SessionCreate] = None):
+    """
+    Crear una conversación en el servidor, opcionalmente con historial inicial.
+    Los turnos siguientes solo envían el mensaje nuevo (/v1/sessions/{id}/messages).
+    La sesión usa siempre el modelo con el que se creó.
+    """
+    system = Message(role="system", content=system_instruction(SHOW_INTERNAL_THINKING))
+    history = [m for m in (req.messages if req else []) if m.role != "system"]
+    async with _use_model(req.model if req else None) as model:
+        session = sessions.create([system] + history, model.name, model.tokenizer)
+    return session.info()
+
+def _get_session(session_id):
+    session = sessions.get(session_id)
+    if session is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"No existe la sesión '{session_id}' (o fue desalojada por inactividad)"
+        )
+    return session
+
+@app.post("/v1/sessions/{session_id}/messages", response_model=ChatResponse)
+async def session_message(session_id: str, req: SessionMessage, request: Request):
+    """
+    Agregar un mensaje del usuario a la sesión y generar la respuesta.
+    Solo se renderiza y tokeniza el turno nuevo; el historial se reutiliza.
+    """
+    session = _get_session(session_id)
+    if session.lock.locked():
+        raise HTTPException(
+            status_code=409,
+            detail="La sesión ya tiene un turno en curso"
+        )
+
+    async with session.lock, _use_model(session.model) as model:
+        prompt, pending = session.prepare(req.content)
+        sampling = build_model_params(req.params, req.max_tokens)
+
+        n_prompt = len(prompt["prompt_token_ids"]) if isinstance(prompt, dict) else None
+        if n_prompt is not None and n_prompt + sampling.max_tokens > MODEL_MAX_TOKENS:
+            raise HTTPException(
+                status_code=413,
+                detail=f"La sesión excede el contexto del modelo ({n_prompt} tokens + {sampling.max_tokens} de respuesta > {MODEL_MAX_TOKENS})"
+            )
+
+        request_id = RequestRegistry.new_id(request)
+        text = await _generate(request, model, prompt, sampling, request_id, "/v1/sessions")
+
+        # Solo los turnos completos se agregan a la sesión
+        session.commit(pending, text)
+        sessions.touch(session)
+
+    return ChatResponse(
+        id=request_id,
+        api="/v1/sessions",
+        created=int(time.time()),
+        model=model.name,
+        choices=[ChatChoice(index=0, message=Message(role="assistant", content=text))]
+    )
+
+@app.get("/v1/sessions/{session_id}")
+def get_session(session_id: str):
+    session = _get_session(session_id)
+    return {**session.info(), "history": [m.model_dump() for m in session.messages[1:]]}
+
+@app.delete("/v1/sessions/{session_id}")
+def delete_session(session_id: str):
+    if not sessions.delete(session_id):
+        raise HTTPException(
+            status_code=404,
+            detail=f"No existe la sesión '{session_id}'"
+        )
+    return {"status": "ok", "id": session_id}
+
+@app.get("/v1/sessions")
+def get_sessions_status():
+    return sessions.status()
+
 @app.post("/v1/chat/rag")
 async def chat_rag(
         request: Request,
         background: BackgroundTasks,
         sync: bool = Form(True),
         internet: bool = Form(False),
+        persist_web: bool = Form(False),
+        collection: str = Form(DEFAULT_COLLECTION),
     ):
     """
     Subir documentos y guadarlos, después reindexar y cargar preguntas en el retriever.
     Acepta un máximo de 10 documentos por llamada a la API.
+    Cada colección tiene su propio índice, solo se reindexa y consulta la colección indicada.
+    Las páginas web se usan como contexto en memoria de la solicitud; con persist_web=true
+    (o sin chat / sync=false) además se guardan y agregan al índice en segundo plano.
     """
-    if not RAG_ENABLED:
-        raise HTTPException(
-            status_code=400, 
-            detail="RAG no está activado"
-        )
+    col = _get_collection(collection)
 
     form = await request.form()
 
@@ -145,6 +388,8 @@ async def chat_rag(
                 status_code=400, 
                 detail=f"JSON inválido en campo 'chat': {e}"
             )
+        # Validar el modelo antes de guardar archivos o buscar en internet
+        _get_model(chat_req.model)
     
     """
     Documentos
@@ -165,7 +410,7 @@ async def chat_rag(
         )
 
     # Validar extensiones de archivos
-    os.makedirs(DOCS_DIR, exist_ok=True)
+    os.makedirs(col.docs_dir, exist_ok=True)
     for uf in uploads:
         _, ext = os.path.splitext(uf.filename or "")
         ext = ext.lower()
@@ -175,21 +420,42 @@ async def chat_rag(
                 detail=f"Formato no soportado en '{uf.filename}'. Solo se permiten: {', '.join(sorted(ALLOWED_EXTS))}"
             )
 
-    # Guardar los archivos
+    # Guardar los archivos por bloques, omitiendo contenido ya indexado
     saved_files = []
-    for uf in uploads:
-        safe_name = (uf.filename or "unnamed").replace("/", "_").replace("\\", "_")
-        dst_path = os.path.join(DOCS_DIR, safe_name)
-        content = await uf.read()
-        with open(dst_path, "wb") as f:
-            f.write(content)
-        saved_files.append(safe_name)
+    skipped_files = []
+    # El primer uso de la colección hashea todos sus documentos: fuera del event loop
+    registry = await _run(_io_pool, _hash_registry, col)
+    remaining = RAG_MAX_REQUEST_BYTES
+    with span("upload", files=len(uploads)) as upload_span:
+        for uf in uploads:
+            safe_name = _safe_filename(uf.filename)
+            dst_path = os.path.join(col.docs_dir, safe_name)
+            try:
+                tmp_path, digest, size = await stream_to_temp(uf, col.docs_dir, RAG_MAX_FILE_BYTES, remaining)
+            except UploadTooLarge as e:
+                raise HTTPException(
+                    status_code=413,
+                    detail=str(e)
+                )
+            remaining -= size
+
+            existing = await _run(_io_pool, registry.lookup, digest)
+            if existing:
+                await _run(_io_pool, os.remove, tmp_path)
+                skipped_files.append({"file": safe_name, "duplicate_of": existing})
+                continue
+
+            await _run(_io_pool, os.replace, tmp_path, dst_path)
+            await _run(_io_pool, registry.add, digest, safe_name)
+            saved_files.append(safe_name)
+
+        upload_span.set(bytes=RAG_MAX_REQUEST_BYTES - remaining, saved=len(saved_files), skipped=len(skipped_files))
 
     """
     Internet
     """
-    # Ejecutar búsqueda y guardar paginas en .md
-    web_files = []
+    # Ejecutar búsqueda y renderizar páginas en memoria (.md)
+    web_pages = []
     search_query = None
     if internet:
         if chat_req:
@@ -205,7 +471,7 @@ async def chat_rag(
             )
 
         try:
-            web_files = get_webpages(search_query, ls_rate_limiter, WEB_DIR, LS_API_URL, LS_API_KEY)
+            web_pages = await aget_webpages(search_query, ls_client, ls_rate_limiter, col.web_dir)
         except RuntimeError as e:
             raise HTTPException(
                 status_code=429, 
@@ -227,14 +493,36 @@ async def chat_rag(
     # Reindex + reload retriever
     def _task_reindex():
         try:
-            with _reindex_lock:
-                _rebuild_index_and_reload()
+            rag_collections.rebuild(col.name)
         except Exception as e:
             print(f"[RAG] Error en reindex task: {e}")
 
+    # Guardar páginas web nuevas e indexar solo esas (sin reindexar la colección)
+    def _task_persist_web():
+        try:
+            with col.lock:
+                created = write_webpages(web_pages)
+                if created:
+                    rag_collections.add_files(col.name, created)
+                rag_collections.enforce_web_retention(col.name)
+        except Exception as e:
+            print(f"[RAG] Error guardando páginas web: {e}")
+
+    # Sin chat o en modo asíncrono, persistir es la única forma de aprovechar las páginas
+    persist_web = bool(web_pages) and (persist_web or not sync or not chat_req)
+    web_files = [path for path, _ in web_pages]
+
+    # Si todo el contenido ya estaba indexado no es necesario reindexar
+    needs_reindex = bool(saved_files)
+
     if sync:
-        with _reindex_lock:
-            _rebuild_index_and_reload()
+        with span("reindex" if needs_reindex else "load_retriever", collection=col.name):
+            if needs_reindex:
+                retriever = await _run(_index_pool, rag_collections.rebuild, col.name)
+            else:
+                retriever = await _run(_index_pool, rag_collections.retriever, col.name)
+        if persist_web:
+            background.add_task(_task_persist_web)
         
         # Si vienen mensajes entonces llamar al retriever
         if chat_req:
@@ -250,24 +538,30 @@ async def chat_rag(
                     detail="El campo 'chat' no contiene mensajes del usuario."
                 )
             
-            # Recuperar contexto desde RAG
-            docs = retriever.retrieve(user_query, top_k=5)
+            # Recuperar contexto desde RAG + páginas web de esta solicitud (índice en memoria)
+            ephemeral = None
+            if web_pages:
+                with span("ephemeral_index", pages=len(web_pages)):
+                    ephemeral = await _run(_query_pool, rag_collections.ephemeral_index, col.name, web_pages)
+            docs = await _run(_query_pool, retriever.retrieve, user_query, top_k=5, ephemeral=ephemeral)
+            rag_collections.record_hits(col.name, docs)
             context = build_context(docs)
 
-            # Renderizar prompt desde messages
-            prompt = build_prompt_from_messages(chat_req.messages, _tokenizer, SHOW_INTERNAL_THINKING, True, context)
+            async with _use_model(chat_req.model) as model:
+                # Renderizar prompt desde messages
+                prompt = build_prompt_from_messages(chat_req.messages, model.tokenizer, SHOW_INTERNAL_THINKING, True, context)
 
-            # Cargar modelo con parametros especificados
-            sampling = build_model_params(chat_req.params, chat_req.max_tokens)
+                # Cargar modelo con parametros especificados
+                sampling = build_model_params(chat_req.params, chat_req.max_tokens)
 
-            outputs = llm.generate(prompts=[prompt], sampling_params=sampling)
-            text = outputs[0].outputs[0].text
+                request_id = RequestRegistry.new_id(request)
+                text = await _generate(request, model, prompt, sampling, request_id, "/v1/chat/rag")
 
             res = ChatResponse(
-                id=str(uuid.uuid4()),
+                id=request_id,
                 api="/v1/chat/rag",
                 created=int(time.time()),
-                model=os.path.basename(MODEL_DIR),
+                model=model.name,
                 choices=[ChatChoice(index=0, message=Message(role="assistant", content=text))]
             )
             
@@ -279,29 +573,238 @@ async def chat_rag(
                 "status": "ok", 
                 "indexed": True, 
                 "doc_files": saved_files,
+                "skipped_files": skipped_files,
                 "web_files": web_files,
+                "web_persisted": persist_web,
+                "collection": col.name,
                 "mode": "docs+internet" if (uploads and internet) else ("internet" if internet else "docs")
             }
     # Utilizar modo asincrónico para testing o evitar bloqueos de la API
     else:
-        background.add_task(_task_reindex)
+        if needs_reindex:
+            background.add_task(_task_reindex)
+        # Después del reindex: solo se indexan las páginas que aún no estaban en disco
+        if persist_web:
+            background.add_task(_task_persist_web)
         
         if chat_req:
             return {
                 "status": "accepted",
-                "indexed": "in_progress",
+                "indexed": "in_progress" if needs_reindex else True,
                 "doc_files": saved_files,
+                "skipped_files": skipped_files,
                 "web_files": web_files,
+                "web_persisted": persist_web,
+                "collection": col.name,
                 "mode": "docs+internet" if (uploads and internet) else ("internet" if internet else "docs"),
                 "warning": "Reintenta el chat cuando termine el reindex o usa sync=true."
             }
         else:
-            return {"status": "accepted", "indexed": "in_progress", "files": saved_files}
+            return {
+                "status": "accepted",
+                "indexed": "in_progress" if needs_reindex else True,
+                "files": saved_files,
+                "skipped_files": skipped_files,
+                "collection": col.name
+            }
+
+@app.put("/v1/rag/docs/{name}")
+async def replace_rag_doc(
+        name: str,
+        file: UploadFile = File(...),
+        collection: str = Form(DEFAULT_COLLECTION),
+    ):
+    """
+    Crear o reemplazar un documento: se eliminan sus chunks anteriores y se indexa solo este archivo.
+    """
+    col = _get_collection(collection)
+    safe_name = _validate_doc_name(name)
+    dst_path = os.path.join(col.docs_dir, safe_name)
+    registry = await _run(_io_pool, _hash_registry, col)
+
+    try:
+        tmp_path, digest, _ = await stream_to_temp(file, col.docs_dir, RAG_MAX_FILE_BYTES, RAG_MAX_REQUEST_BYTES)
+    except UploadTooLarge as e:
+        raise HTTPException(
+            status_code=413,
+            detail=str(e)
+        )
+
+    existing = await _run(_io_pool, registry.lookup, digest)
+    if existing == safe_name:
+        await _run(_io_pool, os.remove, tmp_path)
+        return {"status": "unchanged", "doc": safe_name, "collection": col.name}
+    if existing:
+        await _run(_io_pool, os.remove, tmp_path)
+        raise HTTPException(
+            status_code=409,
+            detail=f"El contenido es idéntico al documento '{existing}'"
+        )
+
+    await _run(_io_pool, os.replace, tmp_path, dst_path)
+    await _run(_io_pool, registry.add, digest, safe_name)
+    removed, added = await _run(_index_pool, rag_collections.replace_file, col.name, dst_path)
+
+    return {
+        "status": "ok",
+        "doc": safe_name,
+        "collection": col.name,
+        "chunks_removed": removed,
+        "chunks_added": added,
+    }
+
+@app.delete("/v1/rag/docs/{name}")
+def delete_rag_doc(name: str, collection: str = DEFAULT_COLLECTION):
+    """
+    Eliminar un documento y sus chunks del índice sin reindexar la colección.
+    """
+    col = _get_collection(collection)
+    safe_name = _validate_doc_name(name)
+    path = os.path.join(col.docs_dir, safe_name)
+
+    removed = rag_collections.delete_file(col.name, path)
+    if removed == 0 and not os.path.exists(path):
+        raise HTTPException(
+            status_code=404,
+            detail=f"No existe el documento '{safe_name}'"
+        )
+
+    if os.path.exists(path):
+        os.remove(path)
+    _hash_registry(col).remove_name(safe_name)
+
+    return {"status": "ok", "doc": safe_name, "collection": col.name, "chunks_removed": removed}
+
+@app.post("/v1/rag/ingest")
+async def ingest_rag_docs(
+        background: BackgroundTasks,
+        archive: Optional[UploadFile] = File(None),
+        path: Optional[str] = Form(None),
+        collection: str = Form(DEFAULT_COLLECTION),
+        sync: bool = Form(True),
+    ):
+    """
+    Ingesta masiva desde un .zip/.tar subido (archive) o una carpeta/archivo del servidor (path).
+    El índice se confirma una sola vez al terminar.
+    """
+    col = _get_collection(collection)
+    if (archive is None) == (path is None):
+        raise HTTPException(
+            status_code=400,
+            detail="Debes enviar 'archive' o 'path' (solo uno)"
+        )
+
+    tmp_path = None
+    if archive is not None:
+        try:
+            tmp_path, _, _ = await stream_to_temp(archive, os.path.dirname(col.meta_path) or ".", RAG_MAX_ARCHIVE_BYTES, None)
+        except UploadTooLarge as e:
+            raise HTTPException(
+                status_code=413,
+                detail=str(e)
+            )
+        source = tmp_path
+    else:
+        source = os.path.realpath(path)
+        root = os.path.realpath(RAG_INGEST_ROOT)
+        if os.path.commonpath([source, root]) != root or not os.path.exists(source):
+            raise HTTPException(
+                status_code=400,
+                detail=f"La ruta debe existir dentro de {RAG_INGEST_ROOT}"
+            )
+
+    def _task_ingest():
+        try:
+            return rag_collections.ingest(
+                col.name, source,
+                registry=_hash_registry(col),
+                workers=RAG_INGEST_WORKERS,
+                max_file_bytes=RAG_MAX_FILE_BYTES,
+            )
+        finally:
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    if not sync:
+        background.add_task(_task_ingest)
+        return {"status": "accepted", "collection": col.name}
+
+    try:
+        stats = await _run(_index_pool, _task_ingest)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=str(e)
+        )
+
+    return {"status": "ok", "collection": col.name, "stats": stats}
+
+@app.get("/v1/rag/collections")
+def list_rag_collections():
+    _require_rag()
+    return {"collections": rag_collections.list()}
+
+@app.get("/v1/rag/web/stats")
+def get_rag_web_stats(collection: str = DEFAULT_COLLECTION):
+    """
+    Estado de la retención de páginas web de la colección (tamaño y desalojos).
+    """
+    col = _get_collection(collection)
+    return {"collection": col.name, **rag_collections.web_store(col.name).status()}
+
+@app.get("/v1/models")
+def list_models():
+    """
+    Modelos disponibles y cargados: tiempo de carga, usos y memoria estimada (pesos en disco).
+    """
+    return models.status()
+
+@app.get("/v1/traces")
+def list_traces(limit: int = 50):
+    """
+    Trazas recientes (id, duración). Solo se trazan las solicitudes con X-Trace: 1 (o todas con TRACING=all).
+    """
+    return {"mode": TRACING, "slow_ms": TRACE_SLOW_MS, "slow_logged": tracer.slow_count, "traces": tracer.recent(limit)}
+
+@app.get("/v1/traces/{trace_id}")
+def get_trace(trace_id: str):
+    """
+    Árbol de spans de una solicitud (el id es el de la respuesta o el X-Request-Id enviado).
+    """
+    trace = tracer.get(trace_id)
+    if trace is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"No existe la traza '{trace_id}' (solicitud sin X-Trace o ya descartada)"
+        )
+    return trace
+
+@app.get("/v1/requests")
+def list_requests():
+    """
+    Generaciones en curso y métricas de cancelación (tokens ahorrados).
+    """
+    return inflight.status()
+
+@app.post("/v1/requests/{request_id}/cancel")
+def cancel_request(request_id: str):
+    """
+    Aborta una generación en curso (p. ej. botón "detener" del cliente).
+    El id es el header X-Request-Id enviado por el cliente o el id de la respuesta.
+    """
+    if not inflight.cancel(request_id):
+        raise HTTPException(
+            status_code=404,
+            detail=f"No hay una generación en curso con id '{request_id}'"
+        )
+    return {"status": "cancelled", "id": request_id}
 
 @app.get("/v1/langsearch/status")
 def get_langsearch_state():
-    count, date = ls_usage_tracker.get_today_count()
+    # Con LANGSEARCH_LIMITER=shared es el total de todos los procesos
+    count, date = ls_rate_limiter.get_today_count()
     return {
         "date": date,
         "count": count,
+        "cache": ls_client.stats,
     }
@@ -0,0 +1,363 @@
+"""
+Ingesta masiva de documentos desde un .zip, .tar(.gz/.bz2/.xz) o una carpeta.
+
+Las entradas se leen una a una (sin descomprimir todo en memoria) y pasan por un
+pipeline de hilos: lectura -> parseo + chunks -> embeddings por lotes. Los
+embeddings se acumulan en disco y el índice se confirma una sola vez al final.
+
+Uso (desde la carpeta llm/):
+    python -m rag.bulk_ingest /data/kb.zip --collection default
+"""
+import os, sys, json, time, queue, hashlib, zipfile, tarfile, argparse, tempfile, threading
+from pathlib import Path
+
+import numpy as np
+
+from rag.rag_index import build_index, id_selector
+from rag.rag_snapshot import write_snapshot, load_index_writable
+
+ALLOWED_EXTS = {".pdf", ".txt", ".md"}
+
+# Marca de fin de cola entre etapas del pipeline
+_DONE = object()
+
+def _entry_name(rel):
+    rel = rel.replace("\\", "/").strip("/")
+    return rel.replace("/", "_")
+
+def _skip_entry(rel):
+    parts = rel.replace("\\", "/").split("/")
+    if any(p.startswith(".") or p == "__MACOSX" for p in parts):
+        return True
+    return os.path.splitext(rel)[1].lower() not in ALLOWED_EXTS
+
+def iter_entries(source, max_file_bytes=None):
+    """
+    Genera (nombre, bytes) por cada documento soportado de la fuente, uno a la vez.
+    Las entradas que exceden max_file_bytes se omiten.
+    """
+    source = str(source)
+
+    if os.path.isdir(source):
+        for p in sorted(Path(source).rglob("*")):
+            rel = str(p.relative_to(source))
+            if not p.is_file() or _skip_entry(rel):
+                continue
+            if max_file_bytes and p.stat().st_size > max_file_bytes:
+                continue
+            yield _entry_name(rel), p.read_bytes()
+
+    elif zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as zf:
+            for info in zf.infolist():
+                if info.is_dir() or _skip_entry(info.filename):
+                    continue
+                if max_file_bytes and info.file_size > max_file_bytes:
+                    continue
+                with zf.open(info) as f:
+                    yield _entry_name(info.filename), f.read()
+
+    elif tarfile.is_tarfile(source):
+        # Modo stream: recorre el tar secuencialmente sin índice en memoria
+        with tarfile.open(source, mode="r|*") as tf:
+            for member in tf:
+                if not member.isfile() or _skip_entry(member.name):
+                    continue
+                if max_file_bytes and member.size > max_file_bytes:
+                    continue
+                f = tf.extractfile(member)
+                if f is None:
+                    continue
+                yield _entry_name(member.name), f.read()
+
+    else:
+        raise ValueError(f"Fuente no soportada: '{source}' (usa una carpeta, .zip o .tar)")
+
+class BulkIngestor:
+    """
+    Pipeline de ingesta para una colección (ver RAGCollections.ingest).
+    - registry: ContentHashRegistry opcional para omitir contenido ya existente
+    """
+    def __init__(self, collections, name, registry=None, workers=2, batch_size=256, queue_size=64, max_file_bytes=None):
+        self.collections = collections
+        self.col = collections.get(name)
+        self.registry = registry
+        self.workers = max(1, int(workers))
+        self.batch_size = max(1, int(batch_size))
+        self.queue_size = queue_size
+        self.max_file_bytes = max_file_bytes
+        self.stats = {
+            "docs": 0,
+            "chunks": 0,
+            "skipped_duplicates": 0,
+            "duplicate_chunks": 0,
+            "failed": 0,
+            "read_s": 0.0,
+            "parse_s": 0.0,
+            "embed_s": 0.0,
+            "commit_s": 0.0,
+        }
+        self._stats_lock = threading.Lock()
+        self._error = None
+        self._stop = threading.Event()
+        self._new_hashes = {}  # sha256 -> nombre, se registran una vez al confirmar
+
+    def _add_stat(self, key, value):
+        with self._stats_lock:
+            self.stats[key] += value
+
+    def _put(self, q, item):
+        # Bloquea mientras la cola está llena, salvo que el pipeline se haya detenido por un error
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, q):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _DONE
+
+    @staticmethod
+    def _drain(q):
+        try:
+            while True:
+                q.get_nowait()
+        except queue.Empty:
+            pass
+
+    """
+    Etapas del pipeline
+    """
+    def _read_stage(self, source, paths_q):
+        # Etapa 1: leer entradas, deduplicar por sha256 y escribirlas en la carpeta de documentos
+        seen = set()
+        replaced = set()
+        try:
+            os.makedirs(self.col.docs_dir, exist_ok=True)
+            t0 = time.perf_counter()
+            for name, data in iter_entries(source, self.max_file_bytes):
+                if self._stop.is_set():
+                    break
+                digest = hashlib.sha256(data).hexdigest()
+                if digest in seen or (self.registry and self.registry.lookup(digest)):
+                    self._add_stat("skipped_duplicates", 1)
+                    continue
+                seen.add(digest)
+
+                dst = os.path.join(self.col.docs_dir, name)
+                if os.path.exists(dst):
+                    replaced.add(dst)
+                tmp = dst + ".part"
+                with open(tmp, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, dst)
+                self._new_hashes[digest] = name
+
+                self._add_stat("read_s", time.perf_counter() - t0)
+                if not self._put(paths_q, dst):
+                    break
+                t0 = time.perf_counter()
+        except Exception as e:
+            self._error = e
+        finally:
+            for _ in range(self.workers):
+                self._put(paths_q, _DONE)
+            self.replaced_sources = replaced
+
+    def _parse_stage(self, indexer, paths_q, chunks_q):
+        # Etapa 2: extraer texto y generar chunks (varios hilos)
+        try:
+            while True:
+                path = self._get(paths_q)
+                if path is _DONE:
+                    break
+                t0 = time.perf_counter()
+                entry = indexer.load_file(path)
+                docs = indexer.chunk_docs([entry]) if entry else []
+                self._add_stat("parse_s", time.perf_counter() - t0)
+                if not docs:
+                    self._add_stat("failed", 1)
+                    continue
+                self._add_stat("docs", 1)
+                if not self._put(chunks_q, docs):
+                    break
+        except Exception as e:
+            self._error = e
+        finally:
+            self._put(chunks_q, _DONE)
+
+    def run(self, source):
+        """
+        Ejecuta la ingesta completa y confirma el índice una vez. Devuelve las estadísticas.
+        """
+        start = time.perf_counter()
+        indexer = self.collections._indexer(self.col)
+        dim = indexer.model.get_sentence_embedding_dimension()
+
+        paths_q = queue.Queue(maxsize=self.queue_size)
+        chunks_q = queue.Queue(maxsize=self.queue_size)
+        self.replaced_sources = set()
+
+        threads = [threading.Thread(target=self._read_stage, args=(source, paths_q), daemon=True)]
+        threads += [
+            threading.Thread(target=self._parse_stage, args=(indexer, paths_q, chunks_q), daemon=True)
+            for _ in range(self.workers)
+        ]
+        for t in threads:
+            t.start()
+
+        # Etapa 3: embeddings por lotes; filas y vectores se acumulan en disco
+        # Dedup de chunks compartido por todos los lotes (copias entre documentos distintos)
+        dedup = indexer.deduper.session() if indexer.deduper is not None else None
+        tmp_dir = tempfile.mkdtemp(prefix=".ingest_", dir=os.path.dirname(self.col.meta_path) or ".")
+        rows_path = os.path.join(tmp_dir, "rows.jsonl")
+        emb_path = os.path.join(tmp_dir, "emb.f32")
+        n = 0
+        try:
+            with open(rows_path, "w", encoding="utf-8") as rows_f, open(emb_path, "wb") as emb_f:
+                pending = []
+                finished = 0
+
+                def _flush():
+                    nonlocal n
+                    t0 = time.perf_counter()
+                    batch = dedup.add(pending) if dedup is not None else list(pending)
+                    self._add_stat("duplicate_chunks", len(pending) - len(batch))
+                    pending.clear()
+                    if not batch:
+                        return
+                    emb = indexer.embed([d["text"] for d in batch], show_progress_bar=False)
+                    self._add_stat("embed_s", time.perf_counter() - t0)
+                    np.ascontiguousarray(emb, dtype="float32").tofile(emb_f)
+                    # Fila i del archivo = vid start_vid + i al confirmar
+                    for d in batch:
+                        rows_f.write(json.dumps(d, ensure_ascii=False) + "\n")
+                    n += len(batch)
+
+                while finished < self.workers:
+                    docs = chunks_q.get()
+                    if docs is _DONE:
+                        finished += 1
+                        continue
+                    pending.extend(docs)
+                    if len(pending) >= self.batch_size:
+                        _flush()
+                if pending:
+                    _flush()
+
+            for t in threads:
+                t.join()
+            if self._error:
+                raise self._error
+
+            self.stats["chunks"] = n
+            t0 = time.perf_counter()
+            if n or self.replaced_sources:
+                self._commit(rows_path, emb_path, n, dim, dedup)
+            if self.registry and self._new_hashes:
+                # Una sola escritura del registro para toda la ingesta
+                self.registry.add_many(self._new_hashes)
+            self.stats["commit_s"] = time.perf_counter() - t0
+        except BaseException:
+            # Detener lectura y parseo (bloqueados en colas llenas) antes de propagar el error
+            self._stop.set()
+            for q in (paths_q, chunks_q):
+                self._drain(q)
+            for t in threads:
+                t.join()
+            raise
+        finally:
+            for p in (rows_path, emb_path):
+                if os.path.exists(p):
+                    os.remove(p)
+            os.rmdir(tmp_dir)
+
+        elapsed = time.perf_counter() - start
+        self.stats["elapsed_s"] = elapsed
+        self.stats["docs_per_s"] = self.stats["docs"] / elapsed if elapsed > 0 else 0.0
+        self.stats["chunks_per_s"] = self.stats["chunks"] / elapsed if elapsed > 0 else 0.0
+        for k in ("read_s", "parse_s", "embed_s", "commit_s", "elapsed_s", "docs_per_s", "chunks_per_s"):
+            self.stats[k] = round(self.stats[k], 3)
+        return self.stats
+
+    def _commit(self, rows_path, emb_path, n, dim, dedup=None):
+        """
+        Confirma todo en un único snapshot: índice vigente (compactado) + vectores nuevos.
+        dedup: DedupSession de la ingesta, agrega a cada fila las copias de lotes posteriores.
+        """
+        col = self.col
+        with col.lock:
+            r = self.collections._current(col)
+            r.compact()
+
+            start_vid = r.next_id
+            new_ids = np.arange(start_vid, start_vid + n, dtype="int64")
+            emb = np.memmap(emb_path, dtype="float32", mode="r", shape=(n, dim)) if n else None
+
+            # Archivos sobrescritos: sus chunks anteriores se eliminan del índice
+            old_ids = [v for src in self.replaced_sources for v in r.source_ids(src)]
+
+            if r.ntotal - len(old_ids) <= 0 and n:
+                # Colección vacía: entrenar/construir el índice con los vectores nuevos
+                index = build_index(emb, self.collections.index_type, ids=new_ids)
+            else:
+                index = load_index_writable(col.index_path, r.manifest)
+                if old_ids:
+                    index.remove_ids(id_selector(old_ids))
+                for i in range(0, n, 8192):
+                    index.add_with_ids(np.ascontiguousarray(emb[i:i + 8192]), new_ids[i:i + 8192])
+
+            old = set(old_ids)
+
+            def _rows():
+                for m in r.metas:
+                    if m.get("vid") not in old:
+                        yield m
+                with open(rows_path, "r", encoding="utf-8") as f:
+                    for i, line in enumerate(f):
+                        d = json.loads(line)
+                        d["vid"] = start_vid + i
+                        yield dedup.apply(i, d) if dedup is not None else d
+
+            write_snapshot(
+                index, _rows(), col.index_path, col.meta_path,
+                self.collections.index_type, self.collections.shards, self.collections.shard_by
+            )
+            del emb
+            self.collections.reload(col.name)
+
+def main():
+    ap = argparse.ArgumentParser(description="Ingesta masiva de documentos al índice RAG")
+    ap.add_argument("source", help="Carpeta, .zip o .tar(.gz) con documentos .pdf/.txt/.md")
+    ap.add_argument("--collection", default="default")
+    ap.add_argument("--workers", type=int, default=2, help="Hilos de parseo")
+    ap.add_argument("--batch-size", type=int, default=256, help="Chunks por lote de embedding")
+    args = ap.parse_args()
+
+    from dotenv import load_dotenv
+    from server.uploads import ContentHashRegistry
+    from rag.rag_collections import collections_from_env
+
+    load_dotenv()
+    collections = collections_from_env()
+    col = collections.get(args.collection)
+    registry = ContentHashRegistry(col.hashes_path, col.docs_dir, lock=col.lock)
+
+    try:
+        stats = collections.ingest(col.name, args.source, registry=registry, workers=args.workers, batch_size=args.batch_size)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    print("[RAG] Ingesta completa:")
+    print(json.dumps(stats, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import re
+import time
+import zlib
+import hashlib
+
+import numpy as np
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# Campos de cada copia que se guardan en "sources" del chunk representante
+_SOURCE_FIELDS = ("source", "chunk_id", "doc_name", "source_type", "url")
+
+def _normalize(text):
+    return _WORD_RE.findall(text.lower())
+
+class ChunkDeduper:
+    """
+    Detección de chunks duplicados antes de generar embeddings.
+    - Exactos: mismo texto normalizado (minúsculas, solo palabras)
+    - Casi duplicados: MinHash de shingles de palabras + LSH por bandas; los candidatos se
+      confirman con la similitud de Jaccard estimada (>= threshold)
+    Se conserva la primera aparición y las copias quedan en su lista "sources".
+    """
+    def __init__(self, threshold=0.85, num_perm=64, bands=16, shingle=3, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm debe ser múltiplo de bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle = shingle
+
+        # Hash multiply-shift: (a * x + b) mod 2^64, se usan los 32 bits altos
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, 2**63, size=(num_perm, 1), dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2**63, size=(num_perm, 1), dtype=np.uint64)
+
+    def signature(self, words):
+        k = self.shingle
+        shingles = [" ".join(words[i:i + k]) for i in range(max(1, len(words) - k + 1))]
+        x = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+        with np.errstate(over="ignore"):
+            h = (self._a * x + self._b) >> np.uint64(32)
+        return h.min(axis=1).astype(np.uint32)
+
+    def dedup(self, docs, start_vid=0):
+        """
+        Devuelve (docs únicos con vids consecutivos desde start_vid, estadísticas).
+        """
+        t0 = time.perf_counter()
+        session = self.session()
+        kept = session.add(docs)
+        for i, d in enumerate(kept):
+            d["vid"] = start_vid + i
+        stats = dict(session.stats, dedup_s=round(time.perf_counter() - t0, 3))
+        return kept, stats
+
+    def session(self):
+        """Estado compartido entre lotes sucesivos (ver DedupSession)"""
+        return DedupSession(self)
+
+    def _band_keys(self, sig):
+        r = self.rows
+        return [(b, sig[b * r:(b + 1) * r].tobytes()) for b in range(self.bands)]
+
+    def _find_near(self, sig, buckets, signatures):
+        best, best_sim = None, self.threshold
+        seen = set()
+        for key in self._band_keys(sig):
+            for idx in buckets.get(key, ()):
+                if idx in seen:
+                    continue
+                seen.add(idx)
+                sim = float(np.mean(signatures[idx] == sig))
+                if sim >= best_sim:
+                    best, best_sim = idx, sim
+        return best
+
+    @staticmethod
+    def _merge(rep, dup):
+        if "sources" not in rep:
+            rep["sources"] = [{k: rep[k] for k in _SOURCE_FIELDS if k in rep}]
+        rep["sources"].append({k: dup[k] for k in _SOURCE_FIELDS if k in dup})
+
+class DedupSession:
+    """
+    Dedup de chunks que llegan por lotes (ingesta masiva): cada lote se compara con todos
+    los chunks únicos de los lotes anteriores, no solo consigo mismo.
+    - add(docs) devuelve los chunks nuevos; su posición global (0, 1, ...) es la fila del representante
+    - Las copias de representantes de lotes anteriores (ya escritos) quedan en pending_sources
+      y se agregan al escribir la fila final con apply(fila, doc)
+    Memoria: una firma MinHash por chunk único (num_perm * 4 bytes) más los buckets LSH.
+    """
+    def __init__(self, deduper):
+        self.deduper = deduper
+        self.exact = {}
+        self.buckets = {}
+        self.signatures = []
+        self.pending_sources = {}  # fila del representante -> copias en lotes posteriores
+        self.stats = {"chunks": 0, "unique": 0, "exact_duplicates": 0, "near_duplicates": 0}
+
+    def add(self, docs):
+        dd = self.deduper
+        batch = {}  # fila -> doc de este lote (las copias se fusionan directamente)
+        kept = []
+        for d in docs:
+            self.stats["chunks"] += 1
+            words = _normalize(d["text"])
+            digest = hashlib.blake2b(" ".join(words).encode("utf-8"), digest_size=16).digest()
+            rep = self.exact.get(digest)
+            if rep is not None:
+                self._merge(batch, rep, d)
+                self.stats["exact_duplicates"] += 1
+                continue
+
+            sig = dd.signature(words) if words else None
+            rep = dd._find_near(sig, self.buckets, self.signatures) if sig is not None else None
+            if rep is not None:
+                self._merge(batch, rep, d)
+                self.exact[digest] = rep
+                self.stats["near_duplicates"] += 1
+                continue
+
+            idx = len(self.signatures)
+            batch[idx] = d
+            kept.append(d)
+            self.signatures.append(sig)
+            self.exact[digest] = idx
+            if sig is not None:
+                for key in dd._band_keys(sig):
+                    self.buckets.setdefault(key, []).append(idx)
+
+        self.stats["unique"] += len(kept)
+        return kept
+
+    def _merge(self, batch, rep, dup):
+        if rep in batch:
+            ChunkDeduper._merge(batch[rep], dup)
+        else:
+            self.pending_sources.setdefault(rep, []).append({k: dup[k] for k in _SOURCE_FIELDS if k in dup})
+
+    def apply(self, row, doc):
+        """Agrega al doc de la fila las copias encontradas después de escribirlo"""
+        for dup in self.pending_sources.get(row, ()):
+            ChunkDeduper._merge(doc, dup)
+        return doc
+
+def other_sources(meta, source):
+    """Copias de un chunk deduplicado que no pertenecen a source"""
+    return [s for s in meta.get("sources") or [] if s.get("source") != source]
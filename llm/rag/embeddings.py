@@ -0,0 +1,99 @@
+import time
+
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+
+EMBED_BACKENDS = ("torch", "int8")
+
+# Frases de control para comparar el modelo cuantizado con el fp32
+PARITY_TEXTS = [
+    "¿Cuál es el plazo para presentar la declaración de impuestos?",
+    "El índice vectorial se reconstruye cuando cambian los documentos.",
+    "La reunión de seguimiento se movió al jueves a las diez de la mañana.",
+    "Instrucciones de instalación del servidor con Docker y GPU.",
+    "Resumen del informe trimestral de ventas por región.",
+    "How do I reset my password if I no longer have access to my email?",
+    "The contract may be terminated by either party with thirty days notice.",
+    "Mitochondria are the site of cellular respiration in eukaryotic cells.",
+    "Receta: mezclar harina, huevos y leche hasta obtener una masa homogénea.",
+    "Los pacientes con hipertensión deben controlar el consumo de sodio.",
+    "El artículo 14 establece los requisitos de acceso a la información pública.",
+    "Python list comprehensions are usually faster than explicit loops.",
+]
+
+def set_threads(threads):
+    """
+    Hilos de PyTorch para inferencia en CPU (intra-op). interop solo se puede fijar
+    antes del primer trabajo en paralelo, si ya es tarde se ignora.
+    """
+    if not threads:
+        return
+    torch.set_num_threads(int(threads))
+    try:
+        torch.set_num_interop_threads(max(1, int(threads) // 2))
+    except RuntimeError:
+        pass
+
+def _quantized_engine():
+    # fbgemm/x86 en Intel/AMD, qnnpack en ARM
+    supported = torch.backends.quantized.supported_engines
+    for engine in ("x86", "fbgemm", "qnnpack"):
+        if engine in supported:
+            return engine
+    return None
+
+def quantize_int8(model):
+    """
+    Cuantización dinámica int8 de las capas Linear (pesos int8, activaciones cuantizadas
+    en cada llamada). Devuelve una copia, el modelo original no se modifica.
+    """
+    engine = _quantized_engine()
+    if engine is None:
+        raise RuntimeError("PyTorch no tiene un backend de cuantización disponible en esta CPU")
+    torch.backends.quantized.engine = engine
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+def parity_check(reference, candidate, texts=None):
+    """
+    Similitud coseno entre los embeddings de ambos modelos para los mismos textos.
+    Devuelve {"mean": ..., "min": ..., "n": ...}.
+    """
+    texts = texts or PARITY_TEXTS
+    a = reference.encode(texts, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False)
+    b = candidate.encode(texts, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False)
+    cos = np.sum(a * b, axis=1)
+    return {"mean": round(float(cos.mean()), 5), "min": round(float(cos.min()), 5), "n": len(texts)}
+
+def load_embedder(model_name, backend="torch", threads=None, min_cosine=0.98):
+    """
+    Carga el modelo de embedding según el backend:
+    - torch: SentenceTransformer fp32 (GPU si hay, si no CPU)
+    - int8: SentenceTransformer en CPU con cuantización dinámica int8. Se compara con el
+      fp32 (parity_check) y si la similitud mínima queda bajo min_cosine se usa el fp32
+    threads: hilos de PyTorch en CPU (None = valor por defecto de PyTorch)
+    """
+    if backend not in EMBED_BACKENDS:
+        raise ValueError(f"Backend de embeddings no soportado: '{backend}'. Opciones: {', '.join(EMBED_BACKENDS)}")
+
+    if backend == "torch":
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        if device == "cpu":
+            set_threads(threads)
+        return SentenceTransformer(model_name, device=device)
+
+    set_threads(threads)
+    model = SentenceTransformer(model_name, device="cpu")
+    t0 = time.perf_counter()
+    try:
+        quantized = quantize_int8(model)
+    except RuntimeError as e:
+        print(f"[RAG] No se pudo cuantizar el modelo de embedding, se usa fp32: {e}")
+        return model
+
+    parity = parity_check(model, quantized)
+    print(f"[RAG] Embeddings int8 listos en {time.perf_counter() - t0:.2f}s (coseno vs fp32: medio {parity['mean']}, mínimo {parity['min']})")
+    if parity["min"] < min_cosine:
+        print(f"[RAG] Similitud bajo {min_cosine}, se usa el modelo fp32")
+        return model
+    return quantized
@@ -1,7 +1,11 @@
-import json, requests, hashlib, os
+import json, requests, hashlib, os, re, time, sqlite3, asyncio, threading, unicodedata
 from pathlib import Path
 from datetime import datetime
 
+import httpx
+
+from server.tracing import span
+
 def call_api(query, API_URL, API_KEY):
   if not API_KEY:
       raise RuntimeError("Error: No se encontró la API_KEY de langsearch en el archivo .env")
@@ -9,17 +13,7 @@ def call_api(query, API_URL, API_KEY):
       raise RuntimeError("Error: No se ha especificado ninguna query")
 
   # Armar payload y headers
-  payload = {
-    "query": query,
-    "freshness": "onLimit",
-    "summary": True,
-    "count": 10
-  }
-
-  headers = {
-    "Content-Type": "application/json",
-    "Authorization": f"Bearer {API_KEY}",
-  }
+  payload, headers = _build_request(query, API_KEY)
 
   # Hacer la petición a la API
   try:
@@ -34,6 +28,147 @@ def call_api(query, API_URL, API_KEY):
   except json.JSONDecodeError:
     return resp.text
 
+def _build_request(query, API_KEY, freshness="onLimit", count=10):
+  payload = {
+    "query": query,
+    "freshness": freshness,
+    "summary": True,
+    "count": count
+  }
+
+  headers = {
+    "Content-Type": "application/json",
+    "Authorization": f"Bearer {API_KEY}",
+  }
+  return payload, headers
+
+def normalize_query(query):
+  """Normaliza la query para el caché: unicode, minúsculas, espacios y puntuación final"""
+  q = unicodedata.normalize("NFKC", query or "").lower()
+  q = re.sub(r"\s+", " ", q).strip()
+  return q.strip("¿?¡!.,;: ")
+
+class SearchCache:
+  """
+  Caché en SQLite de respuestas de LangSearch, clave (query normalizada, freshness, count) con TTL.
+  """
+  def __init__(self, db_path, ttl_s):
+    self.db_path = db_path
+    self.ttl_s = ttl_s
+    os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+    self.lock = threading.Lock()
+    self._con = None
+    with self.lock:
+      self._conn().execute("""
+        CREATE TABLE IF NOT EXISTS SEARCH_CACHE (
+          key TEXT PRIMARY KEY,
+          query TEXT NOT NULL,
+          response TEXT NOT NULL,
+          created_at REAL NOT NULL
+        )
+      """)
+
+  def _conn(self):
+    # Conexión persistente (los PRAGMA se ejecutan una sola vez), protegida por self.lock
+    if self._con is None:
+      self._con = sqlite3.connect(self.db_path, timeout=5, isolation_level=None, check_same_thread=False)
+      self._con.execute("PRAGMA journal_mode=WAL;")
+      self._con.execute("PRAGMA synchronous=NORMAL;")
+    return self._con
+
+  def close(self):
+    with self.lock:
+      if self._con is not None:
+        self._con.close()
+        self._con = None
+
+  @staticmethod
+  def _key(query, freshness, count):
+    raw = f"{normalize_query(query)}|{freshness}|{count}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+  def get(self, query, freshness, count):
+    with self.lock:
+      row = self._conn().execute(
+        "SELECT response, created_at FROM SEARCH_CACHE WHERE key=?",
+        (self._key(query, freshness, count),),
+      ).fetchone()
+    if row is None or (time.time() - row[1]) > self.ttl_s:
+      return None
+    return json.loads(row[0])
+
+  def put(self, query, freshness, count, response):
+    with self.lock:
+      con = self._conn()
+      con.execute(
+        "INSERT OR REPLACE INTO SEARCH_CACHE (key, query, response, created_at) VALUES (?, ?, ?, ?)",
+        (self._key(query, freshness, count), normalize_query(query), json.dumps(response, ensure_ascii=False), time.time()),
+      )
+      # Limpiar entradas vencidas
+      con.execute("DELETE FROM SEARCH_CACHE WHERE created_at < ?", (time.time() - self.ttl_s,))
+
+class LangSearchClient:
+  """
+  Cliente asíncrono de LangSearch con conexiones keep-alive reutilizadas y caché en disco.
+  Los aciertos de caché no consumen cuota (no pasan por el rate limiter).
+  """
+  def __init__(self, API_URL, API_KEY, cache=None, timeout=30, max_connections=10):
+    self.api_url = API_URL
+    self.api_key = API_KEY
+    self.cache = cache
+    self.timeout = timeout
+    self.max_connections = max_connections
+    self._client = None
+    self.stats = {"cache_hits": 0, "cache_misses": 0, "api_calls": 0}
+
+  def _get_client(self):
+    if self._client is None:
+      self._client = httpx.AsyncClient(
+        timeout=self.timeout,
+        limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+      )
+    return self._client
+
+  async def search(self, query, rate_limiter, freshness="onLimit", count=10):
+    if not self.api_key:
+      raise RuntimeError("Error: No se encontró la API_KEY de langsearch en el archivo .env")
+    if not query:
+      raise RuntimeError("Error: No se ha especificado ninguna query")
+
+    if self.cache:
+      cached = await asyncio.to_thread(self.cache.get, query, freshness, count)
+      if cached is not None:
+        self.stats["cache_hits"] += 1
+        return cached
+      self.stats["cache_misses"] += 1
+
+    await rate_limiter.acquire()
+
+    payload, headers = _build_request(query, self.api_key, freshness, count)
+    try:
+      resp = await self._get_client().post(self.api_url, json=payload, headers=headers)
+      resp.raise_for_status()
+    except httpx.HTTPError as e:
+      raise RuntimeError(f"Error al llamar a la API: {e}") from e
+    self.stats["api_calls"] += 1
+
+    try:
+      results = resp.json()
+    except json.JSONDecodeError:
+      return resp.text
+
+    # Solo se cachean respuestas válidas
+    if self.cache and isinstance(results, dict):
+      await asyncio.to_thread(self.cache.put, query, freshness, count, results)
+    return results
+
+  async def aclose(self):
+    if self._client is not None:
+      await self._client.aclose()
+      self._client = None
+    if self.cache:
+      self.cache.close()
+
 def _sanitize_text(s):
   """Normalizador de texto"""
   if s is None:
@@ -105,7 +240,26 @@ def get_webpages(query, rate_limiter, WEB_DIR, API_URL, API_KEY):
   rate_limiter.check_usage()
 
   results = call_api(query, API_URL, API_KEY)
+  return save_webpages(results, WEB_DIR)
+
+async def aget_webpages(query, client, rate_limiter, WEB_DIR):
+  """
+  Versión asíncrona de get_webpages usando LangSearchClient (pool de conexiones + caché).
+  Las páginas se devuelven en memoria [(ruta, markdown), ...], sin escribirlas a disco
+  (ver write_webpages para persistirlas).
+  """
+  with span("web.search", query_chars=len(query)):
+    results = await client.search(query, rate_limiter)
+  with span("web.render") as s:
+    rendered = render_webpages(results, WEB_DIR)
+    s.set(pages=len(rendered), bytes=sum(len(md.encode("utf-8")) for _, md in rendered))
+  return rendered
 
+def render_webpages(results, WEB_DIR):
+  """
+  Genera en memoria (ruta, markdown) de cada página, sin escribir a disco.
+  La ruta es donde se guardaría la página si se persiste.
+  """
   # Validar estructura
   pages = (
     results.get("data", {})
@@ -113,10 +267,8 @@ def get_webpages(query, rate_limiter, WEB_DIR, API_URL, API_KEY):
       .get("value", [])
     if isinstance(results, dict) else []
   )
-  if not pages:
-    return []
 
-  saved = []
+  rendered = []
   for r in pages:
     url = r.get("url", "")
     title = r.get("name", "")
@@ -126,13 +278,27 @@ def get_webpages(query, rate_limiter, WEB_DIR, API_URL, API_KEY):
     if not url:
       continue
 
-    name = f"web_{_hash(url)}.md"
-    path = Path(WEB_DIR) / name
+    path = Path(WEB_DIR) / f"web_{_hash(url)}.md"
+    rendered.append((str(path), create_md(url, title, snippet, summary)))
 
-    if not path.exists():
-      md = create_md(url, title, snippet, summary)
-      path.write_text(md, encoding="utf-8")
+  return rendered
+
+def write_webpages(rendered):
+  """
+  Escribe las páginas renderizadas que aún no existen. Devuelve solo las rutas nuevas.
+  """
+  created = []
+  for path, md in rendered:
+    path = Path(path)
+    if path.exists():
+      continue
+    os.makedirs(path.parent, exist_ok=True)
+    path.write_text(md, encoding="utf-8")
+    created.append(str(path))
 
-    saved.append(str(path))
+  return created
 
-  return saved
+def save_webpages(results, WEB_DIR):
+  rendered = render_webpages(results, WEB_DIR)
+  write_webpages(rendered)
+  return [path for path, _ in rendered]
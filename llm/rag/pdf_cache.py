@@ -0,0 +1,171 @@
+import os
+import time
+import zlib
+import sqlite3
+import hashlib
+
+import pypdf
+from pypdf import PdfReader
+
+# Cambiar el sufijo invalida el caché cuando cambie la lógica de extracción
+EXTRACTOR_VERSION = f"pypdf-{pypdf.__version__}-1"
+
+# Páginas extraídas por transacción
+_COMMIT_EVERY = 16
+
+def _file_digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def extract_pages(path):
+    """
+    Extrae el texto página por página (sin cargar todo el documento en una lista).
+    """
+    reader = PdfReader(str(path))
+    for page in reader.pages:
+        yield page.extract_text() or ""
+
+class PdfTextCache:
+    """
+    Caché en disco (SQLite + zlib) del texto extraído de cada página de un PDF.
+    La clave es (sha256 del archivo, versión del extractor): solo se vuelven a
+    procesar los PDFs nuevos o modificados.
+    max_bytes: tamaño máximo del texto guardado, prune() descarta los PDFs menos usados.
+    """
+    def __init__(self, db_path, extractor_version=EXTRACTOR_VERSION, max_bytes=None):
+        self.db_path = db_path
+        self.extractor = extractor_version
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self._ensure_tables()
+
+    def _conn(self):
+        con = sqlite3.connect(self.db_path, timeout=30)
+        con.execute("PRAGMA journal_mode=WAL;")
+        con.execute("PRAGMA synchronous=NORMAL;")
+        return con
+
+    def _ensure_tables(self):
+        with self._conn() as con:
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS PDF_DOCS (
+                    sha256 TEXT NOT NULL,
+                    extractor TEXT NOT NULL,
+                    pages INTEGER NOT NULL,
+                    used REAL NOT NULL DEFAULT 0,
+                    PRIMARY KEY (sha256, extractor)
+                )
+            """)
+            # Cachés creados antes de registrar el último uso
+            if "used" not in {c[1] for c in con.execute("PRAGMA table_info(PDF_DOCS)")}:
+                con.execute("ALTER TABLE PDF_DOCS ADD COLUMN used REAL NOT NULL DEFAULT 0")
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS PDF_PAGES (
+                    sha256 TEXT NOT NULL,
+                    extractor TEXT NOT NULL,
+                    page INTEGER NOT NULL,
+                    text BLOB NOT NULL,
+                    PRIMARY KEY (sha256, extractor, page)
+                )
+            """)
+
+    def pages(self, path):
+        """
+        Devuelve un generador con el texto de cada página.
+        - Cache hit: se lee desde SQLite sin abrir el PDF
+        - Cache miss: se extrae página por página guardando cada una (reanuda extracciones parciales)
+        """
+        digest = _file_digest(path)
+        con = self._conn()
+        try:
+            row = con.execute(
+                "SELECT pages FROM PDF_DOCS WHERE sha256=? AND extractor=?",
+                (digest, self.extractor),
+            ).fetchone()
+
+            if row is not None:
+                con.execute(
+                    "UPDATE PDF_DOCS SET used=? WHERE sha256=? AND extractor=?",
+                    (time.time(), digest, self.extractor),
+                )
+                con.commit()
+                cur = con.execute(
+                    "SELECT text FROM PDF_PAGES WHERE sha256=? AND extractor=? ORDER BY page",
+                    (digest, self.extractor),
+                )
+                for (blob,) in cur:
+                    yield zlib.decompress(blob).decode("utf-8")
+                return
+
+            # Páginas ya guardadas por una extracción interrumpida
+            done = {
+                p for (p,) in con.execute(
+                    "SELECT page FROM PDF_PAGES WHERE sha256=? AND extractor=?",
+                    (digest, self.extractor),
+                )
+            }
+
+            reader = PdfReader(str(path))
+            n = 0
+            for i, page in enumerate(reader.pages):
+                n = i + 1
+                if i in done:
+                    (blob,) = con.execute(
+                        "SELECT text FROM PDF_PAGES WHERE sha256=? AND extractor=? AND page=?",
+                        (digest, self.extractor, i),
+                    ).fetchone()
+                    yield zlib.decompress(blob).decode("utf-8")
+                    continue
+
+                text = page.extract_text() or ""
+                con.execute(
+                    "INSERT OR REPLACE INTO PDF_PAGES (sha256, extractor, page, text) VALUES (?, ?, ?, ?)",
+                    (digest, self.extractor, i, zlib.compress(text.encode("utf-8"))),
+                )
+                if n % _COMMIT_EVERY == 0:
+                    con.commit()
+                yield text
+
+            con.execute(
+                "INSERT OR REPLACE INTO PDF_DOCS (sha256, extractor, pages, used) VALUES (?, ?, ?, ?)",
+                (digest, self.extractor, n, time.time()),
+            )
+            con.commit()
+        finally:
+            con.close()
+
+    def prune(self):
+        """
+        Elimina el texto de otras versiones del extractor y, si se superó max_bytes,
+        los PDFs usados hace más tiempo (las extracciones incompletas primero).
+        Devuelve la cantidad de documentos eliminados.
+        """
+        con = self._conn()
+        try:
+            con.execute("DELETE FROM PDF_PAGES WHERE extractor<>?", (self.extractor,))
+            removed = con.execute("DELETE FROM PDF_DOCS WHERE extractor<>?", (self.extractor,)).rowcount
+
+            if self.max_bytes:
+                rows = con.execute("""
+                    SELECT p.sha256, SUM(LENGTH(p.text)), COALESCE(MAX(d.used), 0)
+                    FROM PDF_PAGES p
+                    LEFT JOIN PDF_DOCS d ON d.sha256 = p.sha256 AND d.extractor = p.extractor
+                    GROUP BY p.sha256
+                    ORDER BY 3
+                """).fetchall()
+                total = sum(size for _, size, _ in rows)
+                for digest, size, _ in rows:
+                    if total <= self.max_bytes:
+                        break
+                    con.execute("DELETE FROM PDF_PAGES WHERE sha256=?", (digest,))
+                    con.execute("DELETE FROM PDF_DOCS WHERE sha256=?", (digest,))
+                    total -= size
+                    removed += 1
+
+            con.commit()
+            return removed
+        finally:
+            con.close()
@@ -0,0 +1,388 @@
+import os, re, time, threading
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # Windows: solo lock entre hilos
+    fcntl = None
+
+from rag.embeddings import load_embedder
+from rag.rag_indexer import RAGIndexer
+from rag.rag_retriever import RAGRetriever, EphemeralIndex
+from rag.rag_snapshot import snapshot_nbytes
+from rag.bulk_ingest import BulkIngestor
+from rag.web_store import WebPageStore
+
+DEFAULT_COLLECTION = "default"
+_NAME_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_\-]{0,63}$")
+
+class CollectionLock:
+    """
+    Lock reentrante de una colección: entre hilos (RLock) y entre procesos (flock sobre
+    {meta}.lock), para las réplicas del servidor que comparten la carpeta de datos.
+    Protege el reindexado, la escritura de snapshots y las altas/bajas del journal.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        if self._depth == 0 and fcntl is not None:
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                except BaseException:
+                    os.close(fd)
+                    raise
+            except BaseException:
+                self._lock.release()
+                raise
+            self._fd = fd
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            fd, self._fd = self._fd, None
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+        self._lock.release()
+
+class RAGCollection:
+    """
+    Rutas y lock de una colección (una por conversación o workspace).
+    """
+    def __init__(self, name, docs_dir, web_dir, index_path, meta_path):
+        self.name = name
+        self.docs_dir = docs_dir
+        self.web_dir = web_dir
+        self.index_path = index_path
+        self.meta_path = meta_path
+        self.hashes_path = os.path.splitext(meta_path)[0] + ".hashes.json"
+        self.lock = CollectionLock(meta_path + ".lock")
+
+    def disk_size(self):
+        """Tamaño en bytes del snapshot completo (estimación de memoria al cargar)"""
+        return snapshot_nbytes(self.index_path, self.meta_path)
+
+class RAGCollections:
+    """
+    Administra colecciones RAG independientes, cada una con su propio índice y metadatos.
+    - La colección por defecto usa las rutas históricas (DOCS_DIR, WEB_DIR, RAG_INDEX_PATH, RAG_META_PATH)
+    - El resto vive en {base_dir}/{nombre}/
+    - Los retrievers cargados se mantienen en un LRU limitado por memoria (max_loaded_mb)
+    - Las páginas web de cada colección tienen retención acotada (web_ttl_s, web_max_files, web_max_bytes)
+    - Backend de embeddings: embed_backend (torch | int8) y embed_threads (ver rag.embeddings)
+    - Chunks duplicados o casi duplicados se indexan una vez (dedup_threshold, ver rag.dedup)
+    - Varios procesos pueden compartir las carpetas: las escrituras toman el lock de la colección
+      (también entre procesos) y recargan el snapshot si otro proceso lo cambió (_current)
+    """
+    def __init__(self, base_dir, default_docs_dir, default_web_dir, default_index_path, default_meta_path, embed_model_name, max_loaded_mb, index_type="flat", text_cache=None, shards=1, shard_by="id", web_ttl_s=None, web_max_files=None, web_max_bytes=None, embed_backend="torch", embed_threads=None, dedup_threshold=0.85):
+        self.base_dir = base_dir
+        self.embed_model_name = embed_model_name
+        self.index_type = index_type
+        self.text_cache = text_cache
+        self.shards = shards
+        self.shard_by = shard_by
+        self.max_loaded_bytes = int(max_loaded_mb * 1024 * 1024)
+        self.web_limits = (web_ttl_s, web_max_files, web_max_bytes)
+        self.dedup_threshold = dedup_threshold
+
+        # Un único modelo de embedding compartido por todas las colecciones (fp32 o int8 en CPU)
+        self.model = load_embedder(embed_model_name, embed_backend, embed_threads)
+
+        self._default = RAGCollection(
+            DEFAULT_COLLECTION, default_docs_dir, default_web_dir, default_index_path, default_meta_path
+        )
+        self._collections = {DEFAULT_COLLECTION: self._default}
+        self._loaded = OrderedDict()  # nombre -> RAGRetriever (orden LRU)
+        self._sizes = {}  # nombre -> bytes del snapshot al cargarlo
+        self._web_stores = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def validate_name(name):
+        name = (name or DEFAULT_COLLECTION).strip()
+        if not _NAME_RE.match(name):
+            raise ValueError(f"Nombre de colección inválido: '{name}'")
+        return name
+
+    def get(self, name):
+        """
+        Devuelve la colección (rutas) creando su entrada si no existe.
+        """
+        name = self.validate_name(name)
+        with self._lock:
+            col = self._collections.get(name)
+            if col is None:
+                root = os.path.join(self.base_dir, name)
+                col = RAGCollection(
+                    name,
+                    os.path.join(root, "docs"),
+                    os.path.join(root, "web"),
+                    os.path.join(root, "index.faiss"),
+                    os.path.join(root, "meta.jsonl"),
+                )
+                self._collections[name] = col
+            return col
+
+    def list(self):
+        names = {DEFAULT_COLLECTION}
+        if os.path.isdir(self.base_dir):
+            for n in os.listdir(self.base_dir):
+                if _NAME_RE.match(n) and os.path.isdir(os.path.join(self.base_dir, n)):
+                    names.add(n)
+
+        with self._lock:
+            loaded = set(self._loaded.keys())
+        return [{"name": n, "loaded": n in loaded} for n in sorted(names)]
+
+    """
+    Carga y reindexado
+    """
+    def retriever(self, name):
+        """
+        Devuelve el retriever de la colección, cargándolo desde disco si no está en memoria.
+        """
+        col = self.get(name)
+        with self._lock:
+            r = self._loaded.get(col.name)
+            if r is not None:
+                self._loaded.move_to_end(col.name)
+                return r
+
+        with col.lock:
+            with self._lock:
+                r = self._loaded.get(col.name)
+            if r is None:
+                r = self._retriever(col)
+                self._put(col.name, r)
+        return r
+
+    def _current(self, col):
+        """
+        Retriever para modificar la colección (con col.lock tomado): si otra réplica publicó
+        un snapshot o agregó cambios al journal, se recarga antes de escribir.
+        """
+        r = self.retriever(col.name)
+        if r.stale():
+            r = self._retriever(col)
+            self._put(col.name, r)
+        return r
+
+    def rebuild(self, name):
+        """
+        Reindexa solo los documentos de la colección y recarga su retriever.
+        """
+        col = self.get(name)
+        with col.lock:
+            os.makedirs(col.docs_dir, exist_ok=True)
+            os.makedirs(col.web_dir, exist_ok=True)
+            # Las páginas desalojadas no se reindexan (el índice se reconstruye completo)
+            self.web_store(col.name).enforce()
+            self._indexer(col).main()
+            r = self._retriever(col)
+            self._put(col.name, r)
+        return r
+
+    def reload(self, name):
+        """
+        Vuelve a cargar el snapshot de la colección desde disco.
+        """
+        col = self.get(name)
+        with col.lock:
+            r = self._retriever(col)
+            self._put(col.name, r)
+        return r
+
+    def ingest(self, name, source, registry=None, workers=2, batch_size=256, max_file_bytes=None):
+        """
+        Ingesta masiva desde una carpeta o archivo .zip/.tar (ver rag.bulk_ingest).
+        Devuelve estadísticas de rendimiento (docs/s, chunks/s, tiempos por etapa).
+        """
+        ingestor = BulkIngestor(self, name, registry, workers, batch_size, max_file_bytes=max_file_bytes)
+        return ingestor.run(source)
+
+    def _indexer(self, col):
+        return RAGIndexer(
+            [col.docs_dir, col.web_dir], col.index_path, col.meta_path, self.embed_model_name,
+            model=self.model, index_type=self.index_type, text_cache=self.text_cache,
+            shards=self.shards, shard_by=self.shard_by, dedup_threshold=self.dedup_threshold
+        )
+
+    def _retriever(self, col):
+        return RAGRetriever(
+            col.index_path, col.meta_path, self.embed_model_name,
+            model=self.model, shards=self.shards, shard_by=self.shard_by
+        )
+
+    """
+    Altas, bajas y reemplazos incrementales
+    """
+    def add_files(self, name, paths):
+        """
+        Indexa solo los archivos indicados (chunks + embeddings) y los agrega al índice vigente.
+        """
+        col = self.get(name)
+        with col.lock:
+            r = self._current(col)
+            docs, emb = self._indexer(col).index_files(paths, r.next_id)
+            return r.add_documents(docs, emb)
+
+    def delete_file(self, name, path):
+        """
+        Elimina del índice los chunks de un archivo. Devuelve la cantidad eliminada.
+        """
+        col = self.get(name)
+        with col.lock:
+            return self._current(col).delete_source(str(path))
+
+    def replace_file(self, name, path):
+        """
+        Reemplaza los chunks de un archivo ya modificado en disco: baja de los anteriores + alta de los nuevos.
+        """
+        col = self.get(name)
+        with col.lock:
+            removed = self.delete_file(col.name, path)
+            added = self.add_files(col.name, [path])
+            return removed, added
+
+    def ephemeral_index(self, name, rendered):
+        """
+        Índice en memoria con documentos markdown ya renderizados [(ruta, markdown), ...].
+        """
+        indexer = self._indexer(self.get(name))
+        entries = [(src, *indexer.read_md_text(md, src)) for src, md in rendered]
+        # Los resultados web suelen repetir el mismo resumen en varias URLs
+        docs = indexer.dedup(indexer.chunk_docs(entries))
+        if not docs:
+            return None
+        return EphemeralIndex(docs, indexer.embed([d["text"] for d in docs], show_progress_bar=False))
+
+    """
+    Retención de páginas web
+    """
+    def web_store(self, name):
+        col = self.get(name)
+        with self._lock:
+            store = self._web_stores.get(col.name)
+            if store is None:
+                store = WebPageStore(col.web_dir, *self.web_limits)
+                self._web_stores[col.name] = store
+            return store
+
+    def record_hits(self, name, hits):
+        """Registra los hits de páginas web (LRU de retención)"""
+        sources = [h.get("source") for h in hits if h.get("source_type") == "site"]
+        if sources:
+            self.web_store(name).touch(sources)
+
+    def enforce_web_retention(self, name):
+        """
+        Desaloja páginas web vencidas o que exceden los límites, con baja incremental en el índice.
+        """
+        col = self.get(name)
+        with col.lock:
+            return self.web_store(col.name).enforce(lambda path: self.delete_file(col.name, path))
+
+    def compact_loaded(self, min_changes, ratio):
+        """
+        Compacta las colecciones cargadas con suficientes cambios pendientes.
+        """
+        with self._lock:
+            loaded = list(self._loaded.items())
+
+        for name, r in loaded:
+            pending = r.pending_changes()
+            if pending == 0 or pending < max(min_changes, ratio * r.ntotal):
+                continue
+            col = self._collections[name]
+            with col.lock:
+                with self._lock:
+                    if self._loaded.get(name) is not r:
+                        continue  # Desalojada o recargada mientras tanto
+                try:
+                    if self._current(col).compact():
+                        size = col.disk_size()
+                        with self._lock:
+                            if name in self._sizes:
+                                self._sizes[name] = size
+                except Exception as e:
+                    print(f"[RAG] Error compactando colección '{name}': {e}")
+
+    def start_compactor(self, interval_s, min_changes, ratio):
+        """
+        Hilo en segundo plano que aplica la retención web y compacta periódicamente (delta + tombstones -> snapshot).
+        """
+        def _loop():
+            while True:
+                time.sleep(interval_s)
+                with self._lock:
+                    names = list(self._loaded.keys())
+                for name in names:
+                    try:
+                        self.enforce_web_retention(name)
+                    except Exception as e:
+                        print(f"[RAG] Error en retención web de '{name}': {e}")
+                self.compact_loaded(min_changes, ratio)
+
+        t = threading.Thread(target=_loop, name="rag-compactor", daemon=True)
+        t.start()
+        return t
+
+    def _put(self, name, retriever):
+        # Tamaño medido una vez al cargar (y al compactar), no en cada desalojo
+        size = self._collections[name].disk_size()
+        with self._lock:
+            old = self._loaded.get(name)
+            self._loaded[name] = retriever
+            self._loaded.move_to_end(name)
+            self._sizes[name] = size
+            self._evict()
+        if old is not None and old is not retriever:
+            old.release()
+
+    def _evict(self):
+        # Descargar colecciones inactivas hasta respetar el presupuesto (siempre se mantiene la más reciente)
+        total = sum(self._sizes[n] for n in self._loaded)
+        while total > self.max_loaded_bytes and len(self._loaded) > 1:
+            old, r = self._loaded.popitem(last=False)
+            total -= self._sizes.pop(old)
+            r.release()
+            print(f"[RAG] Colección '{old}' descargada de memoria (LRU)")
+
+def collections_from_env():
+    """
+    RAGCollections con la configuración RAG_* / WEB_* del entorno. La usan el servidor y la
+    ingesta por línea de comandos para escribir snapshots con los mismos ajustes
+    (tipo de índice, shards, backend de embeddings, dedup).
+    """
+    from rag.pdf_cache import PdfTextCache
+
+    index_path = os.getenv("RAG_INDEX_PATH")
+    base = os.path.dirname(index_path or ".")
+    return RAGCollections(
+        os.getenv("RAG_COLLECTIONS_DIR") or os.path.join(base, "collections"),
+        os.getenv("DOCS_DIR"), os.getenv("WEB_DIR"), index_path, os.getenv("RAG_META_PATH"),
+        os.getenv("RAG_EMBED_MODEL"),
+        float(os.getenv("RAG_COLLECTIONS_MEM_MB", "1024")),
+        os.getenv("RAG_INDEX_TYPE", "flat"),  # flat | fp16 | sq8 | pq
+        PdfTextCache(
+            os.getenv("RAG_TEXT_CACHE_PATH") or os.path.join(base, "pdf_text_cache.db"),
+            max_bytes=int(float(os.getenv("RAG_TEXT_CACHE_MB", "512")) * 1024 * 1024),
+        ),
+        int(os.getenv("RAG_SHARDS", "1")),
+        os.getenv("RAG_SHARD_BY", "id"),  # id | source
+        float(os.getenv("WEB_TTL_H", "168")) * 3600,  # Antigüedad máxima de páginas web (0 = sin límite)
+        int(os.getenv("WEB_MAX_FILES", "2000")),
+        int(float(os.getenv("WEB_MAX_MB", "200")) * 1024 * 1024),
+        os.getenv("RAG_EMBED_BACKEND", "torch"),  # torch | int8 (CPU sin GPU)
+        int(os.getenv("RAG_EMBED_THREADS", "0")) or None,
+        float(os.getenv("RAG_DEDUP_THRESHOLD", "0.85")),  # Jaccard para casi duplicados (0 = desactivado)
+    )
@@ -0,0 +1,128 @@
+import faiss
+import numpy as np
+
+# Tipos de almacenamiento soportados para los vectores
+# - flat: float32 sin compresión (4 bytes por dimensión)
+# - fp16: float16 (2 bytes por dimensión)
+# - sq8 : cuantización escalar int8 (1 byte por dimensión)
+# - pq  : product quantization (pq_m bytes por vector)
+INDEX_TYPES = ("flat", "fp16", "sq8", "pq")
+
+# Mínimo de vectores para entrenar PQ con 8 bits (256 centroides por subespacio)
+PQ_MIN_TRAIN = 256 * 4
+
+def _pq_subquantizers(dim, pq_m):
+    # PQ requiere que m divida la dimensión, usar el mayor divisor <= pq_m
+    m = max(1, min(int(pq_m), dim))
+    while dim % m != 0:
+        m -= 1
+    return m
+
+def empty_index(dim):
+    """
+    Índice vacío válido para cualquier tipo (no requiere entrenamiento).
+    """
+    return faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+
+def build_index(emb, index_type="flat", pq_m=96, ids=None):
+    """
+    Construye un índice de producto interno con el almacenamiento indicado.
+    Los embeddings deben venir normalizados (IP = coseno).
+    Los vectores se guardan con ids int64 (IndexIDMap2) para poder eliminarlos por id,
+    por defecto 0..n-1 (posición en los metadatos).
+    """
+    index_type = (index_type or "flat").lower()
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Tipo de índice no soportado: '{index_type}'. Opciones: {', '.join(INDEX_TYPES)}")
+
+    emb = np.ascontiguousarray(emb, dtype="float32")
+    n, dim = emb.shape
+
+    if index_type == "pq" and n < PQ_MIN_TRAIN:
+        print(f"[RAG] PQ requiere al menos {PQ_MIN_TRAIN} vectores para entrenar ({n} disponibles), usando sq8")
+        index_type = "sq8"
+
+    if index_type == "flat":
+        index = faiss.IndexFlatIP(dim)
+    elif index_type == "fp16":
+        index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT)
+    elif index_type == "sq8":
+        index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+    else:
+        m = _pq_subquantizers(dim, pq_m)
+        index = faiss.IndexPQ(dim, m, 8, faiss.METRIC_INNER_PRODUCT)
+
+    if not index.is_trained:
+        index.train(emb)
+
+    if ids is None:
+        ids = np.arange(n, dtype="int64")
+    index = faiss.IndexIDMap2(index)
+    index.add_with_ids(emb, np.ascontiguousarray(ids, dtype="int64"))
+
+    return index
+
+def to_id_map(index):
+    """
+    Convierte un índice sin ids (formato anterior) a IndexIDMap2 con ids 0..n-1.
+    """
+    if isinstance(index, faiss.IndexIDMap2):
+        return index
+
+    vectors = index.reconstruct_n(0, index.ntotal) if index.ntotal else None
+    inner = faiss.clone_index(index)
+    inner.reset()
+    index = faiss.IndexIDMap2(inner)
+    if vectors is not None:
+        index.add_with_ids(vectors, np.arange(vectors.shape[0], dtype="int64"))
+    return index
+
+def id_selector(ids):
+    return faiss.IDSelectorBatch(np.ascontiguousarray(list(ids), dtype="int64"))
+
+def split_index(index, assign, n):
+    """
+    Divide un IndexIDMap2 en n shards copiando sus códigos (sin recodificar vectores).
+    assign indica el shard de cada fila del índice (mismo orden que index.id_map).
+    """
+    inner = faiss.downcast_index(index.index)
+    ids = faiss.vector_to_array(index.id_map)
+    codes = faiss.vector_to_array(inner.codes).reshape(index.ntotal, inner.code_size)
+
+    shards = []
+    for s in range(n):
+        sub = faiss.clone_index(inner)
+        sub.reset()
+        shard = faiss.IndexIDMap2(sub)
+        mask = assign == s
+        if mask.any():
+            shard.add_sa_codes(np.ascontiguousarray(codes[mask]), np.ascontiguousarray(ids[mask]))
+        shards.append(shard)
+
+    return shards
+
+def merge_indexes(shards):
+    """Une shards del mismo tipo en un único índice escribible"""
+    index = faiss.clone_index(shards[0])
+    for shard in shards[1:]:
+        if shard.ntotal:
+            index.merge_from(shard)
+    return index
+
+def index_nbytes(index):
+    """
+    Tamaño aproximado del índice en memoria (bytes), sin serializarlo:
+    códigos de los vectores (ntotal * code_size), tablas del cuantizador y mapa de ids.
+    """
+    nbytes, inner = 0, index
+    if hasattr(index, "id_map"):
+        # IndexIDMap2 guarda además el mapa inverso id -> fila
+        nbytes += index.id_map.size() * 8 * (2 if isinstance(index, faiss.IndexIDMap2) else 1)
+        inner = index.index
+    inner = faiss.downcast_index(inner)
+    nbytes += inner.ntotal * inner.sa_code_size()
+    if hasattr(inner, "pq"):
+        nbytes += inner.pq.centroids.size() * 4
+    if hasattr(inner, "sq"):
+        nbytes += inner.sq.trained.size() * 4
+    return int(nbytes)
@@ -1,14 +1,18 @@
-import uuid, json, os
+import uuid, os, time
 from pathlib import Path
 
 import yaml
-import faiss
 import torch
-from pypdf import PdfReader
 from sentence_transformers import SentenceTransformer
 
+from rag.rag_index import build_index, empty_index, index_nbytes
+from rag.pdf_cache import extract_pages
+from rag.dedup import ChunkDeduper
+from rag.rag_snapshot import write_snapshot
+from server.tracing import span
+
 class RAGIndexer:
-    def __init__(self, docs_dirs, index_path, meta_path, embed_model_name):
+    def __init__(self, docs_dirs, index_path, meta_path, embed_model_name, model=None, index_type="flat", text_cache=None, shards=1, shard_by="id", dedup_threshold=0.85):
         if isinstance(docs_dirs, str):
             self.docs_dirs = [docs_dirs]
         else:
@@ -16,14 +20,27 @@ class RAGIndexer:
 
         self.index_path = index_path
         self.meta_path = meta_path
+        self.index_type = index_type or "flat"
+        self.text_cache = text_cache  # PdfTextCache opcional
+        self.shards = shards
+        self.shard_by = shard_by
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.model = SentenceTransformer(embed_model_name, device=self.device)
+        # Chunks duplicados o casi duplicados se embeben una sola vez (0/None = desactivado)
+        self.deduper = ChunkDeduper(dedup_threshold) if dedup_threshold else None
+        self.last_dedup = None
+
+        # Reutilizar modelo compartido (colecciones) si se entrega
+        self.model = model or SentenceTransformer(embed_model_name, device=self.device)
     
     """
     Lectores de archivos
     """
     def read_md(self, path):
         raw = path.read_text(encoding="utf-8", errors="ignore")
+        return self.read_md_text(raw, path)
+
+    def read_md_text(self, raw, path):
+        """Parsea markdown ya cargado (p. ej. páginas web en memoria)"""
         text, meta = self._split_md_and_meta(raw)
 
         # Validaciones
@@ -38,8 +55,9 @@ class RAGIndexer:
 
     def read_pdf(self, path):
         try:
-            reader = PdfReader(str(path))
-            text = "\n".join([p.extract_text() or "" for p in reader.pages])
+            # Página por página, desde caché cuando el archivo no ha cambiado
+            pages = self.text_cache.pages(path) if self.text_cache else extract_pages(path)
+            text = "\n".join(pages)
         except Exception:
             text = ""
 
@@ -56,7 +74,12 @@ class RAGIndexer:
     def _parse_yaml(self, s):
         if yaml:
             try:
-                return yaml.safe_load(s) or {}
+                meta = yaml.safe_load(s) or {}
+                # Fechas (p. ej. captured_at) como texto ISO: los metadatos se guardan en JSON
+                return {
+                    k: v.isoformat() if hasattr(v, "isoformat") else (v.strip() if isinstance(v, str) else v)
+                    for k, v in meta.items()
+                }
             except Exception:
                 pass
 
@@ -102,23 +125,34 @@ class RAGIndexer:
                 if not p.is_file():
                     continue
 
-                suf = p.suffix.lower()
-                try:
-                    if suf in {".txt"}:
-                        text = p.read_text(encoding="utf-8", errors="ignore")
-                        meta = {"source_type": "doc", "doc_name": os.path.basename(str(p))}
-                        entries.append((str(p), text, meta))
-                    elif suf in {".md"}:
-                        text, meta = self.read_md(p)
-                        entries.append((str(p), text, meta))
-                    elif suf in {".pdf"}:
-                        text, meta = self.read_pdf(p)
-                        entries.append((str(p), text, meta))
-                except Exception:
-                    continue
+                entry = self.load_file(p)
+                if entry:
+                    entries.append(entry)
 
         return entries
 
+    def load_file(self, p):
+        """
+        Lee un archivo soportado y devuelve (ruta, texto, meta), o None si no se puede leer.
+        """
+        p = Path(p)
+        suf = p.suffix.lower()
+        try:
+            if suf in {".txt"}:
+                text = p.read_text(encoding="utf-8", errors="ignore")
+                meta = {"source_type": "doc", "doc_name": os.path.basename(str(p))}
+                return (str(p), text, meta)
+            elif suf in {".md"}:
+                text, meta = self.read_md(p)
+                return (str(p), text, meta)
+            elif suf in {".pdf"}:
+                text, meta = self.read_pdf(p)
+                return (str(p), text, meta)
+        except Exception:
+            pass
+
+        return None
+
     def simple_split(self, text, max_chars, overlap):
         """
         Crear chunks de texto con longitud máxima max_chars y solapamiento overlap.
@@ -138,21 +172,11 @@ class RAGIndexer:
         
         return chunks
 
-    def main(self):
-        print(f"[RAG] Cargando documentos...")
-        raw_docs = self.load_docs()
-
-        # Se crean índices y meta vacíos para no romper al retriever
-        if not raw_docs:
-            print("[RAG] Error: No se encontraron documentos")
-            dim = self.model.get_sentence_embedding_dimension()
-            index = faiss.IndexFlatIP(dim)
-            faiss.write_index(index, self.index_path)
-            with open(self.meta_path, "w", encoding="utf-8") as f:
-                pass
-            return
-        
-        print(f"[RAG] Generando chunks...")
+    def chunk_docs(self, raw_docs, start_vid=0):
+        """
+        Divide los documentos en chunks con sus metadatos.
+        Cada chunk recibe un "vid" (id del vector en el índice) consecutivo desde start_vid.
+        """
         docs = []
         for src, txt, meta in raw_docs:
             chunks = self.simple_split(txt, 1200, 200)
@@ -163,6 +187,7 @@ class RAGIndexer:
             for i, ch in enumerate(chunks):
                 item = {
                     "id": str(uuid.uuid4()),
+                    "vid": start_vid + len(docs),
                     "source": src,
                     "chunk_id": i,
                     "text": ch,
@@ -180,25 +205,103 @@ class RAGIndexer:
 
                 docs.append(item)
 
+        return docs
+
+    def dedup(self, docs, start_vid=0):
+        """
+        Elimina chunks duplicados antes del embedding (ver rag.dedup.ChunkDeduper).
+        Las estadísticas quedan en last_dedup.
+        """
+        if self.deduper is None or len(docs) < 2:
+            return docs
+        with span("dedup", chunks=len(docs)) as s:
+            docs, stats = self.deduper.dedup(docs, start_vid)
+            s.set(unique=stats["unique"])
+        self.last_dedup = stats
+        return docs
+
+    def embed(self, texts, show_progress_bar=True):
+        with span("embed", chunks=len(texts)):
+            return self.model.encode(
+                texts,
+                batch_size=64,
+                show_progress_bar=show_progress_bar,
+                convert_to_numpy=True,
+                normalize_embeddings=True
+            )
+
+    def index_files(self, paths, start_vid):
+        """
+        Chunks y embeddings de archivos puntuales, para altas incrementales sin reindexar todo.
+        Devuelve (docs, embeddings).
+        """
+        raw_docs = [e for e in (self.load_file(p) for p in paths) if e]
+        docs = self.dedup(self.chunk_docs(raw_docs, start_vid), start_vid)
+        if not docs:
+            return [], None
+
+        return docs, self.embed([d["text"] for d in docs], show_progress_bar=False)
+
+    def main(self):
+        with span("indexer.main") as s:
+            self._main(s)
+        # Los PDFs leídos en esta corrida quedan como los más recientes del caché
+        if self.text_cache:
+            removed = self.text_cache.prune()
+            if removed:
+                print(f"[RAG] Caché de texto PDF: {removed} documentos eliminados")
+
+    def _main(self, s):
+        print(f"[RAG] Cargando documentos...")
+        with span("load_docs"):
+            raw_docs = self.load_docs()
+        s.set(docs=len(raw_docs))
+
+        # Se crean índices y meta vacíos para no romper al retriever
+        if not raw_docs:
+            print("[RAG] Error: No se encontraron documentos")
+            dim = self.model.get_sentence_embedding_dimension()
+            write_snapshot(empty_index(dim), [], self.index_path, self.meta_path, self.index_type)
+            return
+        
+        print(f"[RAG] Generando chunks...")
+        docs = self.chunk_docs(raw_docs)
+        n_chunks = len(docs)
+        docs = self.dedup(docs)
+        s.set(chunks=n_chunks, unique_chunks=len(docs))
+
         # Normalizaer text embeddings
         texts = [d["text"] for d in docs]
         print(f"[RAG] Embedding {len(texts)} chunks ...")
-        emb = self.model.encode(
-            texts,
-            batch_size=64,
-            show_progress_bar=True,
-            convert_to_numpy=True,
-            normalize_embeddings=True
-        )
-        dim = emb.shape[1]
-        index = faiss.IndexFlatIP(dim)
-        index.add(emb)
+        t0 = time.perf_counter()
+        emb = self.embed(texts)
+        embed_s = time.perf_counter() - t0
+        index = build_index(emb, self.index_type)
+        index_bytes = index_nbytes(index)
+        print(f"[RAG] Índice {self.index_type}: {index_bytes / 1024:.1f} KB para {index.ntotal} vectores")
+        if n_chunks > len(docs):
+            self._report_dedup(n_chunks, len(docs), embed_s, index_bytes)
 
         print(f"[RAG] Guardando índices y metadatos...")
-        faiss.write_index(index, self.index_path)
-
-        with open(self.meta_path, "w", encoding="utf-8") as f:
-            for d in docs:
-                f.write(json.dumps(d, ensure_ascii=False) + "\n")
+        write_snapshot(index, docs, self.index_path, self.meta_path, self.index_type, self.shards, self.shard_by)
 
         print("\nIndexado completo.")
+
+    def _report_dedup(self, n_chunks, n_unique, embed_s, index_bytes):
+        # Ahorro estimado con el costo medio por chunk/vector de esta corrida
+        removed = n_chunks - n_unique
+        stats = self.last_dedup or {}
+        saved_s = embed_s / n_unique * removed if n_unique else 0.0
+        saved_bytes = index_bytes / n_unique * removed if n_unique else 0
+        stats.update({
+            "removed": removed,
+            "embed_s": round(embed_s, 3),
+            "embed_s_saved": round(saved_s, 3),
+            "index_bytes": index_bytes,
+            "index_bytes_saved": int(saved_bytes),
+        })
+        print(
+            f"[RAG] Duplicados: {removed} de {n_chunks} chunks ({removed / n_chunks * 100:.1f}%, "
+            f"{stats.get('exact_duplicates', 0)} exactos, {stats.get('near_duplicates', 0)} casi duplicados); "
+            f"~{saved_s:.2f}s de embedding y ~{saved_bytes / 1024:.1f} KB de índice ahorrados"
+        )
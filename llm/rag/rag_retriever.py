@@ -1,60 +1,125 @@
-import os, json
+import os, json, time, heapq, base64, threading
+from concurrent.futures import ThreadPoolExecutor
 
 import faiss
 import torch
+import numpy as np
 from sentence_transformers import SentenceTransformer
 
+from rag.rag_index import empty_index, to_id_map, id_selector
+from rag.dedup import other_sources
+from server.tracing import span
+from rag.rag_snapshot import write_snapshot, read_manifest, validate_snapshot, data_paths, load_shards, load_index_writable, load_sources, journal_path, MetaStore
+
+# Pool compartido para buscar shards en paralelo (faiss libera el GIL durante la búsqueda)
+_search_pool = None
+_search_pool_lock = threading.Lock()
+
+def get_search_pool(threads=None):
+    global _search_pool
+    with _search_pool_lock:
+        if _search_pool is None:
+            _search_pool = ThreadPoolExecutor(max_workers=threads or os.cpu_count() or 4, thread_name_prefix="rag-search")
+        return _search_pool
+
+def search_shards(shards, q, k, pool=None):
+    """
+    Busca en todos los shards (en paralelo si hay más de uno) y une los resultados
+    con un heap top-k. Devuelve [(score, vid), ...] ordenado de mayor a menor.
+    """
+    def _one(index):
+        if index.ntotal == 0:
+            return []
+        D, I = index.search(q, min(index.ntotal, k))
+        return [(float(s), int(v)) for s, v in zip(D[0], I[0]) if v != -1]
+
+    if len(shards) == 1:
+        return _one(shards[0])
+
+    pool = pool or get_search_pool()
+    results = pool.map(_one, shards)
+    return heapq.nlargest(k, (c for part in results for c in part), key=lambda c: c[0])
+
+class EphemeralIndex:
+    """
+    Índice en memoria de vida corta (p. ej. páginas web de una sola solicitud).
+    Se busca junto al índice persistente sin escribir a disco ni reindexar.
+    """
+    def __init__(self, docs, emb):
+        self.metas = docs
+        self.index = faiss.IndexFlatIP(emb.shape[1])
+        self.index.add(np.ascontiguousarray(emb, dtype="float32"))
+
+    def search(self, q, k):
+        if self.index.ntotal == 0:
+            return []
+        D, I = self.index.search(q, min(self.index.ntotal, k))
+        return [(float(s), self.metas[i]) for s, i in zip(D[0], I[0]) if i != -1]
+
 class RAGRetriever:
-    def __init__(self, index_path, meta_path, embed_model_name):
+    def __init__(self, index_path, meta_path, embed_model_name, model=None, verify=False, shards=1, shard_by="id"):
         # Guardar rutas y configuraciones
         self.index_path = index_path
         self.meta_path = meta_path
+        self.num_shards = max(1, int(shards))
+        self.shard_by = shard_by
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
 
-        # Cargar modelo de embedding
-        self.model = SentenceTransformer(embed_model_name, device=self.device)
+        # Cargar modelo de embedding (o reutilizar uno compartido)
+        self.model = model or SentenceTransformer(embed_model_name, device=self.device)
         self.embed_dim = self.model.get_sentence_embedding_dimension()
 
-        # Validaciones
-        self._ensure_files()
-        self.index = faiss.read_index(index_path)
-        self.metas = self._load_meta_lines(meta_path)
+        # Validaciones (solo cabecera del snapshot, sin cargar el índice)
+        self._lock = threading.RLock()
+        self._active = 0         # Búsquedas en curso
+        self._released = False   # Desalojado del LRU: los metadatos solo se abren durante una búsqueda
+        self._load(self._ensure_files(verify))
     
-    def _ensure_files(self):
+    def _ensure_files(self, verify):
         """
-        Crea archivos vacíos válidos si no existen.
+        Valida el snapshot y crea archivos vacíos válidos si no existen o están corruptos.
         """
         os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
         os.makedirs(os.path.dirname(self.meta_path), exist_ok=True)
 
+        manifest = validate_snapshot(self.index_path, self.meta_path, full=verify)
+        # Otro proceso pudo publicar un snapshot nuevo (y borrar el anterior) entre la
+        # lectura del manifest y la de los archivos: volver a leerlo antes de darlo por inválido
+        for _ in range(2):
+            if manifest is not None or read_manifest(self.index_path) is None:
+                break
+            time.sleep(0.05)
+            manifest = validate_snapshot(self.index_path, self.meta_path, full=verify)
+        if manifest is not None:
+            return manifest
+
         need_index = not os.path.exists(self.index_path)
         need_meta = not os.path.exists(self.meta_path)
 
         if need_index or need_meta:
-            self._write_empty_index_and_meta()
-        else:
-            # Validar indice faiss
-            try:
-                idx = faiss.read_index(self.index_path)
-            except Exception:
-                # Si el archivo está corrupto, lo recreamos vacío
-                self._write_empty_index_and_meta()
+            return self._write_empty_index_and_meta()
 
-            # Validar metadata jsonl
-            try:
-                _ = self._load_meta_lines(self.meta_path)
-            except Exception:
-                with open(self.meta_path, "w", encoding="utf-8") as f:
-                    pass
+        # Archivos sin manifest (formato anterior): migrar una vez al formato snapshot
+        try:
+            index = to_id_map(faiss.read_index(self.index_path))
+            metas = self._load_meta_lines(self.meta_path)
+            # Las filas con vid (snapshot v2 sin manifest válido) ya coinciden con los ids del índice
+            for i, m in enumerate(metas):
+                m.setdefault("vid", i)
+            metas.sort(key=lambda m: m["vid"])
+        except Exception:
+            # Si algún archivo está corrupto, lo recreamos vacío
+            return self._write_empty_index_and_meta()
+
+        print("[RAG] Migrando índice al formato snapshot...")
+        return write_snapshot(index, metas, self.index_path, self.meta_path)
     
     def _write_empty_index_and_meta(self):
         """
         Crea un índice faiss y un meta vacío.
         """
-        index = faiss.IndexFlatIP(self.embed_dim)
-        faiss.write_index(index, self.index_path)
-        with open(self.meta_path, "w", encoding="utf-8") as f:
-            pass
+        index = empty_index(self.embed_dim)
+        return write_snapshot(index, [], self.index_path, self.meta_path)
     
     @staticmethod
     def _load_meta_lines(path):
@@ -67,43 +132,302 @@ class RAGRetriever:
                 metas.append(json.loads(line))
         return metas
 
-    def retrieve(self, query, top_k):
+    """
+    Cambios incrementales: altas en un índice delta en memoria, bajas como tombstones.
+    Ambos se registran en un journal y se consolidan en el snapshot al compactar.
+    """
+    def _load(self, manifest):
+        old = getattr(self, "metas", None)
+        self.manifest = manifest
+        self.shards = load_shards(self.index_path, manifest)
+        self.metas = MetaStore(data_paths(self.index_path, self.meta_path, manifest)[1])
+        # Las búsquedas resuelven los metadatos con el lock tomado: el mmap anterior ya no se usa
+        if old is not None:
+            old.close()
+        self.next_id = int(manifest.get("next_id", len(self.metas)))
+
+        self.delta = faiss.IndexIDMap2(faiss.IndexFlatIP(self.embed_dim))
+        self.delta_metas = {}     # vid -> meta de las altas posteriores al snapshot
+        self.tombstones = set()   # vids del snapshot eliminados
+        self._sources = None      # archivo -> vids del snapshot (carga diferida)
+        self._replay_journal()
+        self._journal_size = self._journal_nbytes()
+
+    def _journal_nbytes(self):
+        try:
+            return os.path.getsize(journal_path(self.meta_path))
+        except OSError:
+            return 0
+
+    def stale(self):
+        """
+        True si otro proceso publicó un snapshot o agregó cambios al journal después de
+        la última carga o escritura de este retriever (réplicas que comparten la carpeta).
+        """
+        manifest = read_manifest(self.index_path)
+        if (manifest or {}).get("snapshot_id") != self.manifest.get("snapshot_id"):
+            return True
+        return self._journal_nbytes() != self._journal_size
+
+    def _replay_journal(self):
+        path = journal_path(self.meta_path)
+        if not os.path.exists(path):
+            return
+
+        with open(path, "r", encoding="utf-8") as f:
+            lines = [l for l in f if l.strip()]
+
+        # El journal solo aplica al snapshot con el que fue creado
+        try:
+            header = json.loads(lines[0]) if lines else {}
+        except ValueError:
+            header = {}
+        if header.get("snapshot_id") != self.manifest.get("snapshot_id"):
+            os.remove(path)
+            return
+
+        for line in lines[1:]:
+            try:
+                op = json.loads(line)
+            except ValueError:
+                # Línea incompleta por una caída durante la escritura
+                continue
+            if op.get("op") == "add":
+                vecs = np.frombuffer(base64.b64decode(op["vecs"]), dtype="float32").reshape(-1, self.embed_dim)
+                self._apply_add(op["metas"], vecs)
+            elif op.get("op") == "del":
+                self._apply_delete(op["ids"])
+
+    def _append_journal(self, op):
+        path = journal_path(self.meta_path)
+        new = not os.path.exists(path)
+        with open(path, "a", encoding="utf-8") as f:
+            if new:
+                f.write(json.dumps({"snapshot_id": self.manifest.get("snapshot_id")}) + "\n")
+            f.write(json.dumps(op, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+            self._journal_size = os.fstat(f.fileno()).st_size
+
+    def _apply_add(self, metas, vecs):
+        ids = np.array([m["vid"] for m in metas], dtype="int64")
+        self.delta.add_with_ids(np.ascontiguousarray(vecs, dtype="float32"), ids)
+        for m in metas:
+            self.delta_metas[m["vid"]] = m
+        self.next_id = max(self.next_id, int(ids.max()) + 1)
+
+    def _apply_delete(self, ids):
+        delta_ids = [v for v in ids if v in self.delta_metas]
+        if delta_ids:
+            self.delta.remove_ids(id_selector(delta_ids))
+            for v in delta_ids:
+                del self.delta_metas[v]
+        self.tombstones.update(v for v in ids if v not in delta_ids)
+
+    def source_ids(self, source):
+        """vids vigentes (snapshot + delta) de un archivo fuente"""
+        with self._lock:
+            if self._sources is None:
+                self._sources = load_sources(self.meta_path, self.manifest)
+            ids = [v for v in self._sources.get(source, []) if v not in self.tombstones]
+            ids += [
+                v for v, m in self.delta_metas.items()
+                if m.get("source") == source or any(s.get("source") == source for s in m.get("sources") or ())
+            ]
+            return ids
+
+    def add_documents(self, docs, emb):
+        """
+        Agrega chunks ya embebidos (ver RAGIndexer.index_files) sin reconstruir el índice.
+        Los vids de docs se reasignan desde next_id.
+        """
+        if not docs:
+            return 0
+        with self._lock:
+            for i, d in enumerate(docs):
+                d["vid"] = self.next_id + i
+            vecs = np.ascontiguousarray(emb, dtype="float32")
+            self._append_journal({
+                "op": "add",
+                "metas": docs,
+                "vecs": base64.b64encode(vecs.tobytes()).decode("ascii"),
+            })
+            self._apply_add(docs, vecs)
+        return len(docs)
+
+    def delete_source(self, source):
+        """
+        Elimina todos los chunks de un archivo: O(chunks del archivo).
+        Los chunks deduplicados que también pertenecen a otros archivos se vuelven a agregar
+        sin este archivo en "sources". Devuelve la cantidad de chunks eliminados.
+        """
+        with self._lock:
+            ids = self.source_ids(source)
+            if not ids:
+                return 0
+            shared = []
+            for v in ids:
+                m = self.delta_metas.get(v) or self.metas.get(v)
+                rest = other_sources(m, source) if m else []
+                if rest:
+                    shared.append(self._rehome(m, rest))
+            self._append_journal({"op": "del", "ids": ids})
+            self._apply_delete(ids)
+            if shared:
+                emb = self.model.encode([m["text"] for m in shared], normalize_embeddings=True)
+                self.add_documents(shared, emb)
+            return len(ids) - len(shared)
+
+    @staticmethod
+    def _rehome(m, rest):
+        # La primera copia restante pasa a ser la fuente del chunk
+        m = {k: v for k, v in m.items() if k not in ("sources", "url")}
+        m.update(rest[0])
+        if len(rest) > 1:
+            m["sources"] = rest
+        return m
+
+    @property
+    def ntotal(self):
+        return sum(s.ntotal for s in self.shards)
+
+    def pending_changes(self):
+        with self._lock:
+            return len(self.tombstones) + len(self.delta_metas)
+
+    def compact(self):
+        """
+        Consolida delta y tombstones en un snapshot nuevo (se llama en segundo plano).
+        Las búsquedas siguen atendiéndose con el snapshot anterior mientras se escribe el nuevo;
+        las altas/bajas deben excluirse con el lock de la colección.
+        """
+        with self._lock:
+            if not self.tombstones and not self.delta_metas:
+                return False
+
+            tombstones = set(self.tombstones)
+            metas = self.metas
+            ids = np.array(sorted(self.delta_metas), dtype="int64")
+            delta_rows = [self.delta_metas[int(v)] for v in ids]
+            vecs = np.vstack([self.delta.reconstruct(int(v)) for v in ids]).astype("float32") if len(ids) else None
+
+        # Copia escribible del índice (el cargado está mapeado en solo lectura)
+        index = load_index_writable(self.index_path, self.manifest)
+        if tombstones:
+            index.remove_ids(id_selector(tombstones))
+        rows = [m for m in metas if m.get("vid") not in tombstones]
+        if vecs is not None:
+            index.add_with_ids(vecs, ids)
+            rows += delta_rows
+
+        manifest = write_snapshot(
+            index, rows, self.index_path, self.meta_path,
+            self.manifest.get("index_type", "flat"), self.num_shards, self.shard_by
+        )
+        with self._lock:
+            self._load(manifest)
+
+        print(f"[RAG] Compactación completa: {len(rows)} chunks vigentes")
+        return True
+
+    def retrieve(self, query, top_k, ephemeral=None):
+        """
+        Top-k de chunks del índice persistente, unido opcionalmente con un EphemeralIndex.
+        """
+        with self._lock:
+            self._active += 1
+            if self.metas.closed:
+                # Desalojado entre que se obtuvo el retriever y la búsqueda
+                self.metas = MetaStore(self.metas.meta_path)
+        try:
+            with span("retrieve", top_k=top_k, query_chars=len(query)) as s:
+                hits = self._retrieve(query, top_k, ephemeral)
+                s.set(hits=len(hits))
+                return hits
+        finally:
+            with self._lock:
+                self._active -= 1
+                if self._released and self._active == 0:
+                    self.metas.close()
+
+    def release(self):
+        """
+        Desalojo (LRU o recarga): cierra el mmap de metadatos en cuanto no queden búsquedas
+        en curso. Los índices se liberan al soltar la última referencia al retriever.
+        """
+        with self._lock:
+            self._released = True
+            if self._active == 0:
+                self.metas.close()
+
+    def _retrieve(self, query, top_k, ephemeral):
         # Si indice vacío, no devolver nada
-        if self.index.ntotal == 0 or len(self.metas) == 0:
+        with self._lock:
+            shards, delta, tombstones = self.shards, self.delta, set(self.tombstones)
+        empty = ephemeral is None or ephemeral.index.ntotal == 0
+        if sum(s.ntotal for s in shards) - len(tombstones) <= 0 and delta.ntotal == 0 and empty:
             return []
 
         # Embedding normalizado para usar IP como coseno
-        q = self.model.encode([query], normalize_embeddings=True)
-        q = q.astype("float32")
-        D, I = self.index.search(q, top_k)
-        hits = []
+        with span("embed_query"):
+            q = self.model.encode([query], normalize_embeddings=True)
+            q = q.astype("float32")
 
-        for score, idx in zip(D[0], I[0]):
-            if idx == -1:
-                continue
+        with span("search", shards=len(shards), delta=delta.ntotal) as sp:
+            # Se piden resultados extra para compensar los eliminados aún no compactados
+            candidates = [c for c in search_shards(shards, q, top_k + len(tombstones)) if c[1] not in tombstones]
+            if delta.ntotal:
+                with self._lock:
+                    D, I = delta.search(q, min(delta.ntotal, top_k))
+                candidates += [(float(s), int(v)) for s, v in zip(D[0], I[0]) if v != -1]
+            if ephemeral is not None:
+                candidates += ephemeral.search(q, top_k)
+            sp.set(candidates=len(candidates))
+        candidates.sort(key=lambda c: c[0], reverse=True)
 
-            m = self.metas[idx]
-            hit = {
-                "score": float(score),
-                "source": m.get("source"),
-                "chunk_id": m.get("chunk_id"),
-                "text": m.get("text", "")
-            }
+        hits = []
+        seen = set()
+        # Con el lock: una compactación concurrente cierra el MetaStore anterior (los vids se conservan)
+        with self._lock:
+            metas, delta_metas = self.metas, self.delta_metas
+            for score, m in candidates:
+                # Los candidatos efímeros ya traen sus metadatos, los persistentes su vid
+                if not isinstance(m, dict):
+                    m = delta_metas.get(m) or metas.get(m)
+                if m is None:
+                    continue
+                # Una página puede estar en el índice persistente y en el efímero
+                key = (m.get("source"), m.get("chunk_id"))
+                if key in seen:
+                    continue
+                seen.add(key)
+                hits.append(self._make_hit(score, m))
+                if len(hits) == top_k:
+                    break
 
-            # Mantener campos para contexto enriquecido
-            for k in ("source_type", "doc_name", "url", "site_domain", "captured_at", "title", "snippet", "summary"):
-                if k in m:
-                    hit[k] = m[k]
+        return hits
 
-            # Validaciones
-            if "source_type" not in hit:
-                hit["source_type"] = "site" if (("url" in hit) or ("site_domain" in hit)) else "doc"
-            if hit["source_type"] == "doc" and "doc_name" not in hit:
-                hit["doc_name"] = os.path.basename(hit["source"] or "desconocido")
+    @staticmethod
+    def _make_hit(score, m):
+        hit = {
+            "score": float(score),
+            "source": m.get("source"),
+            "chunk_id": m.get("chunk_id"),
+            "text": m.get("text", "")
+        }
 
-            hits.append(hit)
+        # Mantener campos para contexto enriquecido
+        for k in ("source_type", "doc_name", "url", "site_domain", "captured_at", "title", "snippet", "summary", "sources"):
+            if k in m:
+                hit[k] = m[k]
 
-        return hits
+        # Validaciones
+        if "source_type" not in hit:
+            hit["source_type"] = "site" if (("url" in hit) or ("site_domain" in hit)) else "doc"
+        if hit["source_type"] == "doc" and "doc_name" not in hit:
+            hit["doc_name"] = os.path.basename(hit["source"] or "desconocido")
+
+        return hit
 
 def build_context(docs):
     """
@@ -0,0 +1,371 @@
+import os, json, mmap, time, uuid, zlib
+from array import array
+
+import faiss
+import numpy as np
+
+from rag.rag_index import split_index, merge_indexes
+
+# Formato de snapshot del índice RAG (gen = generación del snapshot, ver data_paths):
+# - {index_path}.{gen}                 índice faiss IndexIDMap2 (cargado con mmap), shard 0
+# - {index_path}.{gen}.shard{i}        shards adicionales (i >= 1) cuando se usa más de un shard
+# - {meta_path}.{gen}                  metadatos jsonl (una fila por vector, ordenadas por "vid")
+# - {meta_path}.{gen}.offsets          offsets int64 de cada fila del jsonl (acceso aleatorio vía mmap)
+# - {meta_path}.{gen}.ids              id de vector (vid) int64 de cada fila
+# - {meta_path}.{gen}.sources.json     rangos de vids por archivo fuente (borrado por documento)
+# - {meta_path}.journal                cambios incrementales posteriores al snapshot (altas/bajas)
+# - {index_path}.manifest.json         cabecera versionada con generación, tamaños y checksums
+# Cada snapshot escribe archivos nuevos y el reemplazo del manifest es el único punto de cambio:
+# un lector ve el snapshot anterior o el nuevo completo, nunca una mezcla.
+# La versión 2 (archivos sin generación en las rutas fijas) se sigue leyendo.
+SNAPSHOT_FORMAT = "chateai-rag-snapshot"
+SNAPSHOT_VERSION = 3
+_READ_VERSIONS = (2, 3)
+
+# Archivos de generaciones huérfanas (escritura interrumpida) se borran pasado este tiempo
+_ORPHAN_AGE_S = 3600
+
+# Bytes iniciales usados para la validación rápida (no requiere leer el archivo completo)
+_HEAD_BYTES = 64 * 1024
+
+def manifest_path(index_path):
+    return index_path + ".manifest.json"
+
+def shard_path(index_path, i):
+    return index_path if i == 0 else f"{index_path}.shard{i}"
+
+def offsets_path(meta_path):
+    return meta_path + ".offsets"
+
+def ids_path(meta_path):
+    return meta_path + ".ids"
+
+def sources_path(meta_path):
+    return meta_path + ".sources.json"
+
+def journal_path(meta_path):
+    return meta_path + ".journal"
+
+def data_paths(index_path, meta_path, manifest):
+    """
+    Rutas base (índice, metadatos) de los archivos de datos del snapshot descrito por
+    manifest. Los snapshots v2 (y los archivos sin manifest) usan las rutas fijas.
+    """
+    gen = (manifest or {}).get("generation")
+    if not gen:
+        return index_path, meta_path
+    return f"{index_path}.{gen}", f"{meta_path}.{gen}"
+
+def _data_files(index_path, meta_path, manifest):
+    base_index, base_meta = data_paths(index_path, meta_path, manifest)
+    n = int((manifest or {}).get("shards", 1))
+    if manifest is None:
+        # Formato anterior: contar los shards presentes
+        while os.path.exists(shard_path(base_index, n)):
+            n += 1
+    paths = [shard_path(base_index, i) for i in range(n)]
+    paths += [base_meta, offsets_path(base_meta), ids_path(base_meta), sources_path(base_meta)]
+    return paths
+
+def _fsync(path):
+    with open(path, "rb") as f:
+        os.fsync(f.fileno())
+
+def _remove_files(paths):
+    for p in paths:
+        try:
+            os.remove(p)
+        except OSError:
+            pass
+
+def _remove_orphans(index_path, meta_path, keep):
+    # Generaciones que no llegaron a publicarse (caída o escritor concurrente que perdió)
+    now = time.time()
+    for base in (index_path, meta_path):
+        folder = os.path.dirname(base) or "."
+        prefix = os.path.basename(base) + "."
+        for name in os.listdir(folder):
+            if not name.startswith(prefix):
+                continue
+            gen = name[len(prefix):].split(".", 1)[0]
+            if len(gen) != 16 or gen in keep or not all(c in "0123456789abcdef" for c in gen):
+                continue
+            p = os.path.join(folder, name)
+            try:
+                if now - os.path.getmtime(p) > _ORPHAN_AGE_S:
+                    os.remove(p)
+            except OSError:
+                pass
+
+def _crc32_file(path, limit=None):
+    crc = 0
+    remaining = limit
+    with open(path, "rb") as f:
+        while True:
+            size = 1024 * 1024 if remaining is None else min(1024 * 1024, remaining)
+            if size <= 0:
+                break
+            block = f.read(size)
+            if not block:
+                break
+            crc = zlib.crc32(block, crc)
+            if remaining is not None:
+                remaining -= len(block)
+    return crc & 0xFFFFFFFF
+
+def _file_header(path):
+    return {
+        "bytes": os.path.getsize(path),
+        "head_crc32": _crc32_file(path, _HEAD_BYTES),
+        "crc32": _crc32_file(path),
+    }
+
+def _shard_assign(index, meta_ids, meta_keys, n, shard_by):
+    # Shard de cada fila del índice: por vid o por archivo fuente (todos los chunks de un archivo juntos)
+    index_ids = faiss.vector_to_array(index.id_map)
+    if shard_by == "source":
+        rows = np.searchsorted(meta_ids, index_ids)
+        return meta_keys[rows] % n
+    return index_ids % n
+
+def write_snapshot(index, docs, index_path, meta_path, index_type="flat", shards=1, shard_by="id"):
+    """
+    Escribe un snapshot nuevo (índice, metadatos, offsets) en archivos de una generación
+    propia y lo publica reemplazando el manifest de forma atómica (tmp único + os.replace).
+    Una caída antes del manifest deja vigente el snapshot anterior; dos escritores
+    concurrentes no comparten archivos y gana el último manifest.
+    Cada fila debe traer su "vid" (id del vector en el índice), en orden creciente.
+    docs puede ser cualquier iterable (p. ej. un generador para corpus grandes).
+    Con shards > 1 el índice se divide por vid o por archivo fuente (shard_by) en archivos separados.
+    Al escribir un snapshot nuevo el journal de cambios queda obsoleto y se elimina.
+    """
+    for p in (index_path, meta_path):
+        os.makedirs(os.path.dirname(p) or ".", exist_ok=True)
+
+    snapshot_id = uuid.uuid4().hex
+    generation = snapshot_id[:16]
+    base_index, base_meta = data_paths(index_path, meta_path, {"generation": generation})
+
+    offsets = array("q")
+    ids = array("q")
+    keys = array("q")
+    sources = {}
+    pos = 0
+    with open(base_meta, "wb") as f:
+        for d in docs:
+            line = (json.dumps(d, ensure_ascii=False) + "\n").encode("utf-8")
+            vid = int(d["vid"])
+            offsets.append(pos)
+            ids.append(vid)
+            if shards > 1 and shard_by == "source":
+                keys.append(zlib.crc32((d.get("source") or "").encode("utf-8")))
+            f.write(line)
+            pos += len(line)
+
+            # Rangos [inicio, fin) contiguos de vids por archivo (también las copias deduplicadas)
+            srcs = {d.get("source") or ""}
+            srcs.update(s.get("source") or "" for s in d.get("sources") or ())
+            for src in srcs:
+                ranges = sources.setdefault(src, [])
+                if ranges and ranges[-1][1] == vid:
+                    ranges[-1][1] = vid + 1
+                else:
+                    ranges.append([vid, vid + 1])
+    np.frombuffer(offsets, dtype="int64").astype("<i8").tofile(offsets_path(base_meta))
+    np.frombuffer(ids, dtype="int64").astype("<i8").tofile(ids_path(base_meta))
+    with open(sources_path(base_meta), "w", encoding="utf-8") as f:
+        json.dump(sources, f, ensure_ascii=False)
+
+    # Índice (uno o varios shards)
+    shards = max(1, int(shards))
+    if shards > 1 and index.ntotal:
+        parts = split_index(
+            index,
+            _shard_assign(index, np.frombuffer(ids, dtype="int64"), np.frombuffer(keys, dtype="int64"), shards, shard_by),
+            shards,
+        )
+    else:
+        shards = 1
+        parts = [index]
+    for i, part in enumerate(parts):
+        faiss.write_index(part, shard_path(base_index, i))
+
+    manifest = {
+        "format": SNAPSHOT_FORMAT,
+        "version": SNAPSHOT_VERSION,
+        "index_type": index_type,
+        "dim": int(index.d),
+        "ntotal": int(index.ntotal),
+        "rows": len(ids),
+        "next_id": max(ids) + 1 if len(ids) else 0,
+        "snapshot_id": snapshot_id,
+        "generation": generation,
+        "created_at": time.time(),
+        "shards": shards,
+        "shard_by": shard_by,
+        "index": _file_header(base_index),
+        "shard_headers": [_file_header(shard_path(base_index, i)) for i in range(1, shards)],
+        "meta": _file_header(base_meta),
+    }
+
+    # Publicar: el manifest es el único punto de cambio entre snapshots
+    for p in _data_files(index_path, meta_path, manifest):
+        _fsync(p)
+    previous = read_manifest(index_path)
+    tmp_manifest = f"{manifest_path(index_path)}.{generation}.tmp"
+    with open(tmp_manifest, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_manifest, manifest_path(index_path))
+
+    # El journal pertenece al snapshot anterior (se ignora igualmente por snapshot_id)
+    try:
+        os.remove(journal_path(meta_path))
+    except OSError:
+        pass
+
+    # Archivos del snapshot anterior (los lectores que aún lo tienen mapeado no se ven afectados)
+    _remove_files(_data_files(index_path, meta_path, previous))
+    _remove_orphans(index_path, meta_path, {generation})
+
+    return manifest
+
+def read_manifest(index_path):
+    try:
+        with open(manifest_path(index_path), "r", encoding="utf-8") as f:
+            m = json.load(f)
+    except Exception:
+        return None
+    if m.get("format") != SNAPSHOT_FORMAT or m.get("version") not in _READ_VERSIONS:
+        return None
+    return m
+
+def validate_snapshot(index_path, meta_path, full=False):
+    """
+    Valida un snapshot sin cargarlo: tamaños + crc32 de la cabecera de cada archivo.
+    Con full=True verifica el crc32 completo (lectura secuencial, sin cargar en memoria).
+    Devuelve el manifest o None si es inválido.
+    """
+    m = read_manifest(index_path)
+    if m is None:
+        return None
+
+    base_index, base_meta = data_paths(index_path, meta_path, m)
+    try:
+        if os.path.getsize(offsets_path(base_meta)) != 8 * m["rows"]:
+            return None
+        if os.path.getsize(ids_path(base_meta)) != 8 * m["rows"]:
+            return None
+        files = [(base_index, m["index"]), (base_meta, m["meta"])]
+        files += [(shard_path(base_index, i + 1), h) for i, h in enumerate(m.get("shard_headers", []))]
+        for path, header in files:
+            if os.path.getsize(path) != header["bytes"]:
+                return None
+            if _crc32_file(path, _HEAD_BYTES) != header["head_crc32"]:
+                return None
+            if full and _crc32_file(path) != header["crc32"]:
+                return None
+    except (OSError, KeyError):
+        return None
+
+    return m
+
+def load_index(index_path):
+    """
+    Carga el índice con mmap (solo lectura) para que el arranque no dependa del tamaño
+    del corpus y varios procesos compartan las mismas páginas. Si el tipo de índice no
+    soporta mmap se carga normalmente.
+    """
+    flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY | getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+    try:
+        return faiss.read_index(index_path, flags)
+    except Exception:
+        return faiss.read_index(index_path)
+
+def load_shards(index_path, manifest):
+    """Carga (mmap) todos los shards del snapshot"""
+    base_index, _ = data_paths(index_path, None, manifest)
+    return [load_index(shard_path(base_index, i)) for i in range(int(manifest.get("shards", 1)))]
+
+def load_index_writable(index_path, manifest):
+    """
+    Copia escribible del índice completo (shards unidos), para compactar o agregar en bloque.
+    """
+    base_index, _ = data_paths(index_path, None, manifest)
+    shards = [faiss.read_index(shard_path(base_index, i)) for i in range(int(manifest.get("shards", 1)))]
+    return shards[0] if len(shards) == 1 else merge_indexes(shards)
+
+def snapshot_files(index_path, meta_path):
+    """Archivos del snapshot vigente en disco (todos los shards, metadatos auxiliares, journal y manifest)"""
+    paths = _data_files(index_path, meta_path, read_manifest(index_path))
+    paths += [journal_path(meta_path), manifest_path(index_path)]
+    return paths
+
+def snapshot_nbytes(index_path, meta_path):
+    total = 0
+    for p in snapshot_files(index_path, meta_path):
+        try:
+            total += os.path.getsize(p)
+        except OSError:
+            pass
+    return total
+
+def load_sources(meta_path, manifest=None):
+    """Mapa archivo fuente -> lista de vids del snapshot"""
+    _, base_meta = data_paths(None, meta_path, manifest)
+    try:
+        with open(sources_path(base_meta), "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {src: [v for a, b in ranges for v in range(a, b)] for src, ranges in data.items()}
+
+class MetaStore:
+    """
+    Acceso aleatorio a las filas del jsonl de metadatos vía mmap + offsets.
+    Solo se parsean las filas consultadas, por posición o por vid.
+    """
+    def __init__(self, meta_path):
+        self.meta_path = meta_path
+        self._f = None
+        self._mm = None
+        self.closed = False
+        self.offsets = np.zeros(0, dtype="<i8")
+        self.ids = np.zeros(0, dtype="<i8")
+        self._size = os.path.getsize(meta_path)
+
+        if self._size > 0:
+            self.offsets = np.memmap(offsets_path(meta_path), dtype="<i8", mode="r")
+            self.ids = np.memmap(ids_path(meta_path), dtype="<i8", mode="r")
+            self._f = open(meta_path, "rb")
+            self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return int(self.offsets.shape[0])
+
+    def __getitem__(self, i):
+        n = len(self)
+        if i < 0 or i >= n:
+            raise IndexError(i)
+        start = int(self.offsets[i])
+        end = int(self.offsets[i + 1]) if i + 1 < n else self._size
+        return json.loads(self._mm[start:end])
+
+    def get(self, vid):
+        """Fila con el vid indicado (búsqueda binaria sobre ids ordenados) o None"""
+        row = int(np.searchsorted(self.ids, vid))
+        if row >= len(self) or int(self.ids[row]) != vid:
+            return None
+        return self[row]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def close(self):
+        self.closed = True
+        if self._mm is not None:
+            self._mm.close()
+            self._f.close()
+            self._mm = None
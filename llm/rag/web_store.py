@@ -0,0 +1,146 @@
+import os, re, json, time, threading
+from datetime import datetime
+
+# Archivos de páginas web guardadas por internet_search (web_<hash>.md)
+_WEB_FILE_RE = re.compile(r"^web_[0-9a-f]+\.md$")
+_CAPTURED_RE = re.compile(r"^captured_at:\s*(\S+)\s*$", re.MULTILINE)
+
+def _read_captured_at(path):
+    # Solo se lee el inicio del archivo (front matter), con el mtime como respaldo
+    try:
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            head = f.read(4096)
+        m = _CAPTURED_RE.search(head)
+        if m:
+            return datetime.fromisoformat(m.group(1).rstrip("Z").strip("'\"")).timestamp()
+    except (OSError, ValueError):
+        pass
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return time.time()
+
+class WebPageStore:
+    """
+    Política de retención de las páginas web de una colección:
+    - ttl_s: antigüedad máxima según captured_at
+    - max_files / max_bytes: límites de la carpeta, se desaloja la página con el último
+      hit de recuperación más antiguo (LRU)
+    El estado (captured_at y último hit por archivo) se guarda en {web_dir}/.web_store.json.
+    Un límite en 0 o None queda deshabilitado.
+    """
+    def __init__(self, web_dir, ttl_s=None, max_files=None, max_bytes=None):
+        self.web_dir = web_dir
+        self.ttl_s = ttl_s
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.path = os.path.join(web_dir, ".web_store.json")
+        self.lock = threading.RLock()
+        self._pages = self._load()  # nombre -> {"captured_at", "last_hit"}
+        self._dirty = False
+        self.stats = {
+            "evicted_expired": 0,
+            "evicted_lru": 0,
+            "bytes_freed": 0,
+            "last_run": None,
+        }
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return dict(json.load(f))
+        except Exception:
+            return {}
+
+    def _write(self):
+        os.makedirs(self.web_dir, exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._pages, f)
+        os.replace(tmp, self.path)
+        self._dirty = False
+
+    def touch(self, sources):
+        """Registra un hit de recuperación para las páginas web indicadas (rutas o nombres)"""
+        now = time.time()
+        with self.lock:
+            for src in sources:
+                name = os.path.basename(str(src))
+                if _WEB_FILE_RE.match(name):
+                    self._pages.setdefault(name, {})["last_hit"] = now
+                    self._dirty = True
+
+    def _scan(self):
+        # Archivos presentes en disco (tamaño) y sincronización del estado
+        files = {}
+        if os.path.isdir(self.web_dir):
+            for entry in os.scandir(self.web_dir):
+                if entry.is_file() and _WEB_FILE_RE.match(entry.name):
+                    files[entry.name] = entry.stat().st_size
+
+        for name in [n for n in self._pages if n not in files]:
+            del self._pages[name]
+            self._dirty = True
+        for name in files:
+            info = self._pages.setdefault(name, {})
+            if "captured_at" not in info:
+                info["captured_at"] = _read_captured_at(os.path.join(self.web_dir, name))
+                self._dirty = True
+        return files
+
+    def enforce(self, remove=None):
+        """
+        Aplica la política y borra las páginas desalojadas.
+        remove(ruta) se llama antes de borrar cada archivo (p. ej. baja incremental en el índice).
+        Devuelve la lista de rutas eliminadas.
+        """
+        with self.lock:
+            files = self._scan()
+            now = time.time()
+            evicted = []
+
+            def _evict(name, reason):
+                path = os.path.join(self.web_dir, name)
+                if remove is not None:
+                    remove(path)
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                self.stats[reason] += 1
+                self.stats["bytes_freed"] += files.pop(name)
+                del self._pages[name]
+                self._dirty = True
+                evicted.append(path)
+
+            if self.ttl_s:
+                for name in [n for n in files if now - self._pages[n]["captured_at"] > self.ttl_s]:
+                    _evict(name, "evicted_expired")
+
+            # LRU: último hit de recuperación, o captura si nunca se recuperó
+            lru = sorted(files, key=lambda n: self._pages[n].get("last_hit", self._pages[n]["captured_at"]))
+            total = sum(files.values())
+            for name in lru:
+                over_files = self.max_files and len(files) > self.max_files
+                over_bytes = self.max_bytes and total > self.max_bytes
+                if not (over_files or over_bytes):
+                    break
+                total -= files[name]
+                _evict(name, "evicted_lru")
+
+            self.stats["last_run"] = now
+            if self._dirty:
+                self._write()
+            return evicted
+
+    def status(self):
+        with self.lock:
+            files = self._scan()
+            return {
+                "files": len(files),
+                "bytes": sum(files.values()),
+                "ttl_s": self.ttl_s,
+                "max_files": self.max_files,
+                "max_bytes": self.max_bytes,
+                **self.stats,
+            }
@@ -0,0 +1,87 @@
+import asyncio
+import uuid
+
+from server.tracing import annotate
+
+class LLMEngine:
+    """
+    Motor de generación asíncrono sobre vLLM AsyncLLMEngine.
+    Las solicitudes entran al batch continuo de vLLM y se esperan con await,
+    sin bloquear el event loop del servidor.
+    """
+    def __init__(self, model_dir, dtype, max_model_len, gpu_memory_utilization, trust_remote_code, enable_prefix_caching=True):
+        # Import diferido: StubEngine y las pruebas en CPU no necesitan vLLM
+        from vllm import AsyncEngineArgs, AsyncLLMEngine
+        from transformers import AutoTokenizer
+
+        self.model_dir = model_dir
+        args = AsyncEngineArgs(
+            model=model_dir,
+            trust_remote_code=trust_remote_code,
+            dtype=dtype,
+            max_model_len=max_model_len,
+            gpu_memory_utilization=gpu_memory_utilization,
+            # Reutiliza el KV cache de prefijos comunes (instrucciones de sistema, historial de sesiones)
+            enable_prefix_caching=enable_prefix_caching,
+        )
+        self.engine = AsyncLLMEngine.from_engine_args(args)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir, trust_remote_code=bool(trust_remote_code))
+
+    def get_tokenizer(self):
+        return self.tokenizer
+
+    async def generate(self, prompt, sampling, request_id=None, progress=None):
+        """
+        Genera la respuesta completa de un prompt (texto o {"prompt_token_ids": [...]}).
+        Devuelve el texto generado.
+        - progress(n): opcional, recibe la cantidad de tokens generados hasta el momento
+        Si la tarea se cancela, vLLM aborta la solicitud y libera su lugar en el batch.
+        """
+        request_id = request_id or uuid.uuid4().hex
+        final = None
+        async for out in self.engine.generate(prompt, sampling, request_id):
+            final = out
+            if progress is not None and out.outputs:
+                progress(len(out.outputs[0].token_ids))
+        if final is not None and final.prompt_token_ids is not None:
+            annotate(prompt_tokens=len(final.prompt_token_ids))
+        return final.outputs[0].text if final and final.outputs else ""
+
+    async def abort(self, request_id):
+        await self.engine.abort(request_id)
+
+    def shutdown(self):
+        if hasattr(self.engine, "shutdown"):
+            self.engine.shutdown()
+
+class StubEngine:
+    """
+    Motor falso para CPU (pruebas de concurrencia sin GPU ni modelo).
+    Simula la latencia de generación con await y devuelve el final del prompt.
+    """
+    def __init__(self, token_delay_s=0.005, max_tokens=64, model_dir="stub"):
+        self.model_dir = model_dir
+        self.token_delay_s = token_delay_s
+        self.max_tokens = max_tokens
+
+    def get_tokenizer(self):
+        # Sin plantilla de chat: build_prompt_from_messages usa el formato alternativo
+        return None
+
+    async def generate(self, prompt, sampling, request_id=None, progress=None):
+        n = min(int(getattr(sampling, "max_tokens", None) or self.max_tokens), self.max_tokens)
+        # Un "token" por paso para que la cancelación y el progreso se comporten como en vLLM
+        for i in range(n):
+            await asyncio.sleep(self.token_delay_s)
+            if progress is not None:
+                progress(i + 1)
+        if isinstance(prompt, dict):
+            annotate(prompt_tokens=len(prompt.get("prompt_token_ids") or []))
+            return f"[stub] {len(prompt.get('prompt_token_ids') or [])} tokens"
+        return f"[stub] {prompt[-200:]}"
+
+    async def abort(self, request_id):
+        pass
+
+    def shutdown(self):
+        pass
@@ -0,0 +1,143 @@
+import os
+import time
+import uuid
+import asyncio
+import threading
+
+from server.tracing import span
+
+# Intervalo de sondeo de desconexión del cliente
+DISCONNECT_POLL_S = 0.25
+
+class RequestCancelled(Exception):
+    def __init__(self, request_id, reason):
+        super().__init__(f"Solicitud {request_id} cancelada ({reason})")
+        self.request_id = request_id
+        self.reason = reason
+
+class _Inflight:
+    def __init__(self, request_id, endpoint, max_tokens, engine):
+        self.request_id = request_id
+        self.endpoint = endpoint
+        self.max_tokens = max_tokens
+        self.engine = engine
+        self.started = time.time()
+        self.tokens = 0
+        self.reason = None
+        self.task = None
+
+    def progress(self, tokens):
+        self.tokens = tokens
+
+class RequestRegistry:
+    """
+    Ciclo de vida de las generaciones en curso.
+    - Si el cliente se desconecta o se llama a cancel(id), la generación se aborta en el
+      motor (libera su lugar en el batch)
+    - Métricas: solicitudes completadas/canceladas y tokens ahorrados (max_tokens - generados)
+    """
+    def __init__(self, engine=None):
+        # Motor por defecto; con varios modelos cada generación indica el suyo
+        self.engine = engine
+        self.lock = threading.Lock()
+        self._inflight = {}
+        self.metrics = {
+            "completed": 0,
+            "cancelled_disconnect": 0,
+            "cancelled_explicit": 0,
+            "cancelled_handler": 0,
+            "tokens_generated": 0,
+            "tokens_saved": 0,
+        }
+
+    @staticmethod
+    def new_id(http_request=None):
+        # El cliente puede fijar el id (X-Request-Id) para poder cancelarlo después
+        rid = http_request.headers.get("x-request-id") if http_request is not None else None
+        return rid or uuid.uuid4().hex
+
+    async def generate(self, prompt, sampling, request_id, http_request=None, endpoint="", engine=None):
+        """
+        Genera con el motor vigilando la desconexión del cliente.
+        Lanza RequestCancelled si la generación se abortó por desconexión o cancel(id); si se
+        cancela la tarea del handler la generación se aborta y se relanza CancelledError.
+        """
+        engine = engine or self.engine
+        entry = _Inflight(request_id, endpoint, int(getattr(sampling, "max_tokens", 0) or 0), engine)
+        with self.lock:
+            if request_id in self._inflight:
+                raise ValueError(f"Ya existe una solicitud en curso con id '{request_id}'")
+            self._inflight[request_id] = entry
+
+        with span("generate", endpoint=endpoint, max_tokens=entry.max_tokens) as s:
+            entry.task = asyncio.create_task(engine.generate(prompt, sampling, request_id, progress=entry.progress))
+            watcher = None
+            if http_request is not None:
+                watcher = asyncio.create_task(self._watch_disconnect(http_request, entry))
+
+            try:
+                text = await asyncio.shield(entry.task)
+                self._record(entry, completed=True)
+                return text
+            except asyncio.CancelledError:
+                # Sin motivo registrado se canceló el handler (p. ej. apagado del servidor), no
+                # la generación: se aborta en el motor y la cancelación se propaga tal cual
+                handler = entry.reason is None
+                if handler:
+                    entry.reason = "handler"
+                    entry.task.cancel()
+                await engine.abort(request_id)
+                self._record(entry, completed=False)
+                s.set(cancelled=entry.reason)
+                if handler:
+                    raise
+                raise RequestCancelled(request_id, entry.reason)
+            finally:
+                s.set(tokens=entry.tokens)
+                if watcher is not None:
+                    watcher.cancel()
+                with self.lock:
+                    self._inflight.pop(request_id, None)
+
+    async def _watch_disconnect(self, http_request, entry):
+        while not entry.task.done():
+            if await http_request.is_disconnected():
+                entry.reason = "disconnect"
+                entry.task.cancel()
+                return
+            await asyncio.sleep(DISCONNECT_POLL_S)
+
+    def cancel(self, request_id):
+        """Cancela una generación en curso. Devuelve False si el id no existe."""
+        with self.lock:
+            entry = self._inflight.get(request_id)
+        if entry is None or entry.task is None or entry.task.done():
+            return False
+        entry.reason = "explicit"
+        entry.task.get_loop().call_soon_threadsafe(entry.task.cancel)
+        return True
+
+    def _record(self, entry, completed):
+        with self.lock:
+            self.metrics["tokens_generated"] += entry.tokens
+            if completed:
+                self.metrics["completed"] += 1
+            else:
+                self.metrics[f"cancelled_{entry.reason}"] += 1
+                self.metrics["tokens_saved"] += max(0, entry.max_tokens - entry.tokens)
+
+    def status(self):
+        now = time.time()
+        with self.lock:
+            inflight = [
+                {
+                    "id": e.request_id,
+                    "endpoint": e.endpoint,
+                    "model": os.path.basename(e.engine.model_dir),
+                    "elapsed_s": round(now - e.started, 3),
+                    "tokens": e.tokens,
+                    "max_tokens": e.max_tokens,
+                }
+                for e in self._inflight.values()
+            ]
+            return {"in_flight": inflight, "metrics": dict(self.metrics)}
@@ -0,0 +1,246 @@
+import os
+import json
+import time
+import asyncio
+import threading
+
+def _dir_size(path):
+    # Tamaño de los pesos en disco (estimación de memoria al cargar el modelo)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+# Arquitecturas de generación de texto (config.json de transformers); el resto (p. ej. modelos
+# de embedding como multilingual-e5-base) no se registra como modelo de chat
+_LM_ARCH_SUFFIXES = ("ForCausalLM", "ForConditionalGeneration", "LMHeadModel")
+
+def _is_language_model(path):
+    try:
+        with open(os.path.join(path, "config.json"), "r", encoding="utf-8") as f:
+            archs = json.load(f).get("architectures") or []
+    except (OSError, ValueError, AttributeError):
+        return False
+    return any(str(a).endswith(_LM_ARCH_SUFFIXES) for a in archs)
+
+class ModelBusy(RuntimeError):
+    pass
+
+class ModelEntry:
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.nbytes = _dir_size(path)
+        self.engine = None
+        self.tokenizer = None
+        self.load_s = None
+        self.loads = 0
+        self.hits = 0
+        self.active = 0
+        self.last_used = None
+        self.lock = None
+
+    def info(self):
+        return {
+            "name": self.name,
+            "loaded": self.engine is not None,
+            "bytes": self.nbytes,
+            "load_s": self.load_s,
+            "loads": self.loads,
+            "hits": self.hits,
+            "in_flight": self.active,
+            "last_used": self.last_used,
+        }
+
+class ModelRegistry:
+    """
+    Modelos disponibles en models_dir (una carpeta por modelo) + modelos extra {nombre: ruta}.
+    - De models_dir solo se registran las carpetas cuyo config.json declara una arquitectura
+      de generación (*ForCausalLM, *ForConditionalGeneration, *LMHeadModel)
+    - Cada modelo se carga al primer uso con factory(ruta, fracción) -> motor (LLMEngine / StubEngine);
+      fracción es la parte de la GPU que le corresponde (ver share), con ella se acota la
+      memoria que reserva el motor (gpu_memory_utilization de vLLM)
+    - Los modelos cargados se mantienen en un LRU limitado por max_bytes (tamaño de los pesos);
+      un modelo con solicitudes en curso nunca se descarga
+    - gpu_bytes: memoria de GPU disponible para los motores (pesos + KV cache), opcional
+    """
+    def __init__(self, models_dir, factory, max_bytes, default_model=None, extra=None, gpu_bytes=None):
+        self.models_dir = models_dir
+        self.factory = factory
+        self.max_bytes = max_bytes
+        self.gpu_bytes = gpu_bytes
+        self.lock = threading.RLock()
+        self._load_lock = threading.Lock()
+        self._models = {}
+        for name, path in (extra or {}).items():
+            self._models[name] = ModelEntry(name, path)
+        self.refresh()
+        self.default_model = default_model or next(iter(sorted(self._models)), None)
+
+    def refresh(self):
+        """Registra las carpetas nuevas de models_dir"""
+        if not self.models_dir or not os.path.isdir(self.models_dir):
+            return
+        with self.lock:
+            for name in sorted(os.listdir(self.models_dir)):
+                path = os.path.join(self.models_dir, name)
+                if name.startswith(".") or name in self._models or not os.path.isdir(path):
+                    continue
+                if _is_language_model(path):
+                    self._models[name] = ModelEntry(name, path)
+
+    def get(self, name=None):
+        """Entrada del modelo (sin cargarlo). Lanza KeyError si no existe."""
+        name = name or self.default_model
+        with self.lock:
+            entry = self._models.get(name)
+        if entry is None:
+            self.refresh()
+            with self.lock:
+                entry = self._models.get(name)
+        if entry is None:
+            raise KeyError(f"Modelo no disponible: '{name}'")
+        return entry
+
+    def load(self, name=None):
+        """Carga síncrona (p. ej. el modelo por defecto al iniciar el servidor)"""
+        entry = self.get(name)
+        self._load_locked(entry)
+        return entry
+
+    def _load(self, entry):
+        t0 = time.perf_counter()
+        engine = self.factory(entry.path, self.share(entry))
+        entry.tokenizer = engine.get_tokenizer()
+        entry.engine = engine
+        entry.load_s = round(time.perf_counter() - t0, 3)
+        entry.loads += 1
+        print(f"[MODELS] Modelo '{entry.name}' cargado en {entry.load_s}s")
+
+    def max_resident(self):
+        """Cantidad máxima de modelos registrados que caben juntos en max_bytes (al menos 1)"""
+        if not self.max_bytes:
+            return 1
+        with self.lock:
+            sizes = sorted(e.nbytes for e in self._models.values())
+        n, total = 0, 0
+        for size in sizes:
+            if total + size > self.max_bytes:
+                break
+            n, total = n + 1, total + size
+        return max(n, 1)
+
+    def share(self, entry):
+        """
+        Fracción de la GPU que reserva el motor del modelo (0-1].
+        - Si no caben dos modelos a la vez en max_bytes, el único residente usa toda la GPU
+        - Si caben k: con gpu_bytes, sus pesos más una parte igual de lo que queda de la GPU
+          tras los pesos del presupuesto (KV cache); sin gpu_bytes, 1/k de la GPU.
+          En ambos casos los modelos que caben juntos en max_bytes suman como máximo 1
+        """
+        k = self.max_resident()
+        if k == 1:
+            return 1.0
+        if not self.gpu_bytes:
+            return 1.0 / k
+        headroom = max(0, self.gpu_bytes - self.max_bytes) / k
+        return min(1.0, (entry.nbytes + headroom) / self.gpu_bytes)
+
+    def _make_room(self, entry):
+        """
+        Quita de la GPU los modelos inactivos (LRU) hasta que el nuevo quepa en el presupuesto.
+        Se llama con self.lock tomado: solo se eligen y desvinculan, devuelve sus motores para
+        apagarlos después de soltar el lock.
+        """
+        loaded = [e for e in self._models.values() if e.engine is not None and e is not entry]
+        total = sum(e.nbytes for e in loaded)
+        victims = []
+        for e in sorted(loaded, key=lambda e: e.last_used or 0):
+            if total + entry.nbytes <= self.max_bytes:
+                break
+            if e.active:
+                continue
+            victims.append(e)
+            total -= e.nbytes
+        if loaded and total + entry.nbytes > self.max_bytes:
+            raise ModelBusy(f"Sin memoria para cargar '{entry.name}': los modelos cargados están en uso")
+        return [(e, self._detach(e)) for e in victims]
+
+    def _detach(self, entry):
+        # Con self.lock tomado: la entrada queda sin motor (las nuevas solicitudes lo recargan)
+        engine, entry.engine, entry.tokenizer = entry.engine, None, None
+        return engine
+
+    def _shutdown(self, victims):
+        for entry, engine in victims:
+            engine.shutdown()
+            print(f"[MODELS] Modelo '{entry.name}' descargado")
+
+    def unload(self, name):
+        with self.lock:
+            entry = self._models.get(name)
+            if entry is None or entry.engine is None or entry.active:
+                return False
+            victims = [(entry, self._detach(entry))]
+        self._shutdown(victims)
+        return True
+
+    async def acquire(self, name=None):
+        """
+        Reserva un modelo para una solicitud, cargándolo si hace falta (en un hilo, sin
+        bloquear el event loop). Mientras esté reservado no se descarga; liberar con release().
+        Lanza KeyError si no existe y ModelBusy si no hay memoria para cargarlo.
+        """
+        entry = self.get(name)
+        with self.lock:
+            entry.active += 1
+            if entry.lock is None:
+                entry.lock = asyncio.Lock()
+        try:
+            if entry.engine is None:
+                async with entry.lock:
+                    if entry.engine is None:
+                        await asyncio.to_thread(self._load_locked, entry)
+        except BaseException:
+            self.release(entry)
+            raise
+        entry.hits += 1
+        entry.last_used = time.time()
+        return entry
+
+    def release(self, entry):
+        with self.lock:
+            entry.active -= 1
+
+    def _load_locked(self, entry):
+        # Una carga a la vez: el presupuesto se verifica contra los modelos ya cargados
+        with self._load_lock:
+            if entry.engine is not None:
+                return
+            with self.lock:
+                victims = self._make_room(entry)
+            # Apagar los motores fuera de self.lock (acquire/release/status no esperan)
+            self._shutdown(victims)
+            self._load(entry)
+
+    def shutdown(self):
+        with self.lock:
+            loaded = [e for e in self._models.values() if e.engine is not None]
+            for e in loaded:
+                e.active = 0
+        for e in loaded:
+            self.unload(e.name)
+
+    def status(self):
+        with self.lock:
+            models = [e.info() for e in sorted(self._models.values(), key=lambda e: e.name)]
+        return {
+            "default": self.default_model,
+            "max_bytes": self.max_bytes,
+            "loaded_bytes": sum(m["bytes"] for m in models if m["loaded"]),
+            "models": models,
+        }
@@ -1,28 +1,42 @@
 import os
 import time
+import asyncio
 import sqlite3
 import threading
 import datetime
-from collections import deque
 
 class ApiUsageTracker:
-    def __init__(self, db_path):
+    """
+    Contador diario de llamadas a la API con escritura diferida (write-behind):
+    el conteo vive en memoria y se persiste en LANGSEARCH_STATE cada flush_interval_s
+    segundos o cada flush_every incrementos, y al cerrar (close) desde el lifespan.
+    """
+    def __init__(self, db_path, flush_interval_s=5.0, flush_every=20):
         self.db_path = db_path
+        self.flush_interval_s = flush_interval_s
+        self.flush_every = max(1, int(flush_every))
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
         self.lock = threading.RLock()
+        self._con = None
         self._ensure_tables()
         self.current_date, self.current_count = self._load_state()
+        self._pending = 0
+        self._last_flush = time.monotonic()
+        self._stop = threading.Event()
+        self._flusher = None
 
     def _conn(self):
-        # Limitar una conexión a la BD por operación
-        con = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
-        con.execute("PRAGMA journal_mode=WAL;")
-        con.execute("PRAGMA synchronous=NORMAL;")
-        return con
+        # Conexión persistente (los PRAGMA se ejecutan una sola vez), protegida por self.lock
+        if self._con is None:
+            self._con = sqlite3.connect(self.db_path, timeout=5, isolation_level=None, check_same_thread=False)
+            self._con.execute("PRAGMA journal_mode=WAL;")
+            self._con.execute("PRAGMA synchronous=NORMAL;")
+        return self._con
 
     def _ensure_tables(self):
         # Verificar que las tablas se hayan creado en la BD
-        with self._conn() as con:
+        with self.lock:
+            con = self._conn()
             con.execute("""
                 CREATE TABLE IF NOT EXISTS LANGSEARCH (
                     date TEXT PRIMARY KEY,
@@ -43,8 +57,8 @@ class ApiUsageTracker:
                 con.execute("INSERT INTO LANGSEARCH_STATE (id, date, count) VALUES (1, ?, 0)", (today,))
 
     def _load_state(self):
-        with self._conn() as con:
-            row = con.execute("SELECT date, count FROM LANGSEARCH_STATE WHERE id=1").fetchone()
+        with self.lock:
+            row = self._conn().execute("SELECT date, count FROM LANGSEARCH_STATE WHERE id=1").fetchone()
             return (row[0], row[1])
 
     def check_rollover(self):
@@ -53,32 +67,71 @@ class ApiUsageTracker:
             now_str = now_date.isoformat()
 
             if self.current_date != now_str:
-                # Persistir el total del día anterior a LANGSEARCH
-                with self._conn() as con:
+                # Persistir el total del día anterior a LANGSEARCH y setear estado al día actual (una transacción)
+                con = self._conn()
+                con.execute("BEGIN")
+                try:
                     con.execute("""
                         INSERT INTO LANGSEARCH (date, total_requests)
                         VALUES (?, ?)
                         ON CONFLICT(date) DO UPDATE SET
                         total_requests = total_requests + excluded.total_requests
                     """, (self.current_date, self.current_count))
-                    # Setear estado al dia actual
                     con.execute(
                         "UPDATE LANGSEARCH_STATE SET date=?, count=0 WHERE id=1",
                         (now_str,),
                     )
+                    con.execute("COMMIT")
+                except Exception:
+                    con.execute("ROLLBACK")
+                    raise
 
                 self.current_date = now_str
                 self.current_count = 0
+                self._pending = 0
+                self._last_flush = time.monotonic()
 
     def increment(self):
         with self.lock:
             self.check_rollover()
             self.current_count += 1
-            with self._conn() as con:
-                con.execute(
-                    "UPDATE LANGSEARCH_STATE SET count=? WHERE id=1", 
-                    (self.current_count,)
-                )
+            self._pending += 1
+            if self._pending >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_interval_s:
+                self.flush()
+
+    def flush(self):
+        """Persiste el conteo en memoria (no hace nada si no hay cambios pendientes)"""
+        with self.lock:
+            if self._pending == 0:
+                return
+            self._conn().execute(
+                "UPDATE LANGSEARCH_STATE SET date=?, count=? WHERE id=1",
+                (self.current_date, self.current_count)
+            )
+            self._pending = 0
+            self._last_flush = time.monotonic()
+
+    def start(self):
+        """Hilo que persiste el conteo cada flush_interval_s aunque no haya nuevas llamadas"""
+        def _loop():
+            while not self._stop.wait(self.flush_interval_s):
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"[RT] Error persistiendo uso de la API: {e}")
+
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=_loop, name="usage-flusher", daemon=True)
+            self._flusher.start()
+
+    def close(self):
+        """Flush final y cierre de la conexión (llamar al apagar el servidor)"""
+        self._stop.set()
+        with self.lock:
+            self.flush()
+            if self._con is not None:
+                self._con.close()
+                self._con = None
 
     def get_today_count(self):
         with self.lock:
@@ -86,8 +139,8 @@ class ApiUsageTracker:
             return self.current_count, self.current_date
 
     def get_history(self, limit = 30):
-        with self._conn() as con:
-            rows = con.execute("""
+        with self.lock:
+            rows = self._conn().execute("""
                 SELECT date, total_requests
                 FROM LANGSEARCH
                 ORDER BY date DESC
@@ -96,24 +149,63 @@ class ApiUsageTracker:
         return [{"date": d, "total_requests": t} for (d, t) in rows]
 
 class RateLimiter:
-    def __init__(self, tracker, qps, qpm, qpd):
+    """
+    Token buckets para QPS y QPM + tope diario (QPD) del tracker.
+    - acquire(): versión asyncio, espera con await (no bloquea el event loop) y atiende
+      a los solicitantes en orden FIFO con un plazo máximo
+    - check_usage(): versión síncrona para los llamadores existentes
+    """
+    def __init__(self, tracker, qps, qpm, qpd, max_wait=1.0):
         self.tracker = tracker
         self.qps = max(1, int(qps))
         self.qpm = max(1, int(qpm))
         self.qpd = int(qpd) if qpd is not None else None
+        self.max_wait = max_wait
 
-        self._sec_window = deque()  # timestamps últimos 1s
-        self._min_window = deque()  # timestamps últimos 60s
+        # Buckets: capacidad = límite de la ventana, recarga continua a límite/ventana
+        now = time.monotonic()
+        self._buckets = [
+            {"capacity": float(self.qps), "rate": self.qps / 1.0, "tokens": float(self.qps), "t": now},
+            {"capacity": float(self.qpm), "rate": self.qpm / 60.0, "tokens": float(self.qpm), "t": now},
+        ]
         self._lock = threading.RLock()
+        self._async_lock = None
+
+    def _try_reserve(self):
+        """
+        Reserva un cupo si hay tokens en todos los buckets. Devuelve 0 si se reservó,
+        o los segundos a esperar hasta el próximo token.
+        """
+        with self._lock:
+            now = time.monotonic()
+            for b in self._buckets:
+                b["tokens"] = min(b["capacity"], b["tokens"] + (now - b["t"]) * b["rate"])
+                b["t"] = now
 
-    def _prune(self, now):
-        sec_cutoff = now - 1.0
-        while self._sec_window and self._sec_window[0] <= sec_cutoff:
-            self._sec_window.popleft()
+            today_count, _ = self.tracker.get_today_count()
+            if self.qpd is not None and today_count >= self.qpd:
+                raise RuntimeError(f"[RT] Límite diario alcanzado (QPD={self.qpd}).")
 
-        min_cutoff = now - 60.0
-        while self._min_window and self._min_window[0] <= min_cutoff:
-            self._min_window.popleft()
+            wait = max((1.0 - b["tokens"]) / b["rate"] for b in self._buckets)
+            if wait > 0:
+                return wait
+
+            # Reservar cupo y contar el intento
+            for b in self._buckets:
+                b["tokens"] -= 1.0
+            self.tracker.increment()
+            return 0.0
+
+    async def _reserve(self):
+        # Estado en memoria: la reserva es inmediata y puede correr en el event loop
+        return self._try_reserve()
+
+    def get_today_count(self):
+        """(llamadas de hoy, fecha)"""
+        return self.tracker.get_today_count()
+
+    def get_history(self, limit=30):
+        return self.tracker.get_history(limit)
 
     def check_usage(self):
         """
@@ -121,37 +213,166 @@ class RateLimiter:
         - Para QPS/QPM: si no hay cupo, espera hasta max_wait
         - Para QPD: si no hay cupo, lanza error inmediata
         """
-        max_wait = 1
-        start = time.time()
+        deadline = time.monotonic() + self.max_wait
         while True:
-            with self._lock:
-                now = time.time()
-                self._prune(now)
-
-                sec_ok = len(self._sec_window) < self.qps
-                min_ok = len(self._min_window) < self.qpm
-
-                today_count, _ = self.tracker.get_today_count()
-                day_ok = True if self.qpd is None else (today_count < self.qpd)
-                
-                # Reservar cupo y contar el intento
-                if sec_ok and min_ok and day_ok:
-                    self._sec_window.append(now)
-                    self._min_window.append(now)
-                    self.tracker.increment()
+            wait = self._try_reserve()
+            if wait == 0:
+                return
+            if time.monotonic() + wait > deadline:
+                raise RuntimeError("[RT] Rate-limit: excede tiempo máximo de espera.")
+            time.sleep(wait)
+
+    async def acquire(self, timeout=None):
+        """
+        Igual que check_usage pero sin bloquear el event loop. Los solicitantes esperan
+        en orden de llegada (asyncio.Lock es FIFO); solo el primero espera el próximo token.
+        """
+        loop = asyncio.get_running_loop()
+        timeout = self.max_wait if timeout is None else timeout
+        deadline = loop.time() + timeout
+        if self._async_lock is None:
+            self._async_lock = asyncio.Lock()
+
+        try:
+            await asyncio.wait_for(self._async_lock.acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise RuntimeError("[RT] Rate-limit: excede tiempo máximo de espera.")
+
+        try:
+            while True:
+                wait = await self._reserve()
+                if wait == 0:
                     return
+                # Si el próximo token llega después del plazo, fallar sin esperar
+                if loop.time() + wait > deadline:
+                    raise RuntimeError("[RT] Rate-limit: excede tiempo máximo de espera.")
+                await asyncio.sleep(wait)
+        finally:
+            self._async_lock.release()
+
+class SharedRateLimiter(RateLimiter):
+    """
+    RateLimiter con estado compartido entre procesos (varios workers de uvicorn).
+    Los buckets QPS/QPM y el conteo diario viven en SQLite; cada reserva es atómica
+    (BEGIN IMMEDIATE: un solo proceso a la vez lee, recarga y descuenta tokens).
+    El uso diario y el historial se leen de LANGSEARCH_DAILY / LANGSEARCH_HISTORY (totales
+    de todos los procesos); el contador por proceso del tracker no se usa en este modo.
+    acquire() reserva en un hilo: la transacción puede esperar el lock de SQLite (hasta 5 s).
+    """
+    def __init__(self, tracker, qps, qpm, qpd, db_path, max_wait=1.0):
+        super().__init__(tracker, qps, qpm, qpd, max_wait)
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self._con = None
+        self._ensure_tables()
 
-                if not day_ok:
-                    raise RuntimeError(f"[RT] Límite diario alcanzado (QPD={self.qpd}).")
+    def _conn(self):
+        if self._con is None:
+            self._con = sqlite3.connect(self.db_path, timeout=5, isolation_level=None, check_same_thread=False)
+            self._con.execute("PRAGMA journal_mode=WAL;")
+            self._con.execute("PRAGMA synchronous=NORMAL;")
+        return self._con
+
+    def _ensure_tables(self):
+        with self._lock:
+            con = self._conn()
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS LANGSEARCH_BUCKETS (
+                    name TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    t REAL NOT NULL
+                )
+            """)
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS LANGSEARCH_DAILY (
+                    id INTEGER PRIMARY KEY CHECK (id=1),
+                    date TEXT NOT NULL,
+                    count INTEGER NOT NULL
+                )
+            """)
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS LANGSEARCH_HISTORY (
+                    date TEXT PRIMARY KEY,
+                    total_requests INTEGER NOT NULL
+                )
+            """)
+            now = time.time()
+            for name, capacity in (("qps", self.qps), ("qpm", self.qpm)):
+                con.execute(
+                    "INSERT OR IGNORE INTO LANGSEARCH_BUCKETS (name, tokens, t) VALUES (?, ?, ?)",
+                    (name, float(capacity), now),
+                )
+            con.execute(
+                "INSERT OR IGNORE INTO LANGSEARCH_DAILY (id, date, count) VALUES (1, ?, 0)",
+                (datetime.date.today().isoformat(),),
+            )
 
-                waits = []
-                if not sec_ok and self._sec_window:
-                    waits.append(self._sec_window[0] + 1.0 - now)
-                if not min_ok and self._min_window:
-                    waits.append(self._min_window[0] + 60.0 - now)
+    @staticmethod
+    def _rollover(con):
+        # Dentro de una transacción: archivar el total del día anterior (de todos los procesos)
+        today = datetime.date.today().isoformat()
+        date, count = con.execute("SELECT date, count FROM LANGSEARCH_DAILY WHERE id=1").fetchone()
+        if date == today:
+            return count
+        con.execute(
+            "INSERT OR REPLACE INTO LANGSEARCH_HISTORY (date, total_requests) VALUES (?, ?)",
+            (date, count),
+        )
+        con.execute("UPDATE LANGSEARCH_DAILY SET date=?, count=0 WHERE id=1", (today,))
+        return 0
 
-                sleep_for = max(0.0, min(waits) if waits else 0.05)
+    def _transaction(self, fn):
+        with self._lock:
+            con = self._conn()
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                out = fn(con)
+                con.execute("COMMIT")
+                return out
+            except BaseException:
+                if con.in_transaction:
+                    con.execute("ROLLBACK")
+                raise
 
-            if (time.time() - start) + sleep_for > max_wait:
-                raise RuntimeError("[RT] Rate-limit: excede tiempo máximo de espera.")
-            time.sleep(sleep_for if sleep_for > 0 else 0.05)
+    async def _reserve(self):
+        # BEGIN IMMEDIATE puede esperar a otro proceso: fuera del event loop
+        return await asyncio.to_thread(self._try_reserve)
+
+    def _try_reserve(self):
+        return self._transaction(self._reserve_in)
+
+    def _reserve_in(self, con):
+        # Reloj de pared: los tiempos se comparan entre procesos
+        now = time.time()
+        count = self._rollover(con)
+        if self.qpd is not None and count >= self.qpd:
+            raise RuntimeError(f"[RT] Límite diario alcanzado (QPD={self.qpd}).")
+
+        rows = dict((n, (tok, t)) for n, tok, t in con.execute("SELECT name, tokens, t FROM LANGSEARCH_BUCKETS"))
+        buckets = {}
+        for name, capacity, window in (("qps", self.qps, 1.0), ("qpm", self.qpm, 60.0)):
+            tokens, t = rows.get(name, (float(capacity), now))
+            rate = capacity / window
+            buckets[name] = (min(float(capacity), tokens + max(0.0, now - t) * rate), rate)
+
+        wait = max((1.0 - tokens) / rate for tokens, rate in buckets.values())
+        if wait > 0:
+            return wait
+
+        for name, (tokens, _) in buckets.items():
+            con.execute("UPDATE LANGSEARCH_BUCKETS SET tokens=?, t=? WHERE name=?", (tokens - 1.0, now, name))
+        con.execute("UPDATE LANGSEARCH_DAILY SET count=count + 1 WHERE id=1")
+        return 0.0
+
+    def get_today_count(self):
+        count = self._transaction(self._rollover)
+        return count, datetime.date.today().isoformat()
+
+    def get_history(self, limit=30):
+        self._transaction(self._rollover)
+        with self._lock:
+            rows = self._conn().execute(
+                "SELECT date, total_requests FROM LANGSEARCH_HISTORY ORDER BY date DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [{"date": d, "total_requests": t} for (d, t) in rows]
@@ -9,6 +9,7 @@ class Message(BaseModel):
 
 class ChatRequest(BaseModel):
     messages: List[Message] = Field(min_length=1)
+    model: Optional[str] = None
     params: Optional[Dict[str, Numeric]] = None
     max_tokens: Optional[int] = 2048
 
@@ -22,3 +23,12 @@ class ChatResponse(BaseModel):
     created: int
     model: str
     choices: List[ChatChoice]
+
+class SessionCreate(BaseModel):
+    messages: List[Message] = Field(default_factory=list)
+    model: Optional[str] = None
+
+class SessionMessage(BaseModel):
+    content: str = Field(min_length=1)
+    params: Optional[Dict[str, Numeric]] = None
+    max_tokens: Optional[int] = 2048
@@ -0,0 +1,249 @@
+import time
+import uuid
+import asyncio
+import threading
+from collections import OrderedDict
+
+from server.schemas import Message
+from server.utils import render_messages
+
+# Mensajes ancla para renderizar fragmentos: fragmento(m) = render(ancla + [m]) - render(ancla)
+_ANCHOR = [Message(role="system", content="."), Message(role="user", content=".")]
+
+# Caracteres del final del historial que se vuelven a tokenizar junto a cada fragmento nuevo
+_BOUNDARY_CHARS = 64
+
+class PromptRenderer:
+    """
+    Renderizado incremental con la chat template: cada mensaje nuevo se renderiza junto a
+    un ancla fija de tamaño constante (O(mensaje nuevo), no O(historial)).
+    Si la plantilla no es estable por prefijo (el render de un mensaje cambia el de los
+    anteriores), fragment() devuelve None y la sesión se renderiza completa.
+    """
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self._anchor = render_messages(_ANCHOR, tokenizer, add_generation_prompt=False)
+        self.generation_suffix = self._generation_suffix()
+
+    def _generation_suffix(self):
+        """
+        Sufijo de generación (p. ej. "<|im_start|>assistant\n"), o None si la plantilla no
+        permite construir el historial concatenando fragmentos.
+        """
+        probe = _ANCHOR + [Message(role="assistant", content="a"), Message(role="user", content="b")]
+        frags = [self.fragment(m) for m in probe[len(_ANCHOR):]]
+        if None in frags or self.render(probe) != self._anchor + "".join(frags):
+            return None
+
+        full = self.render(probe, add_generation_prompt=True)
+        base = self.render(probe)
+        return full[len(base):] if full.startswith(base) else None
+
+    def render(self, messages, add_generation_prompt=False):
+        return render_messages(messages, self.tokenizer, add_generation_prompt)
+
+    def fragment(self, message):
+        full = render_messages(_ANCHOR + [message], self.tokenizer, add_generation_prompt=False)
+        if not full.startswith(self._anchor):
+            return None
+        return full[len(self._anchor):]
+
+    def encode(self, text):
+        if self.tokenizer is None:
+            return None
+        return self.tokenizer.encode(text, add_special_tokens=False)
+
+class Session:
+    """
+    Conversación guardada en el servidor: mensajes, prompt renderizado y token ids acumulados.
+    """
+    def __init__(self, session_id, messages, renderer, model=None):
+        self.id = session_id
+        self.model = model
+        self.messages = list(messages)
+        self.renderer = renderer
+        self.created = time.time()
+        self.last_used = self.created
+        self.turns = 0
+        self.incremental = renderer.generation_suffix is not None
+        self.lock = asyncio.Lock()
+        self._rebuild()
+
+    def _rebuild(self):
+        # Render y tokenización completos (creación o plantilla no incremental)
+        self.text = self.renderer.render(self.messages)
+        ids = self.renderer.encode(self.text)
+        self.ids = list(ids) if ids is not None else None
+        self._n_ids = len(self.ids) if self.ids is not None else 0
+        self._content_bytes = sum(len(m.content) for m in self.messages)
+
+    def _truncate(self):
+        # Descarta los ids de un prompt anterior que no se confirmó (prepare sin commit)
+        if self.ids is not None:
+            del self.ids[self._n_ids:]
+
+    def _encode_tail(self, text):
+        """
+        Ids de text para agregar al final del historial, tokenizado junto a sus últimos
+        caracteres. None si los tokens del límite cambian (p. ej. "\n" + "\n" -> "\n\n").
+        """
+        tail = self.text[-_BOUNDARY_CHARS:]
+        head = self.renderer.encode(tail)
+        joined = self.renderer.encode(tail + text)
+        if joined[:len(head)] != head:
+            return None
+        return joined[len(head):]
+
+    def _extend(self, fragment):
+        if self.ids is not None:
+            ids = self._encode_tail(fragment)
+            if ids is None:
+                self.ids = list(self.renderer.encode(self.text + fragment))
+            else:
+                self.ids.extend(ids)
+            self._n_ids = len(self.ids)
+        self.text += fragment
+
+    def prepare(self, content):
+        """
+        Prompt para generar la respuesta a un mensaje nuevo del usuario, sin modificar el historial.
+        Devuelve (prompt, pendiente): pendiente se confirma con commit() al terminar.
+        """
+        user = Message(role="user", content=content)
+        self._truncate()
+        fragment = self.renderer.fragment(user) if self.incremental and len(self.messages) > 1 else None
+        if fragment is None:
+            # Primer turno o plantilla no incremental: render completo
+            text = self.renderer.render(self.messages + [user], add_generation_prompt=True)
+            ids = self.renderer.encode(text)
+            pending = {"user": user, "fragment": None}
+        else:
+            suffix = self.renderer.generation_suffix
+            ids = None
+            if self.ids is not None:
+                # Con token ids el motor no vuelve a tokenizar el historial: los del turno nuevo
+                # se agregan a la lista de la sesión (commit o el próximo prepare los descartan)
+                new = self._encode_tail(fragment + suffix)
+                if new is None:
+                    ids = self.renderer.encode(self.text + fragment + suffix)
+                else:
+                    self.ids.extend(new)
+                    ids = self.ids
+            else:
+                text = self.text + fragment + suffix
+            pending = {"user": user, "fragment": fragment}
+
+        prompt = {"prompt_token_ids": ids} if ids is not None else text
+        return prompt, pending
+
+    def commit(self, pending, reply):
+        """Agrega el turno (usuario + asistente) al historial y al prompt acumulado"""
+        assistant = Message(role="assistant", content=reply)
+        self.messages += [pending["user"], assistant]
+        self._content_bytes += len(pending["user"].content) + len(reply)
+        self.turns += 1
+        self.last_used = time.time()
+
+        self._truncate()
+        frag = self.renderer.fragment(assistant) if pending["fragment"] is not None else None
+        if frag is None:
+            self._rebuild()
+            return
+        self._extend(pending["fragment"] + frag)
+
+    @property
+    def n_tokens(self):
+        return self._n_ids if self.ids is not None else None
+
+    def nbytes(self):
+        # Estimación: texto renderizado + ids (referencia de 8 bytes por token) + contenido de los mensajes
+        ids = 8 * self._n_ids if self.ids is not None else 0
+        return len(self.text) + ids + self._content_bytes
+
+    def info(self):
+        return {
+            "id": self.id,
+            "model": self.model,
+            "turns": self.turns,
+            "messages": len(self.messages),
+            "tokens": self.n_tokens,
+            "bytes": self.nbytes(),
+            "incremental": self.incremental,
+            "idle_s": round(time.time() - self.last_used, 3),
+        }
+
+class SessionStore:
+    """
+    Sesiones en memoria con desalojo por inactividad (idle_ttl_s) y por presupuesto (max_bytes, LRU).
+    Cada sesión queda asociada al modelo con el que se creó (un renderer por modelo).
+    """
+    def __init__(self, max_bytes, idle_ttl_s):
+        self._renderers = {}
+        self.max_bytes = max_bytes
+        self.idle_ttl_s = idle_ttl_s
+        self.lock = threading.Lock()
+        self._sessions = OrderedDict()
+        self.stats = {"created": 0, "evicted_idle": 0, "evicted_memory": 0}
+
+    def renderer(self, model, tokenizer):
+        # La plantilla se sondea una sola vez por modelo (se conserva si el modelo se descarga)
+        with self.lock:
+            renderer = self._renderers.get(model)
+        if renderer is None:
+            renderer = PromptRenderer(tokenizer)
+            with self.lock:
+                renderer = self._renderers.setdefault(model, renderer)
+        return renderer
+
+    def create(self, messages, model=None, tokenizer=None):
+        session = Session(uuid.uuid4().hex, messages, self.renderer(model, tokenizer), model)
+        with self.lock:
+            self._sessions[session.id] = session
+            self.stats["created"] += 1
+            self._evict(keep=session.id)
+        return session
+
+    def get(self, session_id):
+        with self.lock:
+            self._evict()
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_used = time.time()
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def delete(self, session_id):
+        with self.lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def touch(self, session):
+        # Recalcular el presupuesto después de que la sesión creció
+        with self.lock:
+            self._evict(keep=session.id)
+
+    def _evict(self, keep=None):
+        now = time.time()
+        if self.idle_ttl_s:
+            for sid in [s.id for s in self._sessions.values() if now - s.last_used > self.idle_ttl_s and s.id != keep]:
+                del self._sessions[sid]
+                self.stats["evicted_idle"] += 1
+
+        total = sum(s.nbytes() for s in self._sessions.values())
+        for sid in list(self._sessions.keys()):
+            if total <= self.max_bytes:
+                break
+            if sid == keep or self._sessions[sid].lock.locked():
+                continue
+            total -= self._sessions.pop(sid).nbytes()
+            self.stats["evicted_memory"] += 1
+
+    def status(self):
+        with self.lock:
+            self._evict()
+            return {
+                "sessions": len(self._sessions),
+                "bytes": sum(s.nbytes() for s in self._sessions.values()),
+                "max_bytes": self.max_bytes,
+                "idle_ttl_s": self.idle_ttl_s,
+                **self.stats,
+            }
@@ -0,0 +1,225 @@
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler
+
+# Span activo de la solicitud (se propaga a tareas asyncio y a hilos con copy_context)
+_current = ContextVar("trace_span", default=None)
+
+class Span:
+    def __init__(self, name, trace, attrs):
+        self.name = name
+        self.trace = trace
+        self.attrs = dict(attrs)
+        self.children = []
+        self.start = time.perf_counter()
+        self.end = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    @property
+    def duration_ms(self):
+        end = self.end if self.end is not None else time.perf_counter()
+        return (end - self.start) * 1000.0
+
+    def to_dict(self, t0):
+        return {
+            "name": self.name,
+            "start_ms": round((self.start - t0) * 1000.0, 3),
+            "duration_ms": round(self.duration_ms, 3),
+            **({"attrs": self.attrs} if self.attrs else {}),
+            **({"children": [c.to_dict(t0) for c in list(self.children)]} if self.children else {}),
+        }
+
+class _NoopSpan:
+    def set(self, **attrs):
+        pass
+
+NOOP_SPAN = _NoopSpan()
+
+class Trace:
+    def __init__(self, trace_id, name, attrs):
+        self.id = trace_id
+        self.created = time.time()
+        self.root = Span(name, self, attrs)
+
+    @property
+    def duration_ms(self):
+        return self.root.duration_ms
+
+    def to_dict(self):
+        return {"id": self.id, "created": self.created, **self.root.to_dict(self.root.start)}
+
+@contextmanager
+def span(name, **attrs):
+    """
+    Span hijo del span activo. Sin traza activa (tracing desactivado) no hace nada.
+    Uso: with span("retrieve", top_k=5) as s: ...; s.set(hits=len(hits))
+    """
+    parent = _current.get()
+    if parent is None:
+        yield NOOP_SPAN
+        return
+
+    s = Span(name, parent.trace, attrs)
+    parent.children.append(s)
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.attrs["error"] = type(e).__name__
+        raise
+    finally:
+        s.end = time.perf_counter()
+        _current.reset(token)
+
+def annotate(**attrs):
+    """Agrega atributos al span activo (si hay traza)"""
+    s = _current.get()
+    if s is not None:
+        s.set(**attrs)
+
+class Tracer:
+    """
+    Trazas por solicitud (árbol de spans con duración y tamaños).
+    - mode: off | header (solo solicitudes con X-Trace: 1) | all
+    - Las últimas max_traces se consultan por id (el id de la respuesta)
+    - Las solicitudes que superan slow_ms se escriben en un JSONL rotativo (slow_log_path):
+      con su árbol de spans si se trazaron, si no solo ruta, estado y duración
+    """
+    def __init__(self, mode="header", slow_ms=0, slow_log_path=None, max_traces=500, slow_log_max_bytes=10 * 1024 * 1024, slow_log_backups=5):
+        self.mode = mode
+        self.slow_ms = slow_ms
+        self.max_traces = max_traces
+        self.lock = threading.Lock()
+        self._traces = OrderedDict()
+        self.slow_count = 0
+
+        self._slow_log = None
+        if slow_log_path and slow_ms:
+            handler = RotatingFileHandler(slow_log_path, maxBytes=slow_log_max_bytes, backupCount=slow_log_backups, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._slow_log = logging.getLogger(f"slow_requests.{slow_log_path}")
+            self._slow_log.setLevel(logging.INFO)
+            self._slow_log.propagate = False
+            self._slow_log.addHandler(handler)
+
+    def wants(self, headers):
+        if self.mode == "all":
+            return True
+        if self.mode == "header":
+            return headers.get("x-trace", "").lower() in ("1", "true", "yes")
+        return False
+
+    @contextmanager
+    def trace(self, trace_id, name, **attrs):
+        t = Trace(trace_id, name, attrs)
+        token = _current.set(t.root)
+        try:
+            yield t.root
+        except BaseException as e:
+            t.root.attrs["error"] = type(e).__name__
+            raise
+        finally:
+            t.root.end = time.perf_counter()
+            _current.reset(token)
+            self._finish(t)
+
+    def _finish(self, t):
+        with self.lock:
+            self._traces[t.id] = t
+            self._traces.move_to_end(t.id)
+            while len(self._traces) > self.max_traces:
+                self._traces.popitem(last=False)
+
+        if self.is_slow(t.duration_ms):
+            self.log_slow(t.to_dict())
+
+    def is_slow(self, duration_ms):
+        return self._slow_log is not None and duration_ms >= self.slow_ms
+
+    def log_slow(self, record):
+        with self.lock:
+            self.slow_count += 1
+        self._slow_log.info(json.dumps(record, ensure_ascii=False, default=str))
+
+    def get(self, trace_id):
+        with self.lock:
+            t = self._traces.get(trace_id)
+        return t.to_dict() if t is not None else None
+
+    def recent(self, limit=50):
+        with self.lock:
+            traces = list(self._traces.values())[-limit:]
+        return [
+            {"id": t.id, "name": t.root.name, "created": t.created, "duration_ms": round(t.duration_ms, 3)}
+            for t in reversed(traces)
+        ]
+
+class TracingMiddleware:
+    """
+    Middleware ASGI: abre la traza de las solicitudes elegidas por el Tracer.
+    El id de la traza es el X-Request-Id (se genera si falta), el mismo id de la respuesta.
+    El resto de las solicitudes solo se cronometra para el log de solicitudes lentas.
+    """
+    def __init__(self, app, tracer):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope["headers"]}
+        if not self.tracer.wants(headers):
+            return await self._timed(scope, receive, send, headers)
+
+        trace_id = headers.get("x-request-id")
+        if not trace_id:
+            trace_id = uuid.uuid4().hex
+            scope = dict(scope, headers=list(scope["headers"]) + [(b"x-request-id", trace_id.encode("latin-1"))])
+
+        with self.tracer.trace(trace_id, f"{scope['method']} {scope['path']}") as root:
+            async def _send(message):
+                if message["type"] == "http.response.start":
+                    root.set(status=message["status"])
+                    message = dict(message, headers=list(message.get("headers", [])) + [(b"x-trace-id", trace_id.encode("latin-1"))])
+                await send(message)
+
+            await self.app(scope, receive, _send)
+
+    async def _timed(self, scope, receive, send, headers):
+        if self.tracer._slow_log is None:
+            return await self.app(scope, receive, send)
+
+        created = time.time()
+        start = time.perf_counter()
+        attrs = {}
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                attrs["status"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        except BaseException as e:
+            attrs["error"] = type(e).__name__
+            raise
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000.0
+            if self.tracer.is_slow(duration_ms):
+                self.tracer.log_slow({
+                    "id": headers.get("x-request-id"),
+                    "created": created,
+                    "name": f"{scope['method']} {scope['path']}",
+                    "duration_ms": round(duration_ms, 3),
+                    "traced": False,
+                    **({"attrs": attrs} if attrs else {}),
+                })
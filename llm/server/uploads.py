@@ -0,0 +1,210 @@
+import os
+import json
+import asyncio
+import hashlib
+import tempfile
+import threading
+
+from fastapi import HTTPException
+
+CHUNK_SIZE = 1024 * 1024  # 1 MB por lectura
+FORM_OVERHEAD_BYTES = 1024 * 1024  # Campos del formulario y cabeceras multipart además de los archivos
+
+class UploadTooLarge(Exception):
+    pass
+
+class RequestSizeLimit:
+    """
+    Middleware ASGI: rechaza con 413 las solicitudes que exceden el límite de su ruta antes
+    de que se lea y guarde el cuerpo (FastAPI/Starlette parsean el formulario completo antes
+    del handler). Se usa el Content-Length; sin él (chunked) se corta al superar el límite.
+    limits: [(método, prefijo de ruta, bytes)], los límites por archivo se siguen validando
+    en stream_to_temp.
+    """
+    def __init__(self, app, limits):
+        self.app = app
+        self.limits = limits
+
+    def _limit(self, scope):
+        for method, prefix, limit in self.limits:
+            if scope["method"] == method and scope["path"].startswith(prefix):
+                return limit + FORM_OVERHEAD_BYTES
+        return None
+
+    async def __call__(self, scope, receive, send):
+        limit = self._limit(scope) if scope["type"] == "http" else None
+        if limit is None:
+            return await self.app(scope, receive, send)
+
+        detail = f"La solicitud excede el máximo de subida ({limit // (1024 * 1024)} MB)"
+        length = dict(scope["headers"]).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > limit:
+            body = json.dumps({"detail": detail}, ensure_ascii=False).encode("utf-8")
+            await send({
+                "type": "http.response.start",
+                "status": 413,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode("latin-1")), (b"connection", b"close")],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        received = 0
+        async def _receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, _receive, send)
+
+class ContentHashRegistry:
+    """
+    Registro sha256 -> nombre de archivo de los documentos de una colección.
+    Permite detectar contenido repetido aunque venga con otro nombre.
+    lock: lock de la colección (CollectionLock) para que las réplicas que comparten la carpeta
+    de datos no pisen sus escrituras; cada cambio relee el archivo si otro proceso lo modificó.
+    """
+    def __init__(self, path, docs_dir, lock=None):
+        self.path = path
+        self.docs_dir = docs_dir
+        self.lock = lock or threading.RLock()
+        self._mutex = threading.RLock()  # Estado en memoria
+        self._by_hash = {}
+        self._by_name = {}
+        self._stat = None
+        with self.lock:
+            if not os.path.exists(self.path):
+                self._write(self._scan_docs())
+            self._refresh()
+
+    def _scan_docs(self):
+        # Primera vez: registrar los documentos que ya existían en la carpeta
+        data = {}
+        if os.path.isdir(self.docs_dir):
+            for name in sorted(os.listdir(self.docs_dir)):
+                p = os.path.join(self.docs_dir, name)
+                if os.path.isfile(p) and not name.startswith("."):
+                    data.setdefault(file_sha256(p), name)
+        return data
+
+    def _refresh(self):
+        """Recarga el archivo si cambió desde la última lectura (escrito por otra réplica)"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        stat = (st.st_ino, st.st_mtime_ns, st.st_size)
+        with self._mutex:
+            if stat == self._stat:
+                return
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = dict(json.load(f))
+            except Exception:
+                data = {}
+            self._by_hash = data
+            self._by_name = {n: h for h, n in data.items()}
+            self._stat = stat
+
+    def _write(self, data):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    def _save(self):
+        self._write(self._by_hash)
+        st = os.stat(self.path)
+        self._stat = (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _set(self, digest, name):
+        # Un mismo nombre sobrescrito con otro contenido invalida el hash anterior
+        old = self._by_name.pop(name, None)
+        if old is not None and self._by_hash.get(old) == name:
+            del self._by_hash[old]
+        prev = self._by_hash.get(digest)
+        if prev is not None and prev != name:
+            self._by_name.pop(prev, None)
+        self._by_hash[digest] = name
+        self._by_name[name] = digest
+
+    def _discard(self, name):
+        digest = self._by_name.pop(name, None)
+        if digest is not None and self._by_hash.get(digest) == name:
+            del self._by_hash[digest]
+        return digest is not None
+
+    def lookup(self, digest):
+        """Nombre del archivo con este contenido, o None si no existe (o fue borrado a mano)"""
+        self._refresh()
+        with self._mutex:
+            name = self._by_hash.get(digest)
+        if name and not os.path.exists(os.path.join(self.docs_dir, name)):
+            self.remove_name(name)
+            return None
+        return name
+
+    def add(self, digest, name):
+        self.add_many({digest: name})
+
+    def add_many(self, items):
+        """Registra {sha256: nombre} en bloque con una sola escritura (ingesta masiva)"""
+        with self.lock:
+            self._refresh()
+            with self._mutex:
+                for digest, name in items.items():
+                    self._set(digest, name)
+                self._save()
+
+    def remove_name(self, name):
+        with self.lock:
+            self._refresh()
+            with self._mutex:
+                removed = self._discard(name)
+                if removed:
+                    self._save()
+                return removed
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(block)
+    return h.hexdigest()
+
+async def stream_to_temp(upload, dst_dir, max_file_bytes, max_remaining_bytes):
+    """
+    Copia un UploadFile a un archivo temporal en dst_dir por bloques, calculando su sha256.
+    - Lanza UploadTooLarge si excede el límite por archivo o el restante de la solicitud
+    - Devuelve (ruta_temporal, sha256, bytes)
+    """
+    os.makedirs(dst_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".upload_", suffix=".part", dir=dst_dir)
+    h = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                block = await upload.read(CHUNK_SIZE)
+                if not block:
+                    break
+                size += len(block)
+                if max_file_bytes and size > max_file_bytes:
+                    raise UploadTooLarge(f"'{upload.filename}' excede el máximo por archivo ({max_file_bytes // (1024 * 1024)} MB)")
+                if max_remaining_bytes is not None and size > max_remaining_bytes:
+                    raise UploadTooLarge("La solicitud excede el máximo total de subida")
+                h.update(block)
+                # Escritura fuera del event loop
+                await asyncio.to_thread(f.write, block)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    return tmp_path, h.hexdigest(), size
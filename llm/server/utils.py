@@ -1,12 +1,14 @@
 import inspect
 
-from vllm import SamplingParams
 from typing import Optional, Dict
 from server.schemas import Numeric, Message
+from server.tracing import span
 
-def build_prompt_from_messages(messages, tokenizer, internal_thinking, using_rag=None, context=None):
+def system_instruction(internal_thinking, using_rag=None):
     """
-    Utilizar una chat template del tokenizer especificado, en caso contrario generar un prompt nuevo
+    Instrucciones de sistema fijas (idioma, razonamiento interno, reglas RAG).
+    No incluyen datos variables: el mismo texto encabeza todas las solicitudes y el motor
+    puede reutilizar su prefijo en caché (prefix caching).
     """
     system_instruct = ""
 
@@ -18,10 +20,20 @@ def build_prompt_from_messages(messages, tokenizer, internal_thinking, using_rag
 
     system_instruct += language_instruct
 
-    # Reglas del sistema cuando se utiliza RAG
+    # Switch: Evitar razonamiento interno
+    if not internal_thinking:
+        thinking_instruct = (
+            "Nunca reveles cadenas de pensamiento ni contenido interno como <think>. "
+            "Si necesitas razonar, hazlo internamente y devuelve solo la respuesta final."
+        )
+
+        system_instruct += thinking_instruct
+
+    # Reglas del sistema cuando se utiliza RAG (el contexto va en el último mensaje del usuario)
     if using_rag:
-        rag_context = (
-            "Eres un asistente con RAG. Usa EXCLUSIVAMENTE el siguiente contexto para responder. "
+        rag_rules = (
+            "Eres un asistente con RAG. Usa EXCLUSIVAMENTE el contexto entregado junto a la pregunta "
+            "(entre ### CONTEXTO y ### FIN CONTEXTO) para responder. "
             "Si no hay información suficiente en el contexto, responde: "
             "\"No encontré suficiente información en la base de conocimiento local.\" "
             "REQUISITOS DE CITADO (OBLIGATORIO):\n"
@@ -30,29 +42,36 @@ def build_prompt_from_messages(messages, tokenizer, internal_thinking, using_rag
             "- Incluye SIEMPRE al menos una cita para cada punto clave o afirmación factual que hagas.\n"
             "- Coloca la(s) cita(s) al final de la frase o bullet correspondiente.\n"
             "- PROHIBIDO usar referencias numéricas, notas o footnotes (p. ej. [1], [2], [CONTEXTO][1]).\n"
-            "- NO inventes URLs y NO uses ningún otro formato de cita.\n\n"
-            f"### CONTEXTO\n{context}\n### FIN CONTEXTO"
+            "- NO inventes URLs y NO uses ningún otro formato de cita."
         )
 
-        system_instruct += rag_context
+        system_instruct += rag_rules
 
-    # Switch: Evitar razonamiento interno
-    if not internal_thinking:
-        thinking_instruct = (
-            "Nunca reveles cadenas de pensamiento ni contenido interno como <think>. "
-            "Si necesitas razonar, hazlo internamente y devuelve solo la respuesta final."
-        )
+    return system_instruct
 
-        system_instruct += thinking_instruct
-    
-    messages = [Message(role="system", content=system_instruct)] + messages
+def with_context(messages, context):
+    """
+    Agrega el contexto recuperado al último mensaje del usuario. Todo lo anterior
+    (sistema + historial) queda igual entre solicitudes y turnos.
+    """
+    messages = list(messages)
+    for i in range(len(messages) - 1, -1, -1):
+        if messages[i].role == "user":
+            content = f"### CONTEXTO\n{context}\n### FIN CONTEXTO\n\n{messages[i].content}"
+            messages[i] = Message(role="user", content=content)
+            break
+    return messages
 
+def render_messages(messages, tokenizer, add_generation_prompt=True):
+    """
+    Renderiza mensajes con la chat template del tokenizer, o con un formato alternativo si no existe
+    """
     # Utilizar plantilla de chat del tokenizer en caso de que exista
     try:
         prompt = tokenizer.apply_chat_template(
             [m.model_dump() for m in messages],
             tokenize=False,
-            add_generation_prompt=True,
+            add_generation_prompt=add_generation_prompt,
         )
         return prompt
     
@@ -69,13 +88,31 @@ def build_prompt_from_messages(messages, tokenizer, internal_thinking, using_rag
         
         hist_txt = "\n".join(hist)
         system_part = f"{sys}\n\n" if sys else ""
-        return f"{system_part}{hist_txt}\nAsistente:"
+        gen_part = "\nAsistente:" if add_generation_prompt else ""
+        return f"{system_part}{hist_txt}{gen_part}"
 
-def build_model_params(params: Optional[Dict[str, Numeric]], model_max_tokens: int) -> SamplingParams:
+def build_prompt_from_messages(messages, tokenizer, internal_thinking, using_rag=None, context=None):
+    """
+    Utilizar una chat template del tokenizer especificado, en caso contrario generar un prompt nuevo.
+    Orden: instrucciones fijas -> historial -> contexto RAG + última pregunta
+    """
+    with span("build_prompt", messages=len(messages), context_chars=len(context or "")) as s:
+        system_instruct = system_instruction(internal_thinking, using_rag)
+        if using_rag:
+            messages = with_context(messages, context)
+        messages = [Message(role="system", content=system_instruct)] + messages
+        prompt = render_messages(messages, tokenizer)
+        s.set(prompt_chars=len(prompt))
+        return prompt
+
+def build_model_params(params: Optional[Dict[str, Numeric]], model_max_tokens: int) -> "SamplingParams":
     """
     - Construcción de parametros especificados por usuario
     - Especifica limite de seguridad para tokens
     """
+    # vllm se importa al usarse: el resto del módulo (render de prompts) no lo necesita
+    from vllm import SamplingParams
+
     params = dict(params or {})
     params.setdefault("max_tokens", model_max_tokens or 2048)
 
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Las pruebas importan los módulos igual que el servidor (desde la carpeta llm/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,28 @@
+"""
+Dedup de chunks por lotes (ingesta masiva): las copias entre lotes también se detectan.
+"""
+from rag.dedup import ChunkDeduper
+
+def _doc(source, text):
+    return {"source": source, "chunk_id": 0, "text": text}
+
+SHARED = "párrafo compartido sobre impuestos y plazos de presentación " * 10
+
+def test_session_dedups_across_batches():
+    session = ChunkDeduper(0.85).session()
+    first = session.add([_doc("a.txt", SHARED), _doc("a.txt", "texto propio de a " * 10), _doc("b.txt", SHARED)])
+    second = session.add([_doc("c.txt", SHARED.upper()), _doc("c.txt", "texto propio de c " * 10)])
+
+    assert [d["source"] for d in first] == ["a.txt", "a.txt"]
+    assert [d["source"] for d in second] == ["c.txt"]
+    # La copia del mismo lote se fusiona al instante, la del lote siguiente al escribir la fila 0
+    assert [s["source"] for s in first[0]["sources"]] == ["a.txt", "b.txt"]
+    row = session.apply(0, dict(first[0]))
+    assert [s["source"] for s in row["sources"]] == ["a.txt", "b.txt", "c.txt"]
+    assert session.apply(1, first[1]) is first[1] and "sources" not in first[1]
+    assert session.stats == {"chunks": 5, "unique": 3, "exact_duplicates": 2, "near_duplicates": 0}
+
+def test_single_call_dedup_assigns_vids():
+    docs, stats = ChunkDeduper(0.85).dedup([_doc("a.txt", SHARED), _doc("b.txt", SHARED), _doc("b.txt", "otro texto " * 10)], start_vid=10)
+    assert [d["vid"] for d in docs] == [10, 11]
+    assert stats["unique"] == 2 and stats["exact_duplicates"] == 1
@@ -0,0 +1,119 @@
+"""
+El event loop del servidor no se bloquea con subidas RAG: con LLM_ENGINE=stub, la latencia
+de /v1/chat/completions se mantiene estable mientras se suben e indexan documentos.
+"""
+import sys
+import time
+import asyncio
+import importlib
+import statistics
+
+import numpy as np
+import pytest
+
+pytest.importorskip("faiss")
+pytest.importorskip("torch")
+pytest.importorskip("sentence_transformers")
+pytest.importorskip("vllm")
+httpx = pytest.importorskip("httpx")
+
+EMBED_DELAY_S = 0.3  # Costo simulado de cada lote de embeddings (en los hilos del RAG)
+
+class _SlowEmbedder:
+    """Embeddings deterministas y lentos, sin descargar un modelo"""
+    dim = 16
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, texts, **kwargs):
+        time.sleep(EMBED_DELAY_S)
+        out = np.zeros((len(texts), self.dim), dtype="float32")
+        for i, t in enumerate(texts):
+            for w in t.split():
+                out[i, hash(w) % self.dim] += 1.0
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return out / np.where(norms == 0, 1.0, norms)
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    model_dir = tmp_path / "models" / "stub"
+    model_dir.mkdir(parents=True)
+    (model_dir / "weights.bin").write_bytes(b"\0" * 1024)
+    data = tmp_path / "data"
+    for d in ("docs", "web"):
+        (data / d).mkdir(parents=True)
+
+    # Colección con documentos previos: su registro de hashes se construye en la primera subida
+    docs = data / "collections" / "uploads" / "docs"
+    docs.mkdir(parents=True)
+    for i in range(100):
+        (docs / f"old_{i}.txt").write_text(f"documento previo {i}")
+
+    env = {
+        "LLM_ENGINE": "stub",
+        "MODEL_DIR": str(model_dir),
+        "MODEL_MAX_TOKENS": "4096",
+        "GPU_UTIL": "0.8",
+        "RAG_ENABLED": "1",
+        "DOCS_DIR": str(data / "docs"),
+        "WEB_DIR": str(data / "web"),
+        "RAG_INDEX_PATH": str(data / "index.faiss"),
+        "RAG_META_PATH": str(data / "meta.jsonl"),
+        "RAG_EMBED_MODEL": "stub",
+        "RAG_COMPACT_INTERVAL_S": "3600",
+        "LANGSEARCH_DB_PATH": str(data / "langsearch.db"),
+        "TRACING": "off",
+    }
+    for k, v in env.items():
+        monkeypatch.setenv(k, v)
+
+    import rag.rag_collections
+    import server.uploads
+    monkeypatch.setattr(rag.rag_collections, "load_embedder", lambda *a, **kw: _SlowEmbedder())
+    sha256 = server.uploads.file_sha256
+    def _slow_sha256(path):
+        time.sleep(EMBED_DELAY_S / 50)  # Documentos grandes
+        return sha256(path)
+    monkeypatch.setattr(server.uploads, "file_sha256", _slow_sha256)
+    monkeypatch.delitem(sys.modules, "main", raising=False)
+    main = importlib.import_module("main")
+    yield main.app
+    sys.modules.pop("main", None)
+
+async def _chat_latency(client, n):
+    latencies = []
+    for _ in range(n):
+        start = time.perf_counter()
+        r = await client.post("/v1/chat/completions", json={
+            "messages": [{"role": "user", "content": "hola"}],
+            "max_tokens": 4,
+        })
+        latencies.append(time.perf_counter() - start)
+        assert r.status_code == 200
+    return latencies
+
+async def _upload(client, i):
+    files = {f"file{j}": (f"doc_{i}_{j}.txt", f"contenido nuevo {i} {j} " * 500, "text/plain") for j in range(3)}
+    r = await client.post("/v1/chat/rag", data={"collection": "uploads"}, files=files)
+    assert r.status_code == 200, r.text
+    return r.json()
+
+def test_chat_latency_flat_during_rag_uploads(app):
+    async def go():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            baseline = await _chat_latency(client, 5)
+
+            # Chats en curso mientras llegan las subidas
+            chats = asyncio.create_task(_chat_latency(client, 10))
+            await asyncio.sleep(0.02)
+            results = await asyncio.gather(*[_upload(client, i) for i in range(4)])
+            return baseline, await chats, results
+
+    baseline, loaded, results = asyncio.run(go())
+    assert all(r["status"] == "ok" for r in results)
+
+    # Un embedding o un hash en el event loop sumaría al menos EMBED_DELAY_S a alguna solicitud
+    limit = statistics.median(baseline) + EMBED_DELAY_S / 2
+    assert max(loaded) < limit, (baseline, loaded)
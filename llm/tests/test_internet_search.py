@@ -0,0 +1,143 @@
+"""
+LangSearchClient + SearchCache contra un servidor HTTP local que imita la API de LangSearch.
+"""
+import json
+import asyncio
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from rag.internet_search import LangSearchClient, SearchCache, normalize_query
+
+class _FakeLangSearch(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.calls.append(body)
+        self.server.peers.add(self.client_address)
+        data = json.dumps({"data": {"webPages": {"value": [{"url": "https://ejemplo.com", "name": body["query"]}]}}}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+class _CountingLimiter:
+    def __init__(self):
+        self.acquired = 0
+
+    async def acquire(self):
+        self.acquired += 1
+
+@pytest.fixture
+def api():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _FakeLangSearch)
+    server.calls = []
+    server.peers = set()
+    t = threading.Thread(target=server.serve_forever, daemon=True)
+    t.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def _client(api, cache=None):
+    return LangSearchClient(f"http://127.0.0.1:{api.server_address[1]}/v1/web-search", "clave", cache)
+
+def test_reuses_pooled_connection(api):
+    async def go():
+        client = _client(api)
+        limiter = _CountingLimiter()
+        try:
+            for i in range(5):
+                await client.search(f"consulta {i}", limiter)
+        finally:
+            await client.aclose()
+        return client, limiter
+
+    client, limiter = asyncio.run(go())
+    assert len(api.calls) == 5
+    assert limiter.acquired == 5
+    assert client.stats["api_calls"] == 5
+    # Las 5 llamadas secuenciales usan la misma conexión keep-alive
+    assert len(api.peers) == 1
+
+def test_cache_hit_skips_api_and_limiter(api, tmp_path):
+    async def go():
+        client = _client(api, SearchCache(str(tmp_path / "cache.db"), ttl_s=3600))
+        limiter = _CountingLimiter()
+        try:
+            first = await client.search("¿Qué es FAISS?", limiter)
+            second = await client.search("¿Qué es FAISS?", limiter)
+        finally:
+            await client.aclose()
+        return client, limiter, first, second
+
+    client, limiter, first, second = asyncio.run(go())
+    assert first == second
+    assert len(api.calls) == 1
+    assert limiter.acquired == 1
+    assert client.stats == {"cache_hits": 1, "cache_misses": 1, "api_calls": 1}
+
+def test_cache_entry_expires_after_ttl(api, tmp_path):
+    async def go():
+        client = _client(api, SearchCache(str(tmp_path / "cache.db"), ttl_s=0.3))
+        limiter = _CountingLimiter()
+        try:
+            await client.search("noticias de hoy", limiter)
+            await client.search("noticias de hoy", limiter)
+            await asyncio.sleep(0.5)
+            await client.search("noticias de hoy", limiter)
+        finally:
+            await client.aclose()
+        return client
+
+    client = asyncio.run(go())
+    assert len(api.calls) == 2
+    assert client.stats["cache_hits"] == 1
+
+def test_normalized_queries_share_cache_entry(api, tmp_path):
+    variants = ["¿Qué es FAISS?", "qué   es faiss", "QUÉ ES FAISS!", "  qué es faiss. "]
+    assert len({normalize_query(q) for q in variants}) == 1
+
+    async def go():
+        client = _client(api, SearchCache(str(tmp_path / "cache.db"), ttl_s=3600))
+        limiter = _CountingLimiter()
+        try:
+            for q in variants:
+                await client.search(q, limiter)
+            # freshness y count son parte de la clave
+            await client.search(variants[0], limiter, count=5)
+        finally:
+            await client.aclose()
+        return client
+
+    client = asyncio.run(go())
+    assert len(api.calls) == 2
+    assert client.stats["cache_hits"] == len(variants) - 1
+
+def test_cache_stores_only_valid_responses(tmp_path):
+    cache = SearchCache(str(tmp_path / "cache.db"), ttl_s=3600)
+    assert cache.get("consulta", "onLimit", 10) is None
+    cache.put("consulta", "onLimit", 10, {"ok": True})
+    assert cache.get("Consulta?", "onLimit", 10) == {"ok": True}
+    assert cache.get("consulta", "oneDay", 10) is None
+
+def test_cache_opens_a_single_connection(tmp_path, monkeypatch):
+    opened = []
+    connect = sqlite3.connect
+    monkeypatch.setattr(sqlite3, "connect", lambda *a, **kw: opened.append(a) or connect(*a, **kw))
+
+    cache = SearchCache(str(tmp_path / "cache.db"), ttl_s=3600)
+    with ThreadPoolExecutor(4) as pool:
+        list(pool.map(lambda i: cache.put(f"consulta {i}", "onLimit", 10, {"i": i}), range(20)))
+        hits = list(pool.map(lambda i: cache.get(f"consulta {i}", "onLimit", 10), range(20)))
+    cache.close()
+    assert hits == [{"i": i} for i in range(20)]
+    assert len(opened) == 1
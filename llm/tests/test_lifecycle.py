@@ -0,0 +1,62 @@
+"""
+RequestRegistry: cancelación explícita frente a cancelación de la tarea del handler.
+"""
+import asyncio
+
+import pytest
+
+from server.lifecycle import RequestRegistry, RequestCancelled
+
+class _Sampling:
+    max_tokens = 100
+
+class _SlowEngine:
+    model_dir = "slow"
+
+    def __init__(self):
+        self.aborted = []
+
+    async def generate(self, prompt, sampling, request_id=None, progress=None):
+        for i in range(sampling.max_tokens):
+            await asyncio.sleep(0.01)
+            progress(i + 1)
+        return "fin"
+
+    async def abort(self, request_id):
+        self.aborted.append(request_id)
+
+def test_explicit_cancel_raises_request_cancelled():
+    engine = _SlowEngine()
+    registry = RequestRegistry(engine)
+
+    async def go():
+        task = asyncio.create_task(registry.generate("hola", _Sampling(), "r1"))
+        await asyncio.sleep(0.05)
+        assert registry.cancel("r1")
+        with pytest.raises(RequestCancelled) as e:
+            await task
+        return e.value
+
+    err = asyncio.run(go())
+    assert err.reason == "explicit"
+    assert engine.aborted == ["r1"]
+    assert registry.metrics["cancelled_explicit"] == 1
+    assert registry.status()["in_flight"] == []
+
+def test_handler_cancel_propagates_cancelled_error():
+    engine = _SlowEngine()
+    registry = RequestRegistry(engine)
+
+    async def go():
+        # Apagado del servidor: se cancela la tarea que atiende la solicitud
+        task = asyncio.create_task(registry.generate("hola", _Sampling(), "r2"))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(go())
+    assert engine.aborted == ["r2"]
+    assert registry.metrics["cancelled_handler"] == 1
+    assert registry.metrics["cancelled_disconnect"] == 0
+    assert registry.status()["in_flight"] == []
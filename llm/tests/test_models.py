@@ -0,0 +1,125 @@
+"""
+ModelRegistry con StubEngine: registro de carpetas, presupuesto por pesos y LRU.
+"""
+import json
+import asyncio
+import threading
+
+import pytest
+
+from server.engine import StubEngine
+from server.models import ModelRegistry, ModelBusy
+
+MB = 1024 * 1024
+
+def _model(root, name, mb, arch="LlamaForCausalLM"):
+    path = root / name
+    path.mkdir()
+    (path / "config.json").write_text(json.dumps({"architectures": [arch]}))
+    (path / "weights.bin").write_bytes(b"\0" * (mb * MB))
+    return path
+
+class _Factory:
+    """Crea StubEngine y registra (modelo, fracción del presupuesto) de cada carga"""
+    def __init__(self):
+        self.loads = []
+
+    def __call__(self, path, share):
+        self.loads.append((path.rsplit("/", 1)[-1], round(share, 2)))
+        return StubEngine(model_dir=path)
+
+@pytest.fixture
+def models_dir(tmp_path):
+    root = tmp_path / "models"
+    root.mkdir()
+    _model(root, "a", 4)
+    _model(root, "b", 4)
+    _model(root, "c", 5)
+    _model(root, "e5", 1, arch="XLMRobertaModel")  # Modelo de embedding en la misma carpeta
+    (root / "vacia").mkdir()
+    return root
+
+def test_only_language_models_are_registered(models_dir):
+    registry = ModelRegistry(str(models_dir), _Factory(), 10 * MB)
+    names = [m["name"] for m in registry.status()["models"]]
+    assert names == ["a", "b", "c"]
+    with pytest.raises(KeyError):
+        registry.get("e5")
+
+def test_single_resident_model_gets_the_whole_gpu(tmp_path):
+    # Configuración por defecto: un solo modelo (MODEL_DIR) usa todo GPU_UTIL
+    path = _model(tmp_path, "solo", 1)
+    factory = _Factory()
+    registry = ModelRegistry(None, factory, 16384 * MB, extra={"solo": str(path)})
+    registry.load()
+    assert factory.loads == [("solo", 1.0)]
+
+    # Con varios modelos que no caben de a dos en el presupuesto tampoco se reparte
+    root = tmp_path / "models"
+    root.mkdir()
+    _model(root, "a", 4)
+    _model(root, "b", 4)
+    factory = _Factory()
+    ModelRegistry(str(root), factory, 6 * MB).load("a")
+    assert factory.loads == [("a", 1.0)]
+
+def test_engine_gets_its_share_of_the_gpu(models_dir):
+    factory = _Factory()
+    registry = ModelRegistry(str(models_dir), factory, 10 * MB)
+
+    async def go():
+        for name in ("a", "b"):
+            registry.release(await registry.acquire(name))
+
+    asyncio.run(go())
+    # Caben dos modelos juntos: sin la memoria de la GPU, cada motor reserva la mitad
+    assert registry.max_resident() == 2
+    assert factory.loads == [("a", 0.5), ("b", 0.5)]
+    assert registry.status()["loaded_bytes"] <= registry.max_bytes
+
+    # Con la memoria de la GPU: pesos + la mitad de lo que queda para KV cache
+    registry = ModelRegistry(str(models_dir), _Factory(), 10 * MB, gpu_bytes=20 * MB)
+    a, c = registry.get("a"), registry.get("c")
+    assert registry.share(a) == (a.nbytes + 5 * MB) / (20 * MB)
+    assert registry.share(a) + registry.share(c) <= 1.0
+
+def test_lru_unloads_idle_models_and_rejects_when_busy(models_dir):
+    factory = _Factory()
+    registry = ModelRegistry(str(models_dir), factory, 10 * MB)
+
+    async def go():
+        registry.release(await registry.acquire("a"))
+        registry.release(await registry.acquire("b"))
+        registry.release(await registry.acquire("a"))  # b queda como el menos usado
+
+        c = await registry.acquire("c")
+        loaded = {m["name"] for m in registry.status()["models"] if m["loaded"]}
+        assert loaded == {"a", "c"}
+
+        # Con c en uso, cargar b exigiría descargar un modelo activo
+        a = await registry.acquire("a")
+        with pytest.raises(ModelBusy):
+            await registry.acquire("b")
+        registry.release(a)
+        registry.release(c)
+
+    asyncio.run(go())
+    assert [name for name, _ in factory.loads] == ["a", "b", "c"]
+
+def test_unloaded_engine_shuts_down_outside_the_registry_lock(models_dir):
+    registry = None
+    free = []
+
+    class _Engine(StubEngine):
+        def shutdown(self):
+            # Otro hilo (p. ej. status() desde el event loop) puede tomar el lock mientras se apaga
+            t = threading.Thread(target=lambda: free.append(registry.lock.acquire(timeout=1) and registry.lock.release() is None))
+            t.start()
+            t.join()
+
+    registry = ModelRegistry(str(models_dir), lambda path, share: _Engine(model_dir=path), 10 * MB)
+    registry.load("a")
+    registry.load("b")
+    registry.load("c")  # Descarga a (el menos usado)
+    assert free == [True]
+    assert {m["name"] for m in registry.status()["models"] if m["loaded"]} == {"b", "c"}
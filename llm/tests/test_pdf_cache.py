@@ -0,0 +1,43 @@
+"""
+PdfTextCache.prune: texto de otras versiones del extractor y límite de tamaño (LRU).
+"""
+import sqlite3
+
+import pytest
+
+pypdf = pytest.importorskip("pypdf")
+
+from rag.pdf_cache import PdfTextCache
+
+def _pdf(path, pages):
+    writer = pypdf.PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=100, height=100)
+    with open(path, "wb") as f:
+        writer.write(f)
+    return str(path)
+
+def _cached(db):
+    with sqlite3.connect(db) as con:
+        return sorted(con.execute("SELECT extractor, pages FROM PDF_DOCS"))
+
+def test_prune_drops_old_extractor_and_least_used(tmp_path):
+    db = str(tmp_path / "cache.db")
+    a, b = _pdf(tmp_path / "a.pdf", 2), _pdf(tmp_path / "b.pdf", 3)
+
+    old = PdfTextCache(db, "v1")
+    list(old.pages(a))
+    new = PdfTextCache(db, "v2")
+    list(new.pages(a))
+    list(new.pages(b))
+    assert new.prune() == 1
+    assert _cached(db) == [("v2", 2), ("v2", 3)]
+
+    # Con espacio para un solo PDF se conserva el usado más recientemente
+    list(new.pages(a))
+    with sqlite3.connect(db) as con:
+        (size_a,) = con.execute("SELECT SUM(LENGTH(text)) FROM PDF_PAGES GROUP BY sha256 ORDER BY COUNT(*) LIMIT 1").fetchone()
+    capped = PdfTextCache(db, "v2", max_bytes=size_a)
+    assert capped.prune() == 1
+    assert _cached(db) == [("v2", 2)]
+    assert list(capped.pages(a)) == ["", ""]
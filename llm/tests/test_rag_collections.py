@@ -0,0 +1,69 @@
+"""
+LRU de colecciones cargadas: tamaño medido al cargar y cierre de los desalojados.
+"""
+import numpy as np
+import pytest
+
+pytest.importorskip("faiss")
+pytest.importorskip("torch")
+pytest.importorskip("sentence_transformers")
+
+import rag.rag_collections
+from rag.rag_collections import RAGCollections, RAGCollection
+
+class _Embedder:
+    dim = 8
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, texts, **kwargs):
+        out = np.zeros((len(texts), self.dim), dtype="float32")
+        for i, t in enumerate(texts):
+            for w in t.split():
+                out[i, hash(w) % self.dim] += 1.0
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return out / np.where(norms == 0, 1.0, norms)
+
+@pytest.fixture
+def collections(tmp_path, monkeypatch):
+    monkeypatch.setattr(rag.rag_collections, "load_embedder", lambda *a, **kw: _Embedder())
+    for d in ("docs", "web"):
+        (tmp_path / d).mkdir()
+    # Presupuesto mínimo: solo cabe la colección más reciente
+    return RAGCollections(
+        str(tmp_path / "cols"), str(tmp_path / "docs"), str(tmp_path / "web"),
+        str(tmp_path / "index.faiss"), str(tmp_path / "meta.jsonl"), "stub", max_loaded_mb=0.000001,
+    )
+
+def _add(collections, name, tmp_path):
+    col = collections.get(name)
+    path = tmp_path / f"{name}.txt"
+    path.write_text(f"contenido de la colección {name} " * 20)
+    collections.add_files(name, [str(path)])
+    collections.compact_loaded(0, 0)
+    return col
+
+def test_evicted_retriever_closes_its_meta_store(collections, tmp_path, monkeypatch):
+    _add(collections, "uno", tmp_path)
+    first = collections.retriever("uno")
+    assert len(first.retrieve("contenido uno", top_k=1)) == 1
+
+    calls = []
+    disk_size = RAGCollection.disk_size
+    monkeypatch.setattr(RAGCollection, "disk_size", lambda self: calls.append(self.name) or disk_size(self))
+
+    _add(collections, "dos", tmp_path)
+    assert [c["name"] for c in collections.list() if c["loaded"]] == ["dos"]
+    assert first.metas.closed
+
+    # Consultas repetidas no vuelven a medir el snapshot
+    calls.clear()
+    for _ in range(5):
+        collections.retriever("dos")
+    assert calls == []
+
+    # Un retriever desalojado que todavía se usa reabre los metadatos durante la búsqueda
+    hits = first.retrieve("contenido uno", top_k=1)
+    assert hits and hits[0]["source"].endswith("uno.txt")
+    assert first.metas.closed
@@ -0,0 +1,145 @@
+"""
+RateLimiter (asyncio) y SharedRateLimiter (estado compartido entre procesos).
+"""
+import time
+import asyncio
+import sqlite3
+import datetime
+import multiprocessing as mp
+
+import pytest
+
+from server.rate_limit import ApiUsageTracker, RateLimiter, SharedRateLimiter
+
+@pytest.fixture
+def tracker(tmp_path):
+    t = ApiUsageTracker(str(tmp_path / "usage.db"))
+    yield t
+    t.close()
+
+def test_acquire_does_not_block_event_loop_and_is_fifo(tracker):
+    limiter = RateLimiter(tracker, qps=1, qpm=60, qpd=None, max_wait=5.0)
+
+    async def go():
+        ticks = []
+        stop = asyncio.Event()
+
+        async def ticker():
+            while not stop.is_set():
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.01)
+
+        order = []
+        async def request(i):
+            await limiter.acquire()
+            order.append((i, time.monotonic()))
+
+        tick_task = asyncio.create_task(ticker())
+        start = time.monotonic()
+        tasks = []
+        for i in range(3):
+            tasks.append(asyncio.create_task(request(i)))
+            await asyncio.sleep(0.01)  # Orden de llegada definido
+        await asyncio.gather(*tasks)
+        stop.set()
+        await tick_task
+        return start, ticks, order
+
+    start, ticks, order = asyncio.run(go())
+
+    # FIFO: se atienden en orden de llegada, uno por segundo (QPS=1)
+    assert [i for i, _ in order] == [0, 1, 2]
+    assert order[0][1] - start < 0.2
+    assert order[1][1] - order[0][1] >= 0.8
+    assert order[2][1] - order[1][1] >= 0.8
+
+    # Mientras se espera el token el event loop sigue atendiendo otras tareas
+    assert len(ticks) > 100
+    gaps = [b - a for a, b in zip(ticks, ticks[1:])]
+    assert max(gaps) < 0.2
+    assert tracker.get_today_count()[0] == 3
+
+def test_acquire_fails_fast_past_deadline(tracker):
+    limiter = RateLimiter(tracker, qps=1, qpm=60, qpd=None, max_wait=0.3)
+
+    async def go():
+        await limiter.acquire()
+        t0 = time.monotonic()
+        with pytest.raises(RuntimeError):
+            await limiter.acquire()
+        return time.monotonic() - t0
+
+    # El próximo token llega en ~1 s, después del plazo: falla sin esperar
+    assert asyncio.run(go()) < 0.2
+
+def test_daily_limit(tracker):
+    limiter = RateLimiter(tracker, qps=100, qpm=1000, qpd=2)
+
+    async def go():
+        await limiter.acquire()
+        await limiter.acquire()
+        with pytest.raises(RuntimeError, match="QPD"):
+            await limiter.acquire()
+
+    asyncio.run(go())
+
+def _shared_worker(tmp_dir, i, qps, qpd, duration_s, out):
+    # Proceso independiente (como un worker de uvicorn): su propio tracker y conexión SQLite
+    tracker = ApiUsageTracker(f"{tmp_dir}/usage_{i}.db")
+    limiter = SharedRateLimiter(tracker, qps=qps, qpm=6000, qpd=qpd, db_path=f"{tmp_dir}/limiter.db", max_wait=0.5)
+
+    async def go():
+        granted = 0
+        deadline = time.monotonic() + duration_s
+        while time.monotonic() < deadline:
+            try:
+                await limiter.acquire()
+                granted += 1
+            except RuntimeError as e:
+                if "QPD" in str(e):
+                    break
+        return granted
+
+    out.put(asyncio.run(go()))
+    tracker.close()
+
+def _run_workers(tmp_dir, n, qps, qpd, duration_s):
+    ctx = mp.get_context("spawn")
+    out = ctx.Queue()
+    procs = [ctx.Process(target=_shared_worker, args=(tmp_dir, i, qps, qpd, duration_s, out)) for i in range(n)]
+    for p in procs:
+        p.start()
+    counts = [out.get(timeout=60) for _ in procs]
+    for p in procs:
+        p.join(timeout=10)
+    return counts
+
+def test_shared_limiter_caps_all_processes(tmp_path):
+    qps, duration_s = 5, 2.0
+    # Inicializar la base antes de lanzar los procesos
+    SharedRateLimiter(ApiUsageTracker(str(tmp_path / "init.db")), qps, 6000, None, str(tmp_path / "limiter.db"))
+    counts = _run_workers(str(tmp_path), 3, qps, None, duration_s)
+
+    # Ráfaga inicial (qps) + recarga durante la prueba; sin compartir serían ~3 veces más
+    total = sum(counts)
+    assert all(c > 0 for c in counts)
+    assert total <= qps + qps * (duration_s + 1.0)
+
+    # El uso reportado es el total de todos los procesos, no el de uno
+    limiter = SharedRateLimiter(ApiUsageTracker(str(tmp_path / "reader.db")), qps, 6000, None, str(tmp_path / "limiter.db"))
+    assert limiter.get_today_count()[0] == total
+
+def test_shared_limiter_qpd_and_history(tmp_path):
+    qpd = 7
+    db = str(tmp_path / "limiter.db")
+    SharedRateLimiter(ApiUsageTracker(str(tmp_path / "init.db")), 100, 6000, qpd, db)
+    counts = _run_workers(str(tmp_path), 3, 100, qpd, 3.0)
+    assert sum(counts) == qpd
+
+    # Cambio de día: el total del día anterior pasa al historial y el conteo vuelve a 0
+    yesterday = (datetime.date.today() - datetime.timedelta(days=1)).isoformat()
+    with sqlite3.connect(db) as con:
+        con.execute("UPDATE LANGSEARCH_DAILY SET date=? WHERE id=1", (yesterday,))
+    limiter = SharedRateLimiter(ApiUsageTracker(str(tmp_path / "reader.db")), 100, 6000, qpd, db)
+    assert limiter.get_today_count()[0] == 0
+    assert limiter.get_history() == [{"date": yesterday, "total_requests": qpd}]
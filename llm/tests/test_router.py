@@ -0,0 +1,171 @@
+"""
+Router de réplicas (autorunner.py) con réplicas falsas: balanceo, failover y afinidad.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import threading
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from autorunner import Backend, Router, start_router, start_stub_backend, sticky_key
+
+class _DropHandler(BaseHTTPRequestHandler):
+    """Réplica que lee la solicitud y corta la conexión sin responder"""
+    received = None
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == "/health":
+            body = b'{"status": "ok"}'
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        self._drop()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self._drop()
+
+    def _drop(self):
+        self.received.append((self.command, self.path))
+        self.close_connection = True
+        self.connection.shutdown(socket.SHUT_RDWR)
+
+def _wait_healthy(router, n):
+    deadline = time.monotonic() + 5
+    while sum(b.healthy for b in router.backends) < n:
+        assert time.monotonic() < deadline, router.status()
+        time.sleep(0.02)
+
+@pytest.fixture
+def cluster():
+    servers, routers = [], []
+
+    def make(*backends):
+        for s in backends:
+            servers.append(s)
+        router, server = start_router(0, [Backend("127.0.0.1", s.server_port) for s in backends])
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        routers.append(router)
+        _wait_healthy(router, len(backends))
+        return router, server.server_port
+
+    yield make
+    for r in routers:
+        r.stop()
+    for s in servers:
+        s.shutdown()
+        s.server_close()
+
+def _request(port, method, path, body=None, headers=None):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    try:
+        conn.request(method, path, body=body, headers=headers or {})
+        resp = conn.getresponse()
+        data = resp.read()
+        return resp.status, json.loads(data) if data else None
+    finally:
+        conn.close()
+
+def _multipart(fields):
+    boundary = "----prueba"
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n')
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="file0"; filename="a.txt"\r\nContent-Type: text/plain\r\n\r\nhola\r\n--{boundary}--\r\n')
+    return "".join(parts).encode("utf-8"), {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+
+def test_least_outstanding_balancing(cluster):
+    a, b = start_stub_backend(0, 0.2), start_stub_backend(0, 0.2)
+    router, port = cluster(a, b)
+
+    with ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(lambda _: _request(port, "POST", "/v1/chat/completions", b"{}"), range(4)))
+
+    assert all(status == 200 for status, _ in results)
+    served = sorted(r["backend"] for _, r in results)
+    assert served == sorted([a.server_port, b.server_port] * 2)
+
+def test_failover_to_healthy_replica(cluster):
+    a, b = start_stub_backend(0, 0.01), start_stub_backend(0, 0.01)
+    router, port = cluster(a, b)
+    a.shutdown()
+    a.server_close()
+
+    for _ in range(3):
+        status, body = _request(port, "GET", "/v1/models")
+        assert status == 200 and body["backend"] == b.server_port
+    assert router.backends[0].healthy is False
+
+def test_post_is_not_retried_after_being_sent(cluster):
+    received = []
+    drop = ThreadingHTTPServer(("127.0.0.1", 0), type("Drop", (_DropHandler,), {"received": received}))
+    drop.daemon_threads = True
+    threading.Thread(target=drop.serve_forever, daemon=True).start()
+    ok = start_stub_backend(0, 0.01)
+    router, port = cluster(drop, ok)
+
+    # La réplica recibió la subida y cortó: repetirla en otra podría duplicarla
+    status, _ = _request(port, "POST", "/v1/rag/ingest", b"x" * 100)
+    assert status == 502
+    assert received == [("POST", "/v1/rag/ingest")]
+
+    # Las solicitudes idempotentes sí se reintentan en otra réplica
+    router.backends[0].healthy = True
+    status, body = _request(port, "GET", "/v1/models")
+    assert status == 200 and body["backend"] == ok.server_port
+    assert received[-1] == ("GET", "/v1/models")
+
+def test_collection_form_field_and_session_affinity(cluster):
+    a, b = start_stub_backend(0, 0.01), start_stub_backend(0, 0.01)
+    router, port = cluster(a, b)
+
+    # La colección va como campo del formulario multipart
+    by_collection = {}
+    for name in ("uno", "dos", "uno", "dos", "uno"):
+        body, headers = _multipart({"collection": name, "sync": "true"})
+        status, r = _request(port, "POST", "/v1/chat/rag", body, headers)
+        assert status == 200
+        by_collection.setdefault(name, set()).add(r["backend"])
+    assert by_collection["uno"] != by_collection["dos"]
+    assert all(len(v) == 1 for v in by_collection.values())
+
+    # Las sesiones nuevas quedan en su réplica y se olvidan al eliminarlas
+    status, session = _request(port, "POST", "/v1/sessions", b"{}")
+    key = f"session:{session['id']}"
+    assert router.sticky[key][0].port == session["backend"]
+    status, r = _request(port, "GET", f"/v1/sessions/{session['id']}")
+    assert r["backend"] == session["backend"]
+    _request(port, "DELETE", f"/v1/sessions/{session['id']}")
+    assert key not in router.sticky
+
+def test_sticky_keys_are_pruned():
+    backends = [Backend("127.0.0.1", 1), Backend("127.0.0.1", 2)]
+    router = Router(backends, sticky_ttl_s=60, sticky_max_keys=3)
+    for i in range(5):
+        router.release(router.pick(f"collection:{i}"))
+    assert list(router.sticky) == ["collection:2", "collection:3", "collection:4"]
+
+    # Las claves sin uso por más de sticky_ttl_s se olvidan
+    router.sticky_ttl_s = 0
+    time.sleep(0.01)
+    router.release(router.pick("collection:nueva"))
+    assert list(router.sticky) == ["collection:nueva"]
+
+def test_sticky_key_reads_collection_from_urlencoded_form():
+    headers = {"Content-Type": "application/x-www-form-urlencoded"}
+    assert sticky_key("POST", "/v1/rag/ingest", {}, headers, b"collection=docs&sync=false") == "collection:docs"
+    assert sticky_key("POST", "/v1/rag/ingest", {}, {"X-Collection": "h"}, b"") == "collection:h"
+    assert sticky_key("POST", "/v1/chat/completions", {}, {}, b"{}") is None
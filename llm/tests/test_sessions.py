@@ -0,0 +1,67 @@
+"""
+Session: token ids incrementales y tokenización completa cuando el límite entre turnos se fusiona.
+"""
+from server.schemas import Message
+from server.sessions import PromptRenderer, Session
+
+class _MergingTokenizer:
+    """
+    Un token por carácter salvo "\\n\\n", que se fusiona en uno solo (como los BPE reales).
+    Sin chat template: se usa el formato alternativo de render_messages.
+    """
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, text, add_special_tokens=False):
+        self.encoded.append(text)
+        ids, i = [], 0
+        while i < len(text):
+            if text.startswith("\n\n", i):
+                ids.append(1000)
+                i += 2
+            else:
+                ids.append(ord(text[i]))
+                i += 1
+        return ids
+
+def _turn(session, content, reply):
+    prompt, pending = session.prepare(content)
+    ids = list(prompt["prompt_token_ids"])
+    session.commit(pending, reply)
+    return ids
+
+def test_session_ids_match_full_tokenization():
+    tok = _MergingTokenizer()
+    renderer = PromptRenderer(tok)
+    assert renderer.generation_suffix == "\nAsistente:"
+    session = Session("s", [Message(role="system", content="sistema")], renderer)
+
+    _turn(session, "hola", "respuesta larga " * 10 + "con salto final\n")
+    history = session.text
+    tok.encoded.clear()
+
+    # El historial termina en "\n" y el turno nuevo empieza con "\n": los ids deben fusionarse
+    ids = _turn(session, "segunda", "ok")
+    full = tok.encode(history + renderer.fragment(Message(role="user", content="segunda")) + renderer.generation_suffix)
+    assert ids == full and 1000 in ids[len(tok.encode(history)) - 1:]
+    assert session.ids == tok.encode(session.text)
+
+    # Sin fusión en el límite solo se tokeniza el turno nuevo junto al final del historial
+    history = session.text
+    tok.encoded.clear()
+    ids = _turn(session, "tercera", "fin")
+    assert max(len(t) for t in tok.encoded) < len(history)
+    full = tok.encode(history + renderer.fragment(Message(role="user", content="tercera")) + renderer.generation_suffix)
+    assert ids == full
+    assert session.ids == tok.encode(session.text)
+
+def test_uncommitted_turn_is_discarded():
+    renderer = PromptRenderer(_MergingTokenizer())
+    session = Session("s", [Message(role="system", content="sistema")], renderer)
+    _turn(session, "hola", "bien")
+    n = session.n_tokens
+
+    session.prepare("se cancela")  # La generación falló: no hay commit
+    assert session.n_tokens == n
+    _turn(session, "otra", "ok")
+    assert session.ids == renderer.encode(session.text)
@@ -0,0 +1,52 @@
+"""
+Log de solicitudes lentas: se escriben con o sin traza (árbol de spans).
+"""
+import json
+import asyncio
+
+from server.tracing import Tracer, TracingMiddleware, span
+
+async def _app(scope, receive, send):
+    delay = 0.1 if scope["path"] == "/lenta" else 0.0
+    with span("trabajo"):
+        await asyncio.sleep(delay)
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+def _call(app, path, headers=()):
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    scope = {"type": "http", "method": "GET", "path": path, "headers": list(headers)}
+    asyncio.run(app(scope, receive, send))
+
+def _read(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def test_slow_requests_are_logged_without_trace(tmp_path):
+    log = tmp_path / "slow.jsonl"
+    tracer = Tracer("header", slow_ms=50, slow_log_path=str(log))
+    app = TracingMiddleware(_app, tracer)
+
+    _call(app, "/rapida")
+    _call(app, "/lenta", [(b"x-request-id", b"abc")])
+    _call(app, "/lenta", [(b"x-trace", b"1"), (b"x-request-id", b"t1")])
+
+    untraced, traced = _read(log)
+    assert untraced["name"] == "GET /lenta" and untraced["id"] == "abc"
+    assert untraced["traced"] is False and untraced["attrs"]["status"] == 200
+    assert untraced["duration_ms"] >= 50
+    # Las solicitudes trazadas conservan el árbol de spans
+    assert traced["id"] == "t1" and traced["children"][0]["name"] == "trabajo"
+    assert tracer.slow_count == 2
+    assert tracer.recent() == [{"id": "t1", "name": "GET /lenta", "created": traced["created"], "duration_ms": traced["duration_ms"]}]
+
+def test_tracing_off_still_logs_slow_requests(tmp_path):
+    log = tmp_path / "slow.jsonl"
+    app = TracingMiddleware(_app, Tracer("off", slow_ms=50, slow_log_path=str(log)))
+    _call(app, "/lenta", [(b"x-trace", b"1")])
+    assert [r["name"] for r in _read(log)] == ["GET /lenta"]
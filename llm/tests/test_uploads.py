@@ -0,0 +1,38 @@
+"""
+ContentHashRegistry compartido por dos réplicas (mismo archivo de hashes).
+"""
+import pytest
+
+pytest.importorskip("fastapi")
+
+from server.uploads import ContentHashRegistry, file_sha256
+
+def test_replicas_do_not_lose_each_other_writes(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "a.txt").write_text("uno")
+    path = str(tmp_path / "col.hashes.json")
+
+    a = ContentHashRegistry(path, str(docs))
+    b = ContentHashRegistry(path, str(docs))
+    digest_a = file_sha256(str(docs / "a.txt"))
+    assert b.lookup(digest_a) == "a.txt"
+
+    (docs / "b.txt").write_text("dos")
+    (docs / "c.txt").write_text("tres")
+    a.add("hb", "b.txt")
+    b.add("hc", "c.txt")  # b relee el archivo antes de escribir: conserva b.txt
+    assert a.lookup("hb") == "b.txt" and a.lookup("hc") == "c.txt"
+
+    # Un nombre sobrescrito con otro contenido invalida su hash anterior
+    a.add("hb2", "b.txt")
+    assert b.lookup("hb") is None and b.lookup("hb2") == "b.txt"
+
+    assert b.remove_name("c.txt")
+    assert a.lookup("hc") is None
+    assert not a.remove_name("c.txt")
+
+    # Un documento borrado a mano deja de contar como duplicado
+    (docs / "a.txt").unlink()
+    assert a.lookup(digest_a) is None
+    assert ContentHashRegistry(path, str(docs)).lookup("hb2") == "b.txt"